@@ -0,0 +1,142 @@
+"""
+Benchmark of concurrent SSE sessions per serving profile.
+
+Starts `cli_use_server start --transport sse` with each profile and opens
+rising numbers of sessions at once. Every session connects to /sse,
+initializes, lists the tools LIST_CALLS times and runs `pwd`, all while the
+other sessions of its level are open. Reported per level are the sessions
+that completed, the time to set up a session (connect and initialize) and to
+answer a request, and requests per second.
+
+Run from apps/mcp/cli_use, optionally with profile arguments such as
+"production --workers 4":
+
+    python benchmarks/serving.py
+    python benchmarks/serving.py production --workers 4
+"""
+
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+SRC = os.path.join(os.path.dirname(__file__), "..", "src")
+
+PROFILES = (["development"], ["production"])
+SESSIONS = (16, 64, 256)
+LIST_CALLS = 5
+SESSION_TIMEOUT = 60
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(profile: list, port: int, allowed_dir: str) -> subprocess.Popen:
+    child = subprocess.Popen(
+        [sys.executable, "-m", "cli_use.cli", "start", "--transport", "sse",
+         "--host", "127.0.0.1", "--port", str(port), "--profile", *profile],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        env={
+            **os.environ,
+            "PYTHONPATH": SRC,
+            "ALLOWED_DIR": allowed_dir,
+            "TEST_MODE": "true",
+            # Not what the benchmark is about
+            "COMMAND_RATE_LIMIT": "0",
+        },
+    )
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/health", timeout=1)
+            return child
+        except OSError:
+            time.sleep(0.2)
+    child.kill()
+    raise RuntimeError(f"Server with profile {' '.join(profile)} did not start")
+
+
+async def session(url: str, opened: asyncio.Barrier, setups: list, latencies: list) -> None:
+    from mcp.client.session import ClientSession
+    from mcp.client.sse import sse_client
+
+    started = time.perf_counter()
+    async with sse_client(url + "/sse") as streams:
+        async with ClientSession(*streams) as client:
+            await client.initialize()
+            setups.append(time.perf_counter() - started)
+            # Hold the session until all of this level are open
+            await opened.wait()
+            for _ in range(LIST_CALLS):
+                sent = time.perf_counter()
+                await client.list_tools()
+                latencies.append(time.perf_counter() - sent)
+            sent = time.perf_counter()
+            result = await client.call_tool("run_command", {"command": "pwd"})
+            latencies.append(time.perf_counter() - sent)
+            if result.isError:
+                raise RuntimeError(result.content[0].text)
+
+
+async def run_level(url: str, sessions: int) -> dict:
+    setups, latencies = [], []
+    opened = asyncio.Barrier(sessions)
+    started = time.perf_counter()
+    results = await asyncio.gather(
+        *(
+            asyncio.wait_for(session(url, opened, setups, latencies), SESSION_TIMEOUT)
+            for _ in range(sessions)
+        ),
+        return_exceptions=True,
+    )
+    elapsed = time.perf_counter() - started
+    setups.sort()
+    latencies.sort()
+
+    def percentile(values: list, fraction: float) -> float:
+        return values[min(int(len(values) * fraction), len(values) - 1)] if values else float("nan")
+
+    return {
+        "completed": sum(1 for result in results if result is None),
+        "setup_p50": percentile(setups, 0.5),
+        "setup_p99": percentile(setups, 0.99),
+        "p50": percentile(latencies, 0.5),
+        "p99": percentile(latencies, 0.99),
+        "throughput": len(latencies) / elapsed,
+    }
+
+
+def main(profiles: list) -> None:
+    print(f"CPUs: {os.cpu_count()}")
+    print(
+        f"{'profile':<24} {'sessions':>8} {'completed':>9} {'setup p50':>10} {'setup p99':>10}"
+        f" {'p50':>9} {'p99':>9} {'requests/s':>10}"
+    )
+    for profile in profiles:
+        with tempfile.TemporaryDirectory() as allowed_dir:
+            port = free_port()
+            child = start_server(profile, port, allowed_dir)
+            try:
+                for sessions in SESSIONS:
+                    result = asyncio.run(run_level(f"http://127.0.0.1:{port}", sessions))
+                    print(
+                        f"{' '.join(profile):<24} {sessions:>8} {result['completed']:>9}"
+                        f" {result['setup_p50'] * 1e3:>8.1f}ms {result['setup_p99'] * 1e3:>8.1f}ms"
+                        f" {result['p50'] * 1e3:>7.1f}ms {result['p99'] * 1e3:>7.1f}ms"
+                        f" {result['throughput']:>10.0f}"
+                    )
+            finally:
+                child.terminate()
+                child.wait()
+
+
+if __name__ == "__main__":
+    main([sys.argv[1:]] if len(sys.argv) > 1 else list(PROFILES))
@@ -0,0 +1,159 @@
+"""
+Benchmark of the stdio transports under bursts of requests.
+
+Starts a child process per transport that answers every request it reads,
+then writes bursts of requests to it at once, as a client that fans out tool
+calls does, and times the responses. Compared are
+
+    pipes      cli_use.stdio.stdio_transport
+    mcp        mcp.server.stdio.stdio_server, a thread per line and a flush per message
+    executor   readline in the default executor and a flush per message, as cli.py did
+
+Run from apps/mcp/cli_use:
+
+    python benchmarks/stdio.py
+"""
+
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+TRANSPORTS = ("pipes", "mcp", "executor")
+BURST = 1000
+BURSTS = 5
+
+
+def executor_transport():
+    """The transport cli.py used, wrapped to yield serve()'s stream pair."""
+    import contextlib
+
+    import anyio
+    import mcp.types as types
+
+    @contextlib.asynccontextmanager
+    async def transport():
+        read_writer, read_stream = anyio.create_memory_object_stream(0)
+        write_stream, write_reader = anyio.create_memory_object_stream(0)
+        loop = asyncio.get_running_loop()
+
+        async def read_messages():
+            async with read_writer:
+                while True:
+                    line = await loop.run_in_executor(None, sys.stdin.readline)
+                    if not line:
+                        break
+                    await read_writer.send(types.JSONRPCMessage.model_validate_json(line))
+
+        async def write_messages():
+            async with write_reader:
+                async for message in write_reader:
+                    sys.stdout.write(message.model_dump_json(by_alias=True, exclude_none=True) + "\n")
+                    sys.stdout.flush()
+                    await asyncio.sleep(0)
+
+        async with anyio.create_task_group() as tg:
+            tg.start_soon(read_messages)
+            tg.start_soon(write_messages)
+            yield read_stream, write_stream
+            tg.cancel_scope.cancel()
+
+    return transport()
+
+
+async def answer(transport_name: str) -> None:
+    """Answers each request with an empty result until stdin ends."""
+    import mcp.server.stdio
+    import mcp.types as types
+
+    from cli_use.stdio import stdio_transport
+
+    transports = {
+        "pipes": stdio_transport,
+        "mcp": mcp.server.stdio.stdio_server,
+        "executor": executor_transport,
+    }
+    async with transports[transport_name]() as (read_stream, write_stream):
+        async for message in read_stream:
+            await write_stream.send(
+                types.JSONRPCMessage(
+                    types.JSONRPCResponse(jsonrpc="2.0", id=message.root.id, result={})
+                )
+            )
+
+
+def run_client(transport_name: str) -> dict:
+    """Sends BURSTS bursts of BURST requests and returns throughput and latencies."""
+    with tempfile.TemporaryDirectory() as allowed_dir:
+        child = subprocess.Popen(
+            [sys.executable, __file__, "--serve", transport_name],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            env={**os.environ, "ALLOWED_DIR": allowed_dir},
+        )
+        # Wait until the child is up before timing
+        child.stdin.write(b'{"jsonrpc": "2.0", "id": -1, "method": "ping"}\n')
+        child.stdin.flush()
+        child.stdout.readline()
+
+        latencies = []
+        started = time.perf_counter()
+        for burst in range(BURSTS):
+            sent = {}
+            requests = b"".join(
+                json.dumps({"jsonrpc": "2.0", "id": burst * BURST + i, "method": "ping"}).encode()
+                + b"\n"
+                for i in range(BURST)
+            )
+
+            def write() -> None:
+                now = time.perf_counter()
+                for i in range(BURST):
+                    sent[burst * BURST + i] = now
+                child.stdin.write(requests)
+                child.stdin.flush()
+
+            writer = threading.Thread(target=write)
+            writer.start()
+            for _ in range(BURST):
+                response = json.loads(child.stdout.readline())
+                latencies.append(time.perf_counter() - sent[response["id"]])
+            writer.join()
+        elapsed = time.perf_counter() - started
+        child.stdin.close()
+        try:
+            child.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            # mcp's stdio_server does not return when stdin ends
+            child.kill()
+            child.wait()
+
+    latencies.sort()
+    return {
+        "throughput": BURST * BURSTS / elapsed,
+        "p50": latencies[len(latencies) // 2],
+        "p99": latencies[int(len(latencies) * 0.99)],
+    }
+
+
+def main() -> None:
+    print(f"{'transport':<12} {'messages/s':>12} {'p50':>10} {'p99':>10}")
+    for name in TRANSPORTS:
+        result = run_client(name)
+        print(
+            f"{name:<12} {result['throughput']:>12.0f}"
+            f" {result['p50'] * 1e3:>8.2f}ms {result['p99'] * 1e3:>8.2f}ms"
+        )
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 3 and sys.argv[1] == "--serve":
+        asyncio.run(answer(sys.argv[2]))
+    else:
+        main()
@@ -0,0 +1,84 @@
+"""
+Microbenchmark of command validation with and without the verdict cache, and
+of path resolution with and without the path cache.
+
+Run from apps/mcp/cli_use:
+
+    python benchmarks/validation.py
+"""
+
+import asyncio
+import os
+import sys
+import tempfile
+import time
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+DEEP_PATH = "services/api/src/main/python/handlers/v2/users/profile.py"
+
+COMMANDS = [
+    "ls -l -a",
+    "git status",
+    "cat README.md",
+    "ls -l src/cli_use",
+    "git status && git diff --stat | head -n 20",
+    f"cat {DEEP_PATH}",
+]
+
+NUMBER = 20000
+
+
+def resolve_paths(resolver_class, root: str) -> None:
+    """Times resolving DEEP_PATH with os.path.realpath and through PathResolver."""
+    plain = resolver_class(root, max_entries=0)
+    checked = resolver_class(root)
+    watched = resolver_class(root)
+
+    async def timed_watched() -> float:
+        watched.start()
+        try:
+            return timeit.timeit(lambda: watched.resolve(DEEP_PATH), number=NUMBER)
+        finally:
+            watched.stop()
+
+    timings = [
+        ("realpath", timeit.timeit(lambda: plain.resolve(DEEP_PATH), number=NUMBER)),
+        ("cached, checked on use", timeit.timeit(lambda: checked.resolve(DEEP_PATH), number=NUMBER)),
+        ("cached, inotify", asyncio.run(timed_watched())),
+    ]
+    print(f"\n{'resolving ' + DEEP_PATH:<70} {'time':>10}")
+    for name, seconds in timings:
+        print(f"{name:<70} {seconds / NUMBER * 1e6:>8.2f}us")
+
+
+def main() -> None:
+    with tempfile.TemporaryDirectory() as allowed_dir:
+        os.environ["ALLOWED_DIR"] = allowed_dir
+        os.environ["ALLOWED_COMMANDS"] = "ls,git,cat,head"
+        os.environ["ALLOWED_FLAGS"] = "-l,-a,-n,--stat"
+        os.environ["ALLOW_SHELL_OPERATORS"] = "true"
+        os.makedirs(os.path.join(allowed_dir, os.path.dirname(DEEP_PATH)))
+        # Directories changed within the last second are not cached
+        time.sleep(1.1)
+
+        from cli_use.paths import PathResolver
+        from cli_use.policy import VerdictCache
+        from cli_use.server import executor
+
+        print(f"{'command':<70} {'uncached':>10} {'cached':>10} {'speedup':>8}")
+        for command in COMMANDS:
+            executor.verdicts = VerdictCache(0)
+            uncached = timeit.timeit(lambda: executor.validate_command(command), number=NUMBER)
+            executor.verdicts = VerdictCache()
+            cached = timeit.timeit(lambda: executor.validate_command(command), number=NUMBER)
+            print(
+                f"{command:<70} {uncached / NUMBER * 1e6:>8.2f}us {cached / NUMBER * 1e6:>8.2f}us"
+                f" {uncached / cached:>7.1f}x"
+            )
+        resolve_paths(PathResolver, allowed_dir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,265 @@
+"""
+Admission control in front of command execution.
+
+Every session has a token bucket that refills at rate commands per second up
+to burst; a command is refused while its session's bucket is empty, so one
+client cannot flood the server. Admitted commands then wait for one of
+max_concurrent execution slots. Free slots go to the waiting sessions in turn
+by start-time fair queuing: each session's commands are tagged with the
+virtual time at which the session's previous share ends, and the smallest
+tag runs next. A session with many queued commands therefore gets its share
+of the slots, not all of them, and a session that was idle gets the next
+slot without waiting behind the backlog of another.
+
+Refusals raise AdmissionRejected with the number of seconds after which a
+retry can succeed.
+"""
+
+import asyncio
+import contextlib
+import heapq
+import time
+from collections import deque
+from typing import Any, AsyncIterator, Callable, Deque, Dict, Hashable, List, Tuple
+
+# Share of a background job relative to a command the client waits for
+BACKGROUND_WEIGHT = 0.25
+
+# Recent waits kept for the percentiles in stats()
+WAIT_SAMPLES = 1024
+
+
+class AdmissionRejected(Exception):
+    """A command was refused for now and may be retried after retry_after seconds"""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(f"{message}, retry after {retry_after:.1f} seconds")
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """
+    Allows rate events per second on average and bursts of up to burst events.
+    """
+
+    def __init__(self, rate: float, burst: float, clock: Callable[[], float] = time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self.clock = clock
+        self.tokens = burst
+        self._updated = clock()
+
+    def _refill(self) -> None:
+        now = self.clock()
+        self.tokens = min(self.burst, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def take(self, tokens: float = 1.0) -> float:
+        """
+        Takes tokens if the bucket holds them.
+
+        Returns 0 if they were taken, otherwise the seconds until they will be there.
+        """
+        self._refill()
+        if self.tokens >= tokens:
+            self.tokens -= tokens
+            return 0.0
+        return (tokens - self.tokens) / self.rate
+
+    def full(self) -> bool:
+        self._refill()
+        return self.tokens >= self.burst
+
+
+class _Flow:
+    """Commands of one session that are waiting or running"""
+
+    __slots__ = ("finish", "waiting", "running")
+
+    def __init__(self) -> None:
+        # Virtual time at which the session's last queued command's share ends
+        self.finish = 0.0
+        self.waiting = 0
+        self.running = 0
+
+
+class AdmissionController:
+    """
+    Per-session rate limits and fair sharing of max_concurrent execution slots.
+
+    A rate of 0 disables rate limiting; max_queued_per_session bounds how many
+    commands of one session may wait for a slot at once.
+    """
+
+    def __init__(
+        self,
+        max_concurrent: int,
+        rate: float = 0.0,
+        burst: float = 1.0,
+        max_queued_per_session: int = 32,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.max_concurrent = max(1, max_concurrent)
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self.max_queued_per_session = max(1, max_queued_per_session)
+        self.clock = clock
+        self._buckets: Dict[Hashable, TokenBucket] = {}
+        self._bucket_limit = 64
+        self._flows: Dict[Hashable, _Flow] = {}
+        # (start tag, sequence, session, future) of waiting commands
+        self._queue: List[Tuple[float, int, Hashable, asyncio.Future]] = []
+        self._sequence = 0
+        self._virtual_time = 0.0
+        self.running = 0
+        self.waiting = 0
+        self._counters = {"admitted": 0, "rate_limited": 0, "queue_full": 0}
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._waits: Deque[float] = deque(maxlen=WAIT_SAMPLES)
+        # Moving average of how long commands hold a slot, to estimate retry times
+        self._run_time = 1.0
+
+    def check(self, session: Hashable, cost: float = 1.0) -> None:
+        """
+        Charges cost commands to the session's rate limit.
+
+        Raises:
+            AdmissionRejected: If the session used up its rate limit.
+        """
+        if self.rate <= 0:
+            return
+        bucket = self._buckets.get(session)
+        if bucket is None:
+            bucket = self._buckets[session] = TokenBucket(self.rate, self.burst, self.clock)
+            self._prune_buckets()
+        # A batch larger than the burst is allowed once the bucket is full
+        wait = bucket.take(min(cost, self.burst))
+        if wait > 0:
+            self._counters["rate_limited"] += 1
+            raise AdmissionRejected(
+                f"Rate limit of {self.rate:g} commands per second exceeded", wait
+            )
+
+    @contextlib.asynccontextmanager
+    async def slot(self, session: Hashable, weight: float = 1.0) -> AsyncIterator[None]:
+        """
+        Holds an execution slot, waiting for the session's turn if all are taken.
+
+        Raises:
+            AdmissionRejected: If max_queued_per_session commands of the session
+                are already waiting.
+        """
+        flow = self._flows.get(session)
+        if flow is None:
+            flow = self._flows[session] = _Flow()
+        if flow.waiting >= self.max_queued_per_session:
+            self._counters["queue_full"] += 1
+            self._forget(session, flow)
+            raise AdmissionRejected(
+                f"{flow.waiting} commands of this session are already waiting to run",
+                self._run_time * (self.waiting + 1) / self.max_concurrent,
+            )
+
+        start = max(self._virtual_time, flow.finish)
+        flow.finish = start + 1.0 / weight
+        queued_at = self.clock()
+        if self.running < self.max_concurrent and not self.waiting:
+            self._virtual_time = start
+            self._dispatched(flow)
+            self._record_wait(0.0)
+        else:
+            await self._wait(session, flow, start)
+            self._record_wait(self.clock() - queued_at)
+
+        started = self.clock()
+        try:
+            yield
+        finally:
+            self._run_time += 0.1 * (self.clock() - started - self._run_time)
+            self.running -= 1
+            flow.running -= 1
+            self._forget(session, flow)
+            self._dispatch_next()
+
+    async def _wait(self, session: Hashable, flow: _Flow, start: float) -> None:
+        future = asyncio.get_running_loop().create_future()
+        self._sequence += 1
+        heapq.heappush(self._queue, (start, self._sequence, session, future))
+        flow.waiting += 1
+        self.waiting += 1
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # The slot was granted as the waiter was cancelled, pass it on
+                self.running -= 1
+                flow.running -= 1
+                self._forget(session, flow)
+                self._dispatch_next()
+            else:
+                future.cancel()
+                flow.waiting -= 1
+                self.waiting -= 1
+                self._forget(session, flow)
+            raise
+
+    def _dispatched(self, flow: _Flow) -> None:
+        self.running += 1
+        flow.running += 1
+        self._counters["admitted"] += 1
+
+    def _dispatch_next(self) -> None:
+        while self._queue and self.running < self.max_concurrent:
+            start, _, session, future = heapq.heappop(self._queue)
+            if future.done():
+                continue
+            flow = self._flows[session]
+            flow.waiting -= 1
+            self.waiting -= 1
+            self._virtual_time = max(self._virtual_time, start)
+            self._dispatched(flow)
+            future.set_result(None)
+
+    def _forget(self, session: Hashable, flow: _Flow) -> None:
+        # An idle session keeps no share beyond the current virtual time
+        if not flow.waiting and not flow.running and flow.finish <= self._virtual_time:
+            self._flows.pop(session, None)
+        # Sessions that went idle ahead of it are dropped now and then
+        if len(self._flows) > 2 * (self.running + self.waiting) + 64:
+            self._flows = {
+                session: flow
+                for session, flow in self._flows.items()
+                if flow.waiting or flow.running
+            }
+
+    def _prune_buckets(self) -> None:
+        # Full buckets are the same as new ones, drop them now and then
+        if len(self._buckets) > self._bucket_limit:
+            for session in [s for s, bucket in self._buckets.items() if bucket.full()]:
+                del self._buckets[session]
+            self._bucket_limit = 2 * len(self._buckets) + 64
+
+    def _record_wait(self, wait: float) -> None:
+        self._wait_total += wait
+        self._wait_max = max(self._wait_max, wait)
+        self._waits.append(wait)
+
+    def stats(self) -> Dict[str, Any]:
+        waits = sorted(self._waits)
+
+        def percentile(fraction: float) -> float:
+            if not waits:
+                return 0.0
+            return waits[min(len(waits) - 1, int(fraction * len(waits)))]
+
+        return {
+            "running": self.running,
+            "queued": self.waiting,
+            "sessions_queued": sum(1 for flow in self._flows.values() if flow.waiting),
+            **self._counters,
+            "wait_seconds_total": round(self._wait_total, 6),
+            "wait_seconds_max": round(self._wait_max, 6),
+            "wait_seconds_p50": round(percentile(0.5), 6),
+            "wait_seconds_p99": round(percentile(0.99), 6),
+        }
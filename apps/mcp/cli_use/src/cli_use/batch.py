@@ -0,0 +1,146 @@
+"""
+Batched execution of several commands in one tool call.
+
+A batch is a list of commands, each with an id and optional depends_on ids.
+All commands are validated before any of them runs. Independent commands run
+in parallel up to a limit; a command starts once all of its dependencies
+finished with return code 0 and is skipped if any of them did not.
+"""
+
+import asyncio
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List
+
+BATCH_OK = "ok"
+BATCH_FAILED = "failed"
+BATCH_ERROR = "error"
+BATCH_SKIPPED = "skipped"
+
+
+class BatchError(Exception):
+    """A batch is malformed, e.g. it has unknown or cyclic dependencies"""
+
+    pass
+
+
+@dataclass
+class BatchCommand:
+    """One command of a batch"""
+
+    id: str
+    command: str
+    depends_on: List[str] = field(default_factory=list)
+
+
+def parse_batch(entries: List[Any], max_commands: int) -> List[BatchCommand]:
+    """
+    Parses the commands argument of run_commands.
+
+    Entries are either command strings or objects with "command" and optional
+    "id" and "depends_on" keys. Ids default to the entry's position.
+
+    Raises:
+        BatchError: If the batch is empty, too large, has duplicate ids, or
+            dependencies that are unknown or form a cycle.
+    """
+    if not isinstance(entries, list) or not entries:
+        raise BatchError("commands must be a non-empty list")
+    if len(entries) > max_commands:
+        raise BatchError(f"A batch may contain at most {max_commands} commands")
+
+    commands: List[BatchCommand] = []
+    for index, entry in enumerate(entries):
+        if isinstance(entry, str):
+            entry = {"command": entry}
+        if not isinstance(entry, dict) or not isinstance(entry.get("command"), str):
+            raise BatchError(f"Entry {index} has no command")
+        depends_on = entry.get("depends_on") or []
+        if not isinstance(depends_on, list):
+            raise BatchError(f"depends_on of entry {index} must be a list of ids")
+        commands.append(
+            BatchCommand(
+                id=str(entry.get("id", index)),
+                command=entry["command"],
+                depends_on=[str(dependency) for dependency in depends_on],
+            )
+        )
+
+    by_id = {command.id: command for command in commands}
+    if len(by_id) != len(commands):
+        raise BatchError("Command ids must be unique")
+    for command in commands:
+        for dependency in command.depends_on:
+            if dependency not in by_id:
+                raise BatchError(f"Command '{command.id}' depends on unknown id '{dependency}'")
+
+    # Depth-first search for cycles
+    state: Dict[str, int] = {}
+
+    def visit(command_id: str) -> None:
+        state[command_id] = 1
+        for dependency in by_id[command_id].depends_on:
+            if state.get(dependency) == 1:
+                raise BatchError(f"Dependency cycle involving '{dependency}'")
+            if dependency not in state:
+                visit(dependency)
+        state[command_id] = 2
+
+    for command in commands:
+        if command.id not in state:
+            visit(command.id)
+    return commands
+
+
+async def run_batch(
+    commands: List[BatchCommand],
+    execute: Callable[[str], Awaitable[Any]],
+    max_parallel: int,
+) -> List[Dict[str, Any]]:
+    """
+    Runs parsed batch commands and returns one result dict per command, in order.
+
+    execute is awaited with a command string and returns a CommandResult; any
+    exception it raises is reported as an error result of that command.
+    """
+    limit = asyncio.Semaphore(max(1, max_parallel))
+    loop = asyncio.get_running_loop()
+    # Commands may wait for the results of commands that come later in the list
+    results: Dict[str, asyncio.Future] = {command.id: loop.create_future() for command in commands}
+
+    async def run(command: BatchCommand) -> Dict[str, Any]:
+        result: Dict[str, Any] = {"id": command.id, "command": command.command}
+        dependencies = [await results[dependency] for dependency in command.depends_on]
+        unmet = [dependency["id"] for dependency in dependencies if dependency["status"] != BATCH_OK]
+        if unmet:
+            result["status"] = BATCH_SKIPPED
+            result["error"] = f"Dependencies did not succeed: {', '.join(unmet)}"
+            return result
+
+        async with limit:
+            try:
+                outcome = await execute(command.command)
+            except Exception as e:
+                result["status"] = BATCH_ERROR
+                result["error"] = str(e)
+                return result
+
+        result["status"] = BATCH_OK if outcome.returncode == 0 else BATCH_FAILED
+        result["returncode"] = outcome.returncode
+        result["stdout"] = outcome.stdout
+        result["stderr"] = outcome.stderr
+        if outcome.output_id:
+            result["output_id"] = outcome.output_id
+        if outcome.usage is not None:
+            result["usage"] = outcome.usage.as_dict()
+        return result
+
+    async def run_and_publish(command: BatchCommand) -> Dict[str, Any]:
+        try:
+            result = await run(command)
+        except BaseException:
+            results[command.id].cancel()
+            raise
+        results[command.id].set_result(result)
+        return result
+
+    return list(await asyncio.gather(*(run_and_publish(command) for command in commands)))
@@ -0,0 +1,338 @@
+"""
+Result cache for read-only commands.
+
+Agents tend to run the same `ls -l`, `cat README.md` or `pwd` over and over.
+Results of commands configured as cacheable are kept in an LRU cache bounded by
+a byte budget. Entries are keyed by the command's argv and the stat identity of
+the paths it reads, and are dropped as soon as inotify reports a change at or
+below one of those paths. Without a working inotify watch the cache stays off,
+since there is no other cheap way to notice changes deeper in a directory.
+"""
+
+import asyncio
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import struct
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Events that can change what a read-only command prints
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = (
+    IN_MODIFY
+    | IN_ATTRIB
+    | IN_CLOSE_WRITE
+    | IN_MOVED_FROM
+    | IN_MOVED_TO
+    | IN_CREATE
+    | IN_DELETE
+    | IN_DELETE_SELF
+    | IN_MOVE_SELF
+    | IN_ONLYDIR
+    | IN_DONT_FOLLOW
+)
+
+EVENT_HEADER = struct.Struct("iIII")
+
+# Directory trees with more subdirectories than this are not watched
+MAX_WATCHED_DIRECTORIES = 8192
+
+# Fixed per-entry overhead counted against the byte budget
+ENTRY_OVERHEAD = 256
+
+
+class InotifyWatcher:
+    """
+    Recursively watches a directory tree with inotify.
+
+    on_change is called with the absolute path of every changed file or
+    directory, or with the root itself when events were lost. New
+    subdirectories are watched as they appear.
+    """
+
+    def __init__(self, root: str, on_change: Callable[[str], None]):
+        self.root = root
+        self.on_change = on_change
+        self._fd = -1
+        self._libc = None
+        self._paths: Dict[int, str] = {}
+        self._watches: Dict[str, int] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    @property
+    def running(self) -> bool:
+        return self._fd >= 0
+
+    def start(self) -> None:
+        """
+        Sets up the watches and registers with the running event loop.
+
+        Raises:
+            OSError: If inotify is unavailable or the tree is too large to watch.
+        """
+        if self.running:
+            return
+        libc_name = ctypes.util.find_library("c")
+        self._libc = ctypes.CDLL(libc_name, use_errno=True)
+        if not hasattr(self._libc, "inotify_init1"):
+            raise OSError(errno.ENOSYS, "inotify is not available on this platform")
+        fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            code = ctypes.get_errno()
+            raise OSError(code, os.strerror(code))
+        self._fd = fd
+        try:
+            self._watch_tree(self.root)
+            self._loop = asyncio.get_running_loop()
+            self._loop.add_reader(self._fd, self._read_events)
+        except BaseException:
+            self.stop()
+            raise
+
+    def stop(self) -> None:
+        if not self.running:
+            return
+        if self._loop is not None:
+            self._loop.remove_reader(self._fd)
+            self._loop = None
+        os.close(self._fd)
+        self._fd = -1
+        self._paths.clear()
+        self._watches.clear()
+
+    def is_watching(self, directory: str) -> bool:
+        return directory in self._watches
+
+    def poll(self) -> None:
+        """Handles the events that are already queued, without waiting for the event loop."""
+        while self.running and self._read_events():
+            pass
+
+    def _watch_tree(self, top: str) -> None:
+        for directory, subdirectories, _ in os.walk(top):
+            self._add_watch(directory)
+            # os.walk does not follow symlinks, and neither do the watches
+            subdirectories[:] = [
+                name for name in subdirectories if not os.path.islink(os.path.join(directory, name))
+            ]
+
+    def _add_watch(self, path: str) -> None:
+        if len(self._paths) >= MAX_WATCHED_DIRECTORIES:
+            raise OSError(errno.ENOSPC, f"More than {MAX_WATCHED_DIRECTORIES} directories to watch")
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            code = ctypes.get_errno()
+            # The directory may already be gone again
+            if code in (errno.ENOENT, errno.ENOTDIR):
+                return
+            raise OSError(code, f"{os.strerror(code)}: {path}")
+        self._paths[wd] = path
+        self._watches[path] = wd
+
+    def _read_events(self) -> bool:
+        try:
+            data = os.read(self._fd, 65536)
+        except BlockingIOError:
+            return False
+        offset = 0
+        while offset + EVENT_HEADER.size <= len(data):
+            wd, mask, _, name_length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset : offset + name_length].rstrip(b"\0")
+            offset += name_length
+
+            if mask & IN_Q_OVERFLOW:
+                self.on_change(self.root)
+                continue
+            directory = self._paths.get(wd)
+            if directory is None:
+                continue
+            if mask & IN_IGNORED:
+                del self._paths[wd]
+                if self._watches.get(directory) == wd:
+                    del self._watches[directory]
+                continue
+            path = os.path.join(directory, os.fsdecode(name)) if name else directory
+            if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                try:
+                    self._watch_tree(path)
+                except OSError as e:
+                    logger.warning(f"Stopped watching new directory {path}: {str(e)}")
+                    self.on_change(self.root)
+            self.on_change(path)
+        return True
+
+
+@dataclass
+class CachedResult:
+    """Output of a cached command run"""
+
+    returncode: int
+    stdout: str
+    stderr: str
+    dependencies: Tuple[str, ...]
+    size: int
+
+
+def path_identity(path: str) -> Optional[Tuple[int, int, int, int]]:
+    """Returns the (device, inode, mtime, size) of a path, or None if it does not exist."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_dev, st.st_ino, st.st_mtime_ns, st.st_size)
+
+
+class ResultCache:
+    """
+    LRU cache of command results bounded by max_bytes.
+
+    Only serves results while the inotify watch on root is running. Call
+    invalidate() for a changed path to drop every entry that depends on the
+    path, one of its ancestors or one of its descendants.
+    """
+
+    def __init__(self, root: str, commands: set[str], max_bytes: int):
+        self.root = root
+        self.commands = commands
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.generation = 0
+        self._bytes = 0
+        self._entries: "OrderedDict[tuple, CachedResult]" = OrderedDict()
+        self.watcher = InotifyWatcher(root, self.invalidate)
+
+    @property
+    def active(self) -> bool:
+        return self.watcher.running
+
+    def start(self) -> None:
+        """Starts watching root. The cache stays disabled if that is not possible."""
+        try:
+            self.watcher.start()
+        except OSError as e:
+            logger.warning(f"Result cache disabled, cannot watch {self.root}: {str(e)}")
+
+    def stop(self) -> None:
+        self.watcher.stop()
+        self.clear()
+
+    def key_for(self, command: str, args: List[str]) -> Optional[tuple]:
+        """
+        Builds the cache key of a validated command, or None if it is not cacheable.
+
+        Every non-flag argument that resolves to an existing path, or to a missing
+        one inside root, is treated as a dependency. A command without such
+        arguments depends on the working directory.
+        """
+        if not self.active or command not in self.commands:
+            return None
+        dependencies = []
+        for arg in args:
+            if arg.startswith("-"):
+                continue
+            path = os.path.realpath(os.path.join(self.root, arg))
+            if path != self.root and not path.startswith(self.root + os.sep):
+                if os.path.lexists(path):
+                    # Outside the watched tree, so changes would go unnoticed
+                    return None
+                continue
+            dependencies.append(path)
+        if not dependencies:
+            dependencies.append(self.root)
+        identities = tuple(path_identity(path) for path in dependencies)
+        return (command, tuple(args), tuple(dependencies), identities)
+
+    def get(self, key: tuple) -> Optional[CachedResult]:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def put(self, key: tuple, returncode: int, stdout: str, stderr: str, generation: int) -> None:
+        """
+        Stores a result computed while the cache was at the given generation.
+
+        Results are discarded if anything was invalidated while the command ran,
+        since they may reflect a state that is already gone.
+        """
+        if not self.active or generation != self.generation:
+            return
+        size = len(stdout) + len(stderr) + ENTRY_OVERHEAD
+        if size > self.max_bytes:
+            return
+        self._remove(key)
+        self._entries[key] = CachedResult(returncode, stdout, stderr, key[2], size)
+        self._bytes += size
+        while self._bytes > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def invalidate(self, path: str) -> None:
+        self.generation += 1
+        stale = [
+            key
+            for key, entry in self._entries.items()
+            if any(_paths_overlap(path, dependency) for dependency in entry.dependencies)
+        ]
+        for key in stale:
+            self._remove(key)
+        self.invalidations += len(stale)
+
+    def _remove(self, key: tuple) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry.size
+
+    def clear(self) -> None:
+        self.generation += 1
+        self._entries.clear()
+        self._bytes = 0
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "enabled": self.active,
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
+
+
+def _paths_overlap(first: str, second: str) -> bool:
+    """True if the paths are equal or one is inside the other."""
+    if first == second:
+        return True
+    shorter, longer = sorted((first, second), key=len)
+    return longer.startswith(shorter.rstrip(os.sep) + os.sep)
@@ -0,0 +1,145 @@
+"""
+Cancellation of in-flight tool calls.
+
+MCP clients abort a request by sending notifications/cancelled with its id.
+The ServerSession of the mcp package handles these by cancelling the
+handler's scope and then fails on the response the handler still sends,
+which tears down the whole connection. serve() therefore takes these
+notifications off the connection before the session sees them and cancels
+the matching call registered with InFlightCalls. The call's command is then
+stopped through the usual asyncio cancellation of its task.
+"""
+
+import asyncio
+import contextvars
+import logging
+from typing import Any, Awaitable, Dict, Optional, TypeVar
+
+import anyio
+import mcp.types as types
+from mcp.server.lowlevel import Server
+
+from .connection import bind_connection
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+CANCELLED_METHOD = "notifications/cancelled"
+
+
+class CallCancelledError(Exception):
+    """The client cancelled the tool call"""
+
+    pass
+
+
+class InFlightCalls:
+    """
+    The cancellable tool calls of one connection, by request id.
+    """
+
+    def __init__(self) -> None:
+        self._tasks: Dict[Any, asyncio.Task] = {}
+        self.cancelled = 0
+
+    def __len__(self) -> int:
+        return len(self._tasks)
+
+    async def run(self, request_id: Any, coroutine: Awaitable[T]) -> T:
+        """
+        Runs coroutine as the work of request request_id and returns its result.
+
+        Raises:
+            CallCancelledError: If the client cancelled the request meanwhile.
+        """
+        task = asyncio.ensure_future(coroutine)
+        self._tasks[request_id] = task
+        try:
+            await asyncio.wait([task])
+        except asyncio.CancelledError:
+            # The handler itself was cancelled, e.g. because the connection closed
+            task.cancel()
+            raise
+        finally:
+            if self._tasks.get(request_id) is task:
+                del self._tasks[request_id]
+        if task.cancelled():
+            raise CallCancelledError(f"Request {request_id} was cancelled by the client")
+        return task.result()
+
+    def cancel(self, request_id: Any) -> bool:
+        """Cancels the call of request_id. Returns False if there is none."""
+        task = self._tasks.get(request_id)
+        if task is None or task.done():
+            return False
+        task.cancel()
+        self.cancelled += 1
+        return True
+
+    def intercept(self, message: Any) -> bool:
+        """
+        Handles message if it is a cancellation notification.
+
+        Returns True if the message was consumed and must not reach the session.
+        """
+        if not isinstance(message, types.JSONRPCMessage):
+            return False
+        notification = message.root
+        if not isinstance(notification, types.JSONRPCNotification):
+            return False
+        if notification.method != CANCELLED_METHOD:
+            return False
+        request_id = (notification.params or {}).get("requestId")
+        if self.cancel(request_id):
+            logger.info(f"Cancelled tool call {request_id}")
+        else:
+            logger.debug(f"Ignoring cancellation of request {request_id}, it is not running")
+        return True
+
+
+_current_calls: contextvars.ContextVar[Optional[InFlightCalls]] = contextvars.ContextVar(
+    "cli_use_in_flight_calls", default=None
+)
+
+
+def current_calls() -> Optional[InFlightCalls]:
+    """The calls of the connection being served, if any."""
+    return _current_calls.get()
+
+
+async def serve(
+    server: Server,
+    read_stream: Any,
+    write_stream: Any,
+    initialization_options: Any,
+    raise_exceptions: bool = False,
+) -> None:
+    """
+    Runs server on one connection, routing cancellations to InFlightCalls.
+
+    Handlers of this connection find its InFlightCalls through current_calls()
+    and its ConnectionContext through connection.current_connection().
+    """
+    calls = InFlightCalls()
+    send_stream, receive_stream = anyio.create_memory_object_stream(0)
+
+    async def forward() -> None:
+        async with send_stream:
+            async for message in read_stream:
+                if not calls.intercept(message):
+                    await send_stream.send(message)
+        # The client is gone once its input ends, but Server.run keeps waiting
+        tg.cancel_scope.cancel()
+
+    token = _current_calls.set(calls)
+    try:
+        with bind_connection():
+            async with anyio.create_task_group() as tg:
+                tg.start_soon(forward)
+                await server.run(
+                    receive_stream, write_stream, initialization_options, raise_exceptions
+                )
+                tg.cancel_scope.cancel()
+    finally:
+        _current_calls.reset(token)
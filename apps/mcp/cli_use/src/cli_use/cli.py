@@ -4,41 +4,44 @@ Command-line interface for cli_use.
 
 import os
 import click
+import shutil
+import anyio
 import asyncio
 import logging
+import tempfile
 import uvicorn
 from starlette.applications import Starlette
-from starlette.routing import Route
-from starlette.responses import JSONResponse, StreamingResponse
-from typing import Dict, Any, Optional
-import sys
+from starlette.routing import BaseRoute, Mount, Route
+from starlette.responses import JSONResponse, Response
+from typing import List, Optional
 
-from mcp.server.lowlevel import Server
+from mcp.server.lowlevel import NotificationOptions, Server
 from mcp.server.sse import SseServerTransport
 
-from .server import server, executor
+from .cancellation import serve
+from .server import auth_validator, server, executor, state_backend
+from .serving import (
+    DEBUG_ENV,
+    LOG_LEVEL_ENV,
+    RUN_DIR_ENV,
+    SERVING_PROFILES,
+    ServingProfile,
+    WorkerRouter,
+    serving_profile,
+)
+from .sessions import DEFAULT_MAX_SESSIONS, DEFAULT_SESSION_IDLE_TIMEOUT
+from .stdio import stdio_transport
+from .streamable_http import DEFAULT_REPLAY_EVENTS, StreamableHTTPTransport
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-
-class AsyncStdinReader:
-    """Async wrapper for stdin."""
-
-    async def receive(self) -> bytes:
-        line = await asyncio.get_event_loop().run_in_executor(None, sys.stdin.readline)
-        return line.encode()
-
-
-class AsyncStdoutWriter:
-    """Async wrapper for stdout."""
-
-    async def send(self, data: bytes) -> None:
-        text = data.decode()
-        sys.stdout.write(text)
-        sys.stdout.flush()
-        await asyncio.sleep(0)  # Yield control back to the event loop
+# Builds the app of one worker, by HTTP transport
+APP_FACTORIES = {
+    "sse": "cli_use.cli:create_sse_app",
+    "streamable-http": "cli_use.cli:create_streamable_http_app",
+}
 
 
 @click.group()
@@ -48,16 +51,43 @@ def cli():
 
 
 @cli.command()
-@click.option("--port", default=8003, help="Port to listen on for SSE")
+@click.option("--port", default=8003, help="Port to listen on for HTTP transports")
 @click.option(
     "--transport",
-    type=click.Choice(["stdio", "sse"]),
+    type=click.Choice(["stdio", *APP_FACTORIES]),
     default="stdio",
     help="Transport type",
 )
+@click.option(
+    "--profile",
+    type=click.Choice(sorted(SERVING_PROFILES)),
+    default="development",
+    help="Serving profile of the HTTP transports",
+)
+@click.option("--host", default="0.0.0.0", help="Address to listen on for HTTP transports")
+@click.option("--workers", type=int, help="Worker processes (production: one per CPU)")
+@click.option(
+    "--loop",
+    type=click.Choice(["auto", "asyncio", "uvloop"]),
+    help="Event loop, auto uses uvloop if installed",
+)
+@click.option(
+    "--http",
+    type=click.Choice(["auto", "h11", "httptools"]),
+    help="HTTP parser, auto uses httptools if installed",
+)
+@click.option("--backlog", type=int, help="Connections waiting to be accepted at most")
+@click.option("--keep-alive", type=int, help="Seconds an idle connection is kept open")
 def start(
     port: int,
     transport: str,
+    profile: str,
+    host: str,
+    workers: Optional[int],
+    loop: Optional[str],
+    http: Optional[str],
+    backlog: Optional[int],
+    keep_alive: Optional[int],
 ) -> int:
     """Start the CLI MCP server."""
     
@@ -69,95 +99,239 @@ def start(
         return asyncio.run(_run_stdio(server))
 
     else:
-        return asyncio.run(_run_sse(port))
+        return _run_http(
+            transport,
+            host,
+            port,
+            serving_profile(
+                profile,
+                workers=workers,
+                loop=loop,
+                http=http,
+                backlog=backlog,
+                keep_alive=keep_alive,
+            ),
+        )
 
 
-async def _run_sse(port: int) -> int:
-    """Run the server using SSE transport."""
-    try:
-        # Set up Starlette app for SSE transport using standard MCP SSE transport
+def create_sse_app() -> Starlette:
+    """
+    Builds the SSE application of one worker, see _run_http.
+    """
+    router = _worker_router()
+    if router is not None:
+        # Several workers, messages may arrive at any of them
+        sse = SseServerTransport(f"/messages/{router.worker}/")
+        handle_post_message = router.route_messages(sse.handle_post_message)
+    else:
         sse = SseServerTransport("/messages/")
-
-        async def handle_sse(request):
-            """Handle SSE connections using mcp.server.sse."""
-            logger.info(f"New SSE connection from {request.client}")
-            try:
-                async with sse.connect_sse(
-                    request.scope, request.receive, request._send
-                ) as streams:
-                    # Run the MCP server with the streams
-                    await server.run(
-                        streams[0], streams[1], server.create_initialization_options()
-                    )
-            except Exception as e:
-                logger.error(f"Error in handle_sse: {str(e)}")
-                raise
-            finally:
-                logger.info(f"SSE connection from {request.client} closed")
-
-        async def health_check(request):
-            """Health check endpoint."""
-            try:
-                return JSONResponse({"status": "healthy", "allowed_dir": executor.allowed_dir})
-            except Exception as e:
-                return JSONResponse(
-                    {"status": "error", "message": str(e)}, status_code=500
-                )
-
-        # Define startup and shutdown events
-        async def startup_event():
-            """Run on server startup."""
-            logger.info("Starting server...")
-            logger.info(f"Server started on port {port} with SSE endpoint at /sse")
-
-        async def shutdown_event():
-            """Run on server shutdown."""
-            logger.info("Shutting down server...")
-            logger.info("Server shut down")
-
-        # Create Starlette app with routes
-        from starlette.routing import Mount
-        
-        routes = [
+        handle_post_message = sse.handle_post_message
+
+    async def handle_sse(request):
+        """Handle SSE connections using mcp.server.sse."""
+        logger.info(f"New SSE connection from {request.client}")
+        disconnected = anyio.Event()
+
+        async def receive():
+            message = await request.receive()
+            if message["type"] == "http.disconnect":
+                disconnected.set()
+            return message
+
+        async def run_session(streams, cancel_scope):
+            # Run the MCP server with the streams
+            await serve(
+                server,
+                streams[0],
+                streams[1],
+                server.create_initialization_options(
+                    notification_options=NotificationOptions(tools_changed=True)
+                ),
+            )
+            cancel_scope.cancel()
+
+        try:
+            async with sse.connect_sse(request.scope, receive, request._send) as streams:
+                # The SSE transport does not end the session when the client
+                # goes away, so stop it here instead of keeping it until shutdown
+                async with anyio.create_task_group() as tg:
+                    tg.start_soon(run_session, streams, tg.cancel_scope)
+                    await disconnected.wait()
+                    tg.cancel_scope.cancel()
+        except Exception as e:
+            logger.error(f"Error in handle_sse: {str(e)}")
+            raise
+        finally:
+            logger.info(f"SSE connection from {request.client} closed")
+        # The event stream has been sent already, this only ends the request
+        return Response()
+
+    return _create_app(
+        [
             Route("/sse", endpoint=handle_sse, methods=["GET"]),
-            Mount("/messages/", app=sse.handle_post_message),
+            Mount("/messages/", app=handle_post_message),
+        ],
+        router,
+    )
+
+
+def create_streamable_http_app() -> Starlette:
+    """
+    Builds the streamable HTTP application of one worker, see _run_http.
+    """
+    router = _worker_router()
+    transport = StreamableHTTPTransport(
+        server,
+        server.create_initialization_options(
+            notification_options=NotificationOptions(tools_changed=True)
+        ),
+        replay_events=int(os.getenv("STREAM_REPLAY_EVENTS", str(DEFAULT_REPLAY_EVENTS))),
+        idle_timeout=float(os.getenv("SESSION_IDLE_TIMEOUT", str(DEFAULT_SESSION_IDLE_TIMEOUT))),
+        max_sessions=int(os.getenv("MAX_SESSIONS", str(DEFAULT_MAX_SESSIONS))),
+        router=router,
+    )
+    return _create_app([Route("/mcp", endpoint=transport)], router, transport)
+
+
+def _worker_router() -> Optional[WorkerRouter]:
+    """The router between the workers, if there are several."""
+    run_dir = os.getenv(RUN_DIR_ENV)
+    return WorkerRouter(run_dir) if run_dir else None
+
+
+def _create_app(
+    routes: List[BaseRoute],
+    router: Optional[WorkerRouter],
+    transport: Optional[StreamableHTTPTransport] = None,
+) -> Starlette:
+    """Adds the health and metrics endpoints and the startup and shutdown of the server to routes."""
+    logging.getLogger().setLevel(os.getenv(LOG_LEVEL_ENV, "info").upper())
+
+    async def health_check(request):
+        """Health check endpoint."""
+        try:
+            return JSONResponse(
+                {"status": "healthy", "allowed_dir": executor.allowed_dir, "worker": os.getpid()}
+            )
+        except Exception as e:
+            return JSONResponse(
+                {"status": "error", "message": str(e)}, status_code=500
+            )
+
+    async def metrics(request):
+        """Executor counters of this worker, such as result cache hits and misses."""
+        return JSONResponse({
+            **executor.metrics(),
+            "sessions": state_backend.session_stats(),
+            "worker": {
+                "pid": os.getpid(),
+                "forwarded_requests": router.forwarded if router is not None else 0,
+            },
+            **({"streamable_http": transport.stats()} if transport is not None else {}),
+        })
+
+    # Define startup and shutdown events
+    async def startup_event():
+        """Run on server startup."""
+        logger.info("Starting server...")
+        await executor.start()
+        await auth_validator.start()
+        if router is not None:
+            await router.start(app)
+        if transport is not None:
+            await transport.start()
+        logger.info(f"Worker {os.getpid()} started")
+
+    async def shutdown_event():
+        """Run on server shutdown."""
+        logger.info("Shutting down server...")
+        if transport is not None:
+            await transport.close()
+        if router is not None:
+            await router.close()
+        await auth_validator.close()
+        await executor.close()
+        logger.info("Server shut down")
+
+    app = Starlette(
+        routes=[
+            *routes,
             Route("/health", endpoint=health_check, methods=["GET"]),
-        ]
-
-        starlette_app = Starlette(
-            routes=routes,
-            on_startup=[startup_event],
-            on_shutdown=[shutdown_event],
-            debug=True,
+            Route("/metrics", endpoint=metrics, methods=["GET"]),
+        ],
+        on_startup=[startup_event],
+        on_shutdown=[shutdown_event],
+        debug=os.getenv(DEBUG_ENV) == "true",
+    )
+    return app
+
+
+def _run_http(transport: str, host: str, port: int, profile: ServingProfile) -> int:
+    """
+    Run the server using an HTTP transport, sse or streamable-http.
+
+    With more than one worker, uvicorn's supervisor binds the socket and runs
+    the workers, which build their app with the transport's factory and share
+    sessions and job metadata through the sqlite state backend unless
+    STATE_BACKEND is set.
+    """
+    os.environ[DEBUG_ENV] = "true" if profile.debug else "false"
+    os.environ[LOG_LEVEL_ENV] = profile.log_level
+    logging.getLogger().setLevel(profile.log_level.upper())
+    run_dir = None
+    try:
+        if profile.workers > 1:
+            run_dir = tempfile.mkdtemp(prefix="cli_use-")
+            os.environ[RUN_DIR_ENV] = run_dir
+            if "STATE_BACKEND" not in os.environ:
+                os.environ["STATE_BACKEND"] = "sqlite"
+                os.environ["STATE_DB_PATH"] = os.path.join(run_dir, "state.sqlite3")
+
+        logger.warning(
+            f"Starting CLI MCP server with {transport} transport on {host}:{port}, "
+            f"{profile.workers} worker(s), loop {profile.loop}, http {profile.http}"
+        )
+        uvicorn.run(
+            APP_FACTORIES[transport],
+            factory=True,
+            host=host,
+            port=port,
+            workers=profile.workers,
+            loop=profile.loop,
+            http=profile.http,
+            backlog=profile.backlog,
+            timeout_keep_alive=profile.keep_alive,
+            access_log=profile.access_log,
+            log_level=profile.log_level,
+            timeout_graceful_shutdown=profile.graceful_shutdown,
         )
-
-        # Run with uvicorn
-        logger.info(f"Starting CLI MCP server with SSE transport on port {port}")
-        config = uvicorn.Config(starlette_app, host="0.0.0.0", port=port)
-        uvicorn_server = uvicorn.Server(config)
-        await uvicorn_server.serve()
-
         return 0
     except Exception as e:
-        logger.error(f"Error running SSE server: {e}")
+        logger.error(f"Error running {transport} server: {e}")
         return 1
+    finally:
+        if run_dir is not None:
+            shutil.rmtree(run_dir, ignore_errors=True)
 
 
 async def _run_stdio(app: Server) -> int:
     """Run the server using stdio transport."""
     try:
-        stdin_reader = AsyncStdinReader()
-        stdout_writer = AsyncStdoutWriter()
-
-        # Create initialization options
-        initialization_options = {}
-
-        # Run the server
-        await app.run(
-            read_stream=stdin_reader,
-            write_stream=stdout_writer,
-            initialization_options=initialization_options,
-        )
+        await executor.start()
+        await auth_validator.start()
+        try:
+            async with stdio_transport() as (read_stream, write_stream):
+                await serve(
+                    app,
+                    read_stream,
+                    write_stream,
+                    app.create_initialization_options(
+                        notification_options=NotificationOptions(tools_changed=True)
+                    ),
+                )
+        finally:
+            await auth_validator.close()
+            await executor.close()
         return 0
     except KeyboardInterrupt:
         logger.info("Server stopped by user")
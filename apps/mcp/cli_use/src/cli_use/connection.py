@@ -0,0 +1,42 @@
+"""
+State bound to one client connection.
+
+Every connection served through cancellation.serve() gets its own
+ConnectionContext in a context variable. The mcp package runs each request
+in a task started from the connection's task, so request handlers see the
+context of the connection they belong to, and concurrent connections never
+see each other's state, such as the authenticated session id.
+"""
+
+import contextlib
+import contextvars
+from dataclasses import dataclass
+from typing import Iterator, Optional
+
+
+@dataclass
+class ConnectionContext:
+    """What the server knows about one connection"""
+
+    session_id: Optional[str] = None
+
+
+_current_connection: contextvars.ContextVar[Optional[ConnectionContext]] = contextvars.ContextVar(
+    "cli_use_connection", default=None
+)
+
+
+def current_connection() -> Optional[ConnectionContext]:
+    """The context of the connection being served, if any."""
+    return _current_connection.get()
+
+
+@contextlib.contextmanager
+def bind_connection() -> Iterator[ConnectionContext]:
+    """Binds a new ConnectionContext to the current task and the tasks it starts."""
+    context = ConnectionContext()
+    token = _current_connection.set(context)
+    try:
+        yield context
+    finally:
+        _current_connection.reset(token)
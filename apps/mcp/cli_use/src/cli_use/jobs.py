@@ -0,0 +1,253 @@
+"""
+Background jobs for commands that outlive a single tool call.
+
+A detached run_command starts a job and returns its id right away. The job's
+output is captured in the same bounded OutputBuffers as regular commands and
+can be read while the job is still running. Jobs belong to the session that
+started them; each session may run a limited number of jobs at once and only
+its most recent finished jobs are kept.
+
+A JobRecord of every job is kept in the state backend, so that all workers
+sharing it list the same jobs and apply the limits across workers. The job's
+processes and output stay with the worker that started it.
+"""
+
+import asyncio
+import os
+import secrets
+import time
+from dataclasses import dataclass, field
+from typing import Dict, Hashable, List, Optional
+
+from .output import OutputBuffer
+from .process import ResourceUsage
+from .state import JobRecord, MemoryStateBackend, StateBackend
+
+JOB_RUNNING = "running"
+JOB_FINISHED = "finished"
+JOB_FAILED = "failed"
+JOB_CANCELLED = "cancelled"
+
+
+class JobError(Exception):
+    """A job could not be started or does not exist"""
+
+    pass
+
+
+@dataclass
+class Job:
+    """A command running, or run, in the background"""
+
+    job_id: str
+    owner: Hashable
+    command: str
+    buffers: Dict[str, OutputBuffer]
+    started_at: float = field(default_factory=time.time)
+    finished_at: Optional[float] = None
+    status: str = JOB_RUNNING
+    returncode: Optional[int] = None
+    error: Optional[str] = None
+    task: Optional[asyncio.Task] = None
+    usage: ResourceUsage = field(default_factory=ResourceUsage)
+
+    @property
+    def running(self) -> bool:
+        return self.status == JOB_RUNNING
+
+    @property
+    def runtime(self) -> float:
+        return (self.finished_at or time.time()) - self.started_at
+
+    def record(self) -> JobRecord:
+        return JobRecord(
+            job_id=self.job_id,
+            owner=str(self.owner),
+            worker=os.getpid(),
+            command=self.command,
+            status=self.status,
+            started_at=self.started_at,
+            finished_at=self.finished_at,
+            returncode=self.returncode,
+            error=self.error,
+            stdout_bytes=self.buffers["stdout"].total_bytes,
+            stderr_bytes=self.buffers["stderr"].total_bytes,
+        )
+
+    def summary(self) -> str:
+        line = f"Job {self.job_id}: {self.status}"
+        if self.returncode is not None:
+            line += f" (return code {self.returncode})"
+        line += (
+            f", {self.runtime:.1f}s, stdout {self.buffers['stdout'].total_bytes} bytes,"
+            f" stderr {self.buffers['stderr'].total_bytes} bytes\n"
+            f"Command: {self.command}"
+        )
+        if not self.running:
+            line += f"\nResources: {self.usage.summary()}"
+        if self.error:
+            line += f"\nError: {self.error}"
+        return line
+
+
+class JobManager:
+    """
+    Runs commands as background jobs on a CommandExecutor.
+
+    The executor validates the command and applies the concurrency limit as for
+    any other command, with timeout instead of the regular command timeout.
+    """
+
+    def __init__(
+        self,
+        executor,
+        max_running_per_owner: int = 4,
+        max_finished_per_owner: int = 16,
+        timeout: float = 3600,
+        state: Optional[StateBackend] = None,
+    ):
+        self.executor = executor
+        self.max_running_per_owner = max_running_per_owner
+        self.max_finished_per_owner = max_finished_per_owner
+        self.timeout = timeout
+        self.state = state if state is not None else MemoryStateBackend()
+        # Jobs started by this worker
+        self._jobs: Dict[str, Job] = {}
+
+    def start(self, owner: Hashable, command_string: str) -> Job:
+        """
+        Validates a command and starts it as a job of owner.
+
+        Raises:
+            JobError: If owner already runs max_running_per_owner jobs.
+            CommandSecurityError: If the command fails security validation.
+        """
+        running = sum(1 for record in self.records(owner) if record.status == JOB_RUNNING)
+        if running >= self.max_running_per_owner:
+            raise JobError(
+                f"Job limit reached: {running} jobs are already running in this session"
+            )
+        # Reject invalid commands now instead of failing the job later
+        self.executor.validate_command(command_string)
+
+        job = Job(
+            job_id=secrets.token_hex(8),
+            owner=owner,
+            command=command_string,
+            buffers=self.executor.new_output_buffers(),
+        )
+        self._jobs[job.job_id] = job
+        self.state.put_job(job.record())
+        job.task = asyncio.ensure_future(self._run(job))
+        return job
+
+    async def _run(self, job: Job) -> None:
+        try:
+            job.returncode = await self.executor.execute_into(
+                job.command, job.buffers, timeout=self.timeout, usage=job.usage, owner=job.owner
+            )
+            job.status = JOB_FINISHED
+        except asyncio.CancelledError:
+            job.status = JOB_CANCELLED
+        except Exception as e:
+            job.status = JOB_FAILED
+            job.error = str(e)
+        finally:
+            job.finished_at = time.time()
+            self.state.put_job(job.record())
+            self._evict_finished(job.owner)
+
+    def get(self, owner: Hashable, job_id: str) -> Job:
+        """
+        Returns a job of owner.
+
+        Raises:
+            JobError: If there is no such job or it runs on another worker. Jobs of
+                other owners are not visible.
+        """
+        job = self._jobs.get(job_id)
+        if job is not None and job.owner == owner:
+            return job
+        record = self.state.get_job(job_id)
+        if job is None and record is not None and record.owner == str(owner):
+            raise JobError(
+                f"Job '{job_id}' belongs to worker {record.worker}, "
+                "its output and processes are only available there"
+            )
+        raise JobError(f"Unknown job id '{job_id}'")
+
+    def list(self, owner: Hashable) -> List[Job]:
+        """Returns the jobs of owner started by this worker."""
+        return [job for job in self._jobs.values() if job.owner == owner]
+
+    def records(self, owner: Hashable) -> List[JobRecord]:
+        """
+        Returns the records of all jobs of owner, on any worker.
+
+        Jobs of workers that exited are marked as failed.
+        """
+        records = self.state.list_jobs(str(owner))
+        for record in records:
+            if record.status != JOB_RUNNING or record.worker == os.getpid():
+                continue
+            if not _worker_alive(record.worker):
+                record.status = JOB_FAILED
+                record.error = f"Worker {record.worker} exited"
+                record.finished_at = time.time()
+                self.state.put_job(record)
+        return records
+
+    def summaries(self, owner: Hashable) -> List[str]:
+        """Describes every job of owner, in more detail for jobs of this worker."""
+        return [
+            self._jobs[record.job_id].summary() if record.job_id in self._jobs else record.summary()
+            for record in self.records(owner)
+        ]
+
+    async def cancel(self, owner: Hashable, job_id: str) -> Job:
+        """Cancels a running job, killing its processes, and waits for it to stop."""
+        job = self.get(owner, job_id)
+        if job.running and job.task is not None:
+            job.task.cancel()
+            await asyncio.gather(job.task, return_exceptions=True)
+        if job.running:
+            # The task was cancelled before it got to run
+            job.status = JOB_CANCELLED
+            job.finished_at = time.time()
+            self.state.put_job(job.record())
+        return job
+
+    def _evict_finished(self, owner: Hashable) -> None:
+        finished = sorted(
+            (record for record in self.records(owner) if record.status != JOB_RUNNING),
+            key=lambda record: record.finished_at or 0,
+        )
+        for record in finished[: max(0, len(finished) - self.max_finished_per_owner)]:
+            self.state.delete_job(record.job_id)
+            job = self._jobs.pop(record.job_id, None)
+            if job is not None:
+                for buffer in job.buffers.values():
+                    buffer.close()
+
+    async def close(self) -> None:
+        """Cancels all running jobs and releases all captured output."""
+        tasks = [job.task for job in self._jobs.values() if job.running and job.task]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for job in self._jobs.values():
+            # Other workers cannot serve the job's output either
+            self.state.delete_job(job.job_id)
+            for buffer in job.buffers.values():
+                buffer.close()
+        self._jobs.clear()
+
+
+def _worker_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
@@ -0,0 +1,257 @@
+"""
+Quote-aware lexer for command strings.
+
+tokenize() reads a command string once, left to right, and splits it the way
+a POSIX shell would into words, control operators (&&, ||, |, ;, & and
+newlines) and redirections. Quotes and backslash escapes are honored, so
+`echo "a|b"` is a single command with the argument a|b. Words record whether
+the shell would expand them, since the shell receives the original string of
+commands that use operators.
+"""
+
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+
+WORD = "word"
+OPERATOR = "operator"
+REDIRECT = "redirect"
+HEREDOC = "heredoc"
+
+CONTROL_OPERATORS = ("&&", "||", "|&", "|", "&", ";", "\n")
+
+REDIRECT_OPERATORS = ("&>>", "<<<", "<<-", "&>", ">>", "<<", ">|", ">&", "<&", "<>", ">", "<")
+
+# Redirections whose target is a file descriptor rather than a path
+FD_REDIRECTS = (">&", "<&")
+
+# Redirections whose target is a here-document delimiter or a here-string
+HEREDOC_REDIRECTS = ("<<", "<<-")
+HERESTRING_REDIRECT = "<<<"
+
+# Every operator, longest first so that e.g. ">>" is not read as two ">"
+_OPERATORS: Tuple[Tuple[str, str], ...] = tuple(
+    sorted(
+        [(operator, OPERATOR) for operator in CONTROL_OPERATORS if operator != "\n"]
+        + [(operator, REDIRECT) for operator in REDIRECT_OPERATORS],
+        key=lambda entry: -len(entry[0]),
+    )
+)
+
+_OPERATOR_CHARACTERS = "|&;<>"
+
+# Characters after "$" that start the expansion of a named parameter. Special
+# parameters such as $$ or $? only expand to numbers and flags.
+_PARAMETER_START = "{_abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ"
+
+
+class LexError(ValueError):
+    """A command string cannot be tokenized, e.g. because a quote is not closed"""
+
+    pass
+
+
+@dataclass(frozen=True)
+class Token:
+    """
+    One token of a command string.
+
+    value is the unquoted text of a word or the operator itself; start and end
+    delimit the token in the command string. expands is set for words the
+    shell would change through named parameter or tilde expansion,
+    substitution for tokens containing command or process substitution,
+    glob for words with an unquoted *, ? or [ that are matched against file
+    names, and shell_syntax for words with an unquoted { or (, which shells
+    read as brace expansion or glob qualifiers.
+    """
+
+    kind: str
+    value: str
+    start: int
+    end: int
+    expands: bool = False
+    substitution: bool = False
+    glob: bool = False
+    shell_syntax: bool = False
+
+
+def tokenize(command_string: str) -> List[Token]:
+    """
+    Splits a command string into tokens in a single pass.
+
+    Raises:
+        LexError: If a quotation is not closed or the string ends in a backslash.
+    """
+    return _Lexer(command_string).run()
+
+
+class _Lexer:
+    def __init__(self, text: str):
+        self.text = text
+        self.tokens: List[Token] = []
+        self.word: List[str] = []
+        self.word_start: Optional[int] = None
+        self.expands = False
+        self.substitution = False
+        self.glob = False
+        self.shell_syntax = False
+        # Here-documents whose bodies start after the next newline
+        self.pending_heredocs: List[Tuple[str, bool, bool]] = []
+        self.expect_delimiter: Optional[str] = None
+
+    def run(self) -> List[Token]:
+        text = self.text
+        i = 0
+        while i < len(text):
+            c = text[i]
+            if c in " \t":
+                self.finish_word(i)
+                i += 1
+            elif c == "\n":
+                self.finish_word(i)
+                self.tokens.append(Token(OPERATOR, "\n", i, i + 1))
+                i = self.read_heredocs(i + 1)
+            elif c == "'":
+                end = text.find("'", i + 1)
+                if end < 0:
+                    raise LexError("No closing quotation")
+                self.add(i, text[i + 1 : end])
+                i = end + 1
+            elif c == '"':
+                i = self.read_double_quoted(i)
+            elif c == "\\":
+                if i + 1 >= len(text):
+                    raise LexError("No escaped character")
+                if text[i + 1] != "\n":
+                    # An escaped newline only continues the line
+                    self.add(i, text[i + 1])
+                i += 2
+            elif c == "#" and self.word_start is None:
+                end = text.find("\n", i)
+                i = len(text) if end < 0 else end
+            elif c in "<>" and text.startswith("(", i + 1):
+                self.substitution = True
+                self.add(i, c)
+                i += 1
+            elif c in _OPERATOR_CHARACTERS:
+                i = self.read_operator(i)
+            elif c == "$":
+                if text.startswith("(", i + 1):
+                    self.substitution = True
+                elif i + 1 < len(text) and text[i + 1] in _PARAMETER_START:
+                    self.expands = True
+                self.add(i, c)
+                i += 1
+            elif c == "`":
+                self.substitution = True
+                self.add(i, c)
+                i += 1
+            else:
+                if c == "~" and self.word_start is None:
+                    self.expands = True
+                elif c in "*?[":
+                    self.glob = True
+                elif c in "{(":
+                    self.shell_syntax = True
+                self.add(i, c)
+                i += 1
+        self.finish_word(len(text))
+        return self.tokens
+
+    def add(self, position: int, characters: str) -> None:
+        if self.word_start is None:
+            self.word_start = position
+        self.word.append(characters)
+
+    def finish_word(self, position: int) -> None:
+        if self.word_start is None:
+            return
+        value = "".join(self.word)
+        self.tokens.append(
+            Token(
+                WORD,
+                value,
+                self.word_start,
+                position,
+                self.expands,
+                self.substitution,
+                self.glob,
+                self.shell_syntax,
+            )
+        )
+        if self.expect_delimiter is not None:
+            quoted = any(c in self.text[self.word_start : position] for c in "'\"\\")
+            self.pending_heredocs.append((value, self.expect_delimiter == "<<-", quoted))
+            self.expect_delimiter = None
+        self.word = []
+        self.word_start = None
+        self.expands = False
+        self.substitution = False
+        self.glob = False
+        self.shell_syntax = False
+
+    def read_double_quoted(self, i: int) -> int:
+        text = self.text
+        self.add(i, "")
+        i += 1
+        while i < len(text):
+            c = text[i]
+            if c == '"':
+                return i + 1
+            if c == "\\" and i + 1 < len(text) and text[i + 1] in '$`"\\\n':
+                if text[i + 1] != "\n":
+                    self.word.append(text[i + 1])
+                i += 2
+                continue
+            if c == "$":
+                if text.startswith("(", i + 1):
+                    self.substitution = True
+                elif i + 1 < len(text) and text[i + 1] in _PARAMETER_START:
+                    self.expands = True
+            elif c == "`":
+                self.substitution = True
+            self.word.append(c)
+            i += 1
+        raise LexError("No closing quotation")
+
+    def read_operator(self, i: int) -> int:
+        text = self.text
+        for operator, kind in _OPERATORS:
+            if text.startswith(operator, i):
+                break
+        start = i
+        if kind == REDIRECT and self.word_start is not None:
+            # Digits right before a redirection name the file descriptor
+            prefix = text[self.word_start : i]
+            if prefix.isdigit():
+                start = self.word_start
+                self.word = []
+                self.word_start = None
+        self.finish_word(i)
+        self.tokens.append(Token(kind, operator, start, i + len(operator)))
+        if operator in HEREDOC_REDIRECTS:
+            self.expect_delimiter = operator
+        return i + len(operator)
+
+    def read_heredocs(self, i: int) -> int:
+        """Reads the bodies of pending here-documents, which follow a newline."""
+        text = self.text
+        for delimiter, strip_tabs, quoted in self.pending_heredocs:
+            start = i
+            while i < len(text):
+                end = text.find("\n", i)
+                end = len(text) if end < 0 else end
+                line = text[i:end]
+                i = end + 1
+                if (line.lstrip("\t") if strip_tabs else line) == delimiter:
+                    break
+            body = text[start:i]
+            # Unless the delimiter is quoted the body is expanded like a word
+            substitution = not quoted and ("$(" in body or "`" in body)
+            expands = not quoted and any(
+                body[position + 1 : position + 2] in _PARAMETER_START
+                for position in range(len(body))
+                if body[position] == "$" and position + 1 < len(body)
+            )
+            self.tokens.append(Token(HEREDOC, body, start, min(i, len(text)), expands, substitution))
+        self.pending_heredocs = []
+        return min(i, len(text))
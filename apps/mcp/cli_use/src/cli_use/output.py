@@ -0,0 +1,208 @@
+"""
+Bounded capture of command output.
+
+Output is kept in memory up to a limit and spilled to an anonymous temporary
+file beyond it, up to a hard size cap. The end of the output is always kept in
+a small in-memory ring so a head/tail preview is cheap to build, and the stored
+part can be paged through by byte or line range after the command finished.
+"""
+
+import os
+import secrets
+import tempfile
+from collections import OrderedDict
+from typing import Hashable, List, Optional, Tuple
+
+# A line start offset is recorded every this many lines to speed up line paging
+LINE_INDEX_INTERVAL = 1000
+
+# Number of completed outputs kept around for read_command_output
+MAX_RETAINED_OUTPUTS = 32
+
+
+class OutputBuffer:
+    """
+    Bounded capture of one output stream.
+
+    Up to memory_limit bytes are kept in memory. Once that is exceeded, all
+    stored output moves to an unlinked temporary file that grows up to
+    spill_limit bytes; anything beyond that is counted but discarded. The last
+    tail_size bytes are always available from memory.
+    """
+
+    def __init__(self, memory_limit: int, spill_limit: int, tail_size: int = 32768):
+        self.memory_limit = memory_limit
+        self.spill_limit = max(spill_limit, memory_limit)
+        self.tail_size = tail_size
+        self.total_bytes = 0
+        self.stored_bytes = 0
+        self._memory = bytearray()
+        self._tail = bytearray()
+        self._spill_file = None
+        self._line_count = 0
+        # _line_index[i] is the byte offset where line i * LINE_INDEX_INTERVAL starts
+        self._line_index: List[int] = [0]
+
+    @property
+    def dropped_bytes(self) -> int:
+        """Bytes that were produced after the spill limit was reached."""
+        return self.total_bytes - self.stored_bytes
+
+    @property
+    def spilled(self) -> bool:
+        return self._spill_file is not None
+
+    def write(self, data: bytes) -> None:
+        if not data:
+            return
+        self.total_bytes += len(data)
+        self._tail.extend(data)
+        if len(self._tail) > self.tail_size:
+            del self._tail[: len(self._tail) - self.tail_size]
+
+        room = self.spill_limit - self.stored_bytes
+        if room <= 0:
+            return
+        data = data[:room]
+        self._index_lines(data)
+        if self._spill_file is None and self.stored_bytes + len(data) > self.memory_limit:
+            self._spill_file = tempfile.TemporaryFile(buffering=0)
+            self._spill_file.write(self._memory)
+            self._memory = bytearray()
+        if self._spill_file is not None:
+            self._spill_file.write(data)
+        else:
+            self._memory.extend(data)
+        self.stored_bytes += len(data)
+
+    def _index_lines(self, data: bytes) -> None:
+        newlines = data.count(b"\n")
+        next_mark = (self._line_count // LINE_INDEX_INTERVAL + 1) * LINE_INDEX_INTERVAL
+        if self._line_count + newlines >= next_mark:
+            position = -1
+            for line in range(self._line_count + 1, self._line_count + newlines + 1):
+                position = data.find(b"\n", position + 1)
+                if line % LINE_INDEX_INTERVAL == 0:
+                    self._line_index.append(self.stored_bytes + position + 1)
+        self._line_count += newlines
+
+    def read(self, offset: int, length: int) -> bytes:
+        """Returns up to length stored bytes starting at offset."""
+        if offset < 0 or length <= 0 or offset >= self.stored_bytes:
+            return b""
+        length = min(length, self.stored_bytes - offset)
+        if self._spill_file is not None:
+            return os.pread(self._spill_file.fileno(), length, offset)
+        return bytes(self._memory[offset : offset + length])
+
+    def read_lines(self, start_line: int, line_count: int, max_bytes: int) -> Tuple[bytes, int]:
+        """
+        Returns up to line_count stored lines starting at the 0-based start_line.
+
+        At most max_bytes are returned. The second value is the number of complete
+        lines included, so callers know where the next page starts.
+        """
+        if start_line < 0 or line_count <= 0:
+            return b"", 0
+        checkpoint = min(start_line // LINE_INDEX_INTERVAL, len(self._line_index) - 1)
+        offset = self._line_index[checkpoint]
+        line = checkpoint * LINE_INDEX_INTERVAL
+
+        # Skip forward to start_line
+        while line < start_line:
+            chunk = self.read(offset, 65536)
+            if not chunk:
+                return b"", 0
+            position = -1
+            while line < start_line:
+                position = chunk.find(b"\n", position + 1)
+                if position == -1:
+                    break
+                line += 1
+            offset += len(chunk) if position == -1 else position + 1
+
+        page = bytearray()
+        lines = 0
+        while lines < line_count and len(page) < max_bytes:
+            chunk = self.read(offset, min(65536, max_bytes - len(page)))
+            if not chunk:
+                break
+            position = -1
+            consumed = len(chunk)
+            while lines < line_count:
+                position = chunk.find(b"\n", position + 1)
+                if position == -1:
+                    break
+                lines += 1
+                consumed = position + 1
+            if lines >= line_count:
+                chunk = chunk[:consumed]
+            page.extend(chunk)
+            offset += len(chunk)
+        return bytes(page), lines
+
+    def fits(self, limit: int) -> bool:
+        return self.total_bytes <= limit
+
+    def text(self) -> str:
+        """Decodes all stored output."""
+        return self.read(0, self.stored_bytes).decode(errors="replace")
+
+    def preview(self, limit: int) -> str:
+        """
+        Returns the whole output if it fits in limit bytes, otherwise its head and tail.
+        """
+        if self.fits(limit) and not self.dropped_bytes:
+            return self.text()
+        half = limit // 2
+        head = self.read(0, half)
+        tail = bytes(self._tail[-half:]) if half else b""
+        omitted = self.total_bytes - len(head) - len(tail)
+        return (
+            head.decode(errors="replace")
+            + f"\n... [{omitted} bytes omitted] ...\n"
+            + tail.decode(errors="replace")
+        )
+
+    def close(self) -> None:
+        """Releases the spill file."""
+        if self._spill_file is not None:
+            self._spill_file.close()
+            self._spill_file = None
+        self._memory = bytearray()
+
+
+class OutputStore:
+    """
+    Keeps the complete output of recent commands so it can be paged through later.
+
+    Every entry belongs to the session that ran the command; other sessions
+    cannot find it. Entries are evicted least recently used first, which
+    closes their buffers and deletes any spill file.
+    """
+
+    def __init__(self, max_entries: int = MAX_RETAINED_OUTPUTS):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, tuple[Hashable, dict[str, OutputBuffer]]]" = OrderedDict()
+
+    def add(self, buffers: "dict[str, OutputBuffer]", owner: Hashable = "local") -> str:
+        output_id = secrets.token_hex(8)
+        self._entries[output_id] = (owner, buffers)
+        while len(self._entries) > self.max_entries:
+            _, (_, evicted) = self._entries.popitem(last=False)
+            for buffer in evicted.values():
+                buffer.close()
+        return output_id
+
+    def get(self, output_id: str, stream: str, owner: Hashable = "local") -> Optional[OutputBuffer]:
+        entry = self._entries.get(output_id)
+        if entry is None or entry[0] != owner:
+            return None
+        self._entries.move_to_end(output_id)
+        return entry[1].get(stream)
+
+    def clear(self) -> None:
+        for _, buffers in self._entries.values():
+            for buffer in buffers.values():
+                buffer.close()
+        self._entries.clear()
@@ -0,0 +1,245 @@
+"""
+Cached resolution of path arguments.
+
+Every path a command names is resolved with the semantics of
+os.path.realpath before it is checked against the allowed directory. Doing
+that from scratch costs an lstat per path component, for every argument of
+every command. PathResolver instead remembers the real path of each directory
+it resolved, so that resolving a path only needs an lstat of its last
+component while the directory is cached.
+
+A cached directory depends on the directories its resolution looked up names
+in. Entries are dropped when inotify reports a change in one of them. Without
+a working watch, each use of an entry compares the change time of those
+directories with the one seen when the entry was made instead. Change times
+cannot be set back by users, unlike modification times.
+"""
+
+import logging
+import os
+import stat
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, Optional, Set, Tuple
+
+from .cache import InotifyWatcher
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PATH_CACHE_SIZE = 4096
+
+# Directories changed more recently than this are not cached, since a second
+# change within the same timestamp tick would go unnoticed
+RACY_INTERVAL_NS = 1_000_000_000
+
+# Symlinks followed while resolving one path, like the kernel's limit
+MAX_SYMLINKS = 40
+
+
+def is_within(path: str, root: str) -> bool:
+    """True if path is root or below it. Both must be absolute and normalized."""
+    return path == root or path.startswith(root.rstrip(os.sep) + os.sep)
+
+
+@dataclass(frozen=True)
+class _Directory:
+    real_path: str
+    # (directory, inode, change time) of every directory a name was looked up in
+    dependencies: Tuple[Tuple[str, int, int], ...]
+
+
+class PathResolver:
+    """
+    Resolves paths like os.path.realpath, caching the real path of directories.
+
+    Relative paths are resolved against root. Only directories that resolve
+    below root are cached. Call start() from the event loop to keep the cache
+    up to date through inotify, otherwise entries are checked on every use.
+    """
+
+    def __init__(self, root: str, max_entries: int = DEFAULT_PATH_CACHE_SIZE):
+        self.root = os.path.abspath(os.path.realpath(root))
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._entries: "OrderedDict[str, _Directory]" = OrderedDict()
+        # Keys of the entries that depend on each directory
+        self._dependents: Dict[str, Set[str]] = {}
+        self.watcher = InotifyWatcher(self.root, self.invalidate)
+
+    @property
+    def watching(self) -> bool:
+        return self.watcher.running
+
+    def start(self) -> None:
+        """Watches root for changes. Entries are checked on use if that is not possible."""
+        if self.max_entries <= 0:
+            return
+        try:
+            self.watcher.start()
+        except OSError as e:
+            logger.warning(f"Checking cached paths on use, cannot watch {self.root}: {str(e)}")
+        self.clear()
+
+    def stop(self) -> None:
+        self.watcher.stop()
+        self.clear()
+
+    def resolve(self, path: str) -> str:
+        """Returns os.path.realpath of path, relative paths taken from root."""
+        absolute = os.path.join(self.root, path)
+        if self.max_entries <= 0:
+            return os.path.abspath(os.path.realpath(absolute))
+        directory, name = os.path.split(absolute)
+        real_directory = self._resolve_directory(directory)
+        if name in ("", "."):
+            return real_directory
+        if name == "..":
+            return os.path.dirname(real_directory)
+        candidate = os.path.join(real_directory, name)
+        try:
+            is_link = stat.S_ISLNK(os.lstat(candidate).st_mode)
+        except OSError:
+            return candidate
+        if is_link:
+            return os.path.realpath(candidate)
+        return candidate
+
+    def invalidate(self, path: str) -> None:
+        """Drops the entries that looked up a name in path or in its directory."""
+        if path == self.root:
+            # Events were lost
+            self.invalidations += len(self._entries)
+            self.clear()
+            return
+        for directory in (path, os.path.dirname(path)):
+            for key in self._dependents.pop(directory, ()):
+                if self._remove(key):
+                    self.invalidations += 1
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._dependents.clear()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "watching": self.watching,
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+        }
+
+    def _resolve_directory(self, directory: str) -> str:
+        if self.watching:
+            # Changes made by a command that just finished must be seen before
+            # the next command is checked, not whenever the event loop gets to it
+            self.watcher.poll()
+        entry = self._entries.get(directory)
+        if entry is not None and (self.watching or self._unchanged(entry)):
+            self._entries.move_to_end(directory)
+            self.hits += 1
+            return entry.real_path
+        if entry is not None:
+            self._remove(directory)
+        self.misses += 1
+
+        real_path = os.path.abspath(os.path.realpath(directory))
+        try:
+            walked, looked_up = _walk(directory)
+        except OSError:
+            return real_path
+        if walked != real_path or not is_within(real_path, self.root):
+            return real_path
+        dependencies = []
+        now = time.time_ns()
+        for looked_up_in in sorted(looked_up):
+            if not is_within(looked_up_in, self.root):
+                if is_within(self.root, looked_up_in):
+                    # The directories above root are taken as given
+                    continue
+                return real_path
+            if self.watching and not self.watcher.is_watching(looked_up_in):
+                return real_path
+            try:
+                st = os.stat(looked_up_in)
+            except OSError:
+                return real_path
+            if now - st.st_ctime_ns < RACY_INTERVAL_NS:
+                return real_path
+            dependencies.append((looked_up_in, st.st_ino, st.st_ctime_ns))
+        self._put(directory, _Directory(real_path, tuple(dependencies)))
+        return real_path
+
+    @staticmethod
+    def _unchanged(entry: _Directory) -> bool:
+        for directory, inode, ctime in entry.dependencies:
+            try:
+                st = os.stat(directory)
+            except OSError:
+                return False
+            if st.st_ino != inode or st.st_ctime_ns != ctime:
+                return False
+        return True
+
+    def _put(self, key: str, entry: _Directory) -> None:
+        self._remove(key)
+        self._entries[key] = entry
+        for directory, _, _ in entry.dependencies:
+            self._dependents.setdefault(directory, set()).add(key)
+        while len(self._entries) > self.max_entries:
+            self._remove(next(iter(self._entries)))
+
+    def _remove(self, key: str) -> bool:
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return False
+        for directory, _, _ in entry.dependencies:
+            dependents = self._dependents.get(directory)
+            if dependents is not None:
+                dependents.discard(key)
+                if not dependents:
+                    del self._dependents[directory]
+        return True
+
+
+def _walk(path: str) -> Tuple[str, Set[str]]:
+    """
+    Resolves an absolute path component by component like os.path.realpath.
+
+    Returns the real path and the real directories names were looked up in.
+
+    Raises:
+        OSError: If there are too many symlinks to follow.
+    """
+    looked_up: Set[str] = set()
+    followed = 0
+
+    def resolve(current: str, rest: str) -> str:
+        nonlocal followed
+        for name in rest.split(os.sep):
+            if name in ("", "."):
+                continue
+            if name == "..":
+                current = os.path.dirname(current)
+                continue
+            looked_up.add(current)
+            candidate = os.path.join(current, name)
+            try:
+                st = os.lstat(candidate)
+            except OSError:
+                current = candidate
+                continue
+            if not stat.S_ISLNK(st.st_mode):
+                current = candidate
+                continue
+            followed += 1
+            if followed > MAX_SYMLINKS:
+                raise OSError(f"Too many levels of symbolic links: {path}")
+            target = os.readlink(candidate)
+            current = resolve(os.sep if os.path.isabs(target) else current, target)
+        return current
+
+    return resolve(os.sep, path), looked_up
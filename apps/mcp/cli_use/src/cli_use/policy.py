@@ -0,0 +1,404 @@
+"""
+Compiled security policy for command validation.
+
+SecurityPolicy is built once from the SecurityConfig: allowed commands and
+flags become frozensets and the allowed directory is resolved up front.
+Checking a command string tokenizes it once with the lexer and yields a
+Verdict, which is cached per string by VerdictCache. A verdict only holds
+what follows from the string itself. Paths named by the command are resolved
+again whenever the verdict is applied, since symlinks below the allowed
+directory may change between two runs of the same command. That resolution
+goes through a PathResolver, which caches the real path of directories. Glob
+patterns are expanded in the process when the verdict is applied, and every
+match is checked like a path, so no shell is needed to run them.
+"""
+
+import glob
+import os
+import re
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Dict, FrozenSet, List, Optional, Sequence, Tuple
+
+from .lexer import (
+    FD_REDIRECTS,
+    HEREDOC_REDIRECTS,
+    HERESTRING_REDIRECT,
+    OPERATOR,
+    REDIRECT,
+    WORD,
+    LexError,
+    Token,
+    tokenize,
+)
+from .paths import PathResolver, is_within
+
+URL_PATTERN = re.compile(r"^https?://")
+
+DEFAULT_VERDICT_CACHE_SIZE = 4096
+
+
+class PolicyViolation(Exception):
+    """A command is not allowed by the security policy"""
+
+    pass
+
+
+@dataclass(frozen=True)
+class Verdict:
+    """
+    The outcome of checking one command string against a SecurityPolicy.
+
+    error is set if the command is rejected. shell tells whether the command
+    needs a shell, i.e. uses operators or redirections. stages holds the argv
+    of each stage if the command is a single command or a plain pipeline.
+    Every entry of paths, given as (stage or -1, index into its argv, path,
+    operator part or ""), still has to be resolved. Resolved paths replace
+    their argument; the ones with stage -1 only have to be inside the allowed
+    directory. globs lists glob patterns in the same form; their matches
+    replace the pattern, or are only checked for stage -1.
+    """
+
+    shell: bool = False
+    stages: Tuple[Tuple[str, ...], ...] = ()
+    paths: Tuple[Tuple[int, int, str, str], ...] = ()
+    globs: Tuple[Tuple[int, int, str, str], ...] = ()
+    error: Optional[str] = None
+
+
+@dataclass
+class ValidatedCommand:
+    """
+    A command that passed validation, with its paths resolved.
+
+    command and args are the argv of a single command. For commands that need
+    a shell, command is the full command string and args is empty.
+    """
+
+    command: str
+    args: List[str]
+    shell: bool = False
+    stages: List[List[str]] = field(default_factory=list)
+
+
+@dataclass(frozen=True)
+class SecurityPolicy:
+    """
+    Immutable form of the validation rules of a SecurityConfig.
+
+    version counts the policies compiled by a CommandExecutor, so that state
+    derived from a policy can tell whether it is still current.
+    """
+
+    allowed_dir: str
+    root: str
+    allowed_commands: FrozenSet[str]
+    allowed_flags: FrozenSet[str]
+    allow_all_commands: bool = False
+    allow_all_flags: bool = False
+    allow_shell_operators: bool = False
+    resolver: Optional[PathResolver] = field(default=None, compare=False, repr=False)
+    version: int = field(default=0, compare=False)
+
+    @classmethod
+    def compile(
+        cls,
+        allowed_dir: str,
+        config: Any,
+        resolver: Optional[PathResolver] = None,
+        version: int = 0,
+    ) -> "SecurityPolicy":
+        """
+        Builds the policy for allowed_dir from a SecurityConfig.
+
+        Paths are resolved through resolver if given, else without caching.
+        """
+        return cls(
+            allowed_dir=allowed_dir,
+            root=os.path.abspath(os.path.realpath(allowed_dir)),
+            allowed_commands=frozenset(config.allowed_commands),
+            allowed_flags=frozenset(config.allowed_flags),
+            allow_all_commands=config.allow_all_commands,
+            allow_all_flags=config.allow_all_flags,
+            allow_shell_operators=config.allow_shell_operators,
+            resolver=resolver,
+            version=version,
+        )
+
+    def check(self, command_string: str) -> Verdict:
+        """
+        Checks a command string, see CommandExecutor.validate_command for the rules.
+
+        A command with operators is split into simple commands, each checked like
+        a single command. Redirection targets must be inside the allowed
+        directory. Such commands are run by a shell, so words the shell would
+        expand other than glob patterns are refused.
+        """
+        try:
+            try:
+                tokens = tokenize(command_string)
+            except LexError as e:
+                raise PolicyViolation(f"Invalid command format: {str(e)}")
+            operators = [token for token in tokens if token.kind in (OPERATOR, REDIRECT)]
+            if not operators:
+                words = [token.value for token in tokens]
+                if not words:
+                    raise PolicyViolation("Empty command")
+                globs = [index for index, token in enumerate(tokens) if index and token.glob]
+                paths = self._check_words(words, globs)
+                return Verdict(
+                    stages=(tuple(words),),
+                    paths=tuple((0, index, path, "") for index, path in paths),
+                    globs=tuple((0, index, words[index], "") for index in globs),
+                )
+            if not self.allow_shell_operators:
+                raise PolicyViolation(
+                    f"Shell operator '{_display(operators[0].value)}' is not supported. Set ALLOW_SHELL_OPERATORS=true to enable."
+                )
+            return self._check_with_operators(command_string, tokens)
+        except PolicyViolation as e:
+            return Verdict(error=str(e))
+
+    def apply(self, verdict: Verdict) -> ValidatedCommand:
+        """
+        Resolves the paths of a verdict and returns the validated command.
+
+        Raises:
+            PolicyViolation: If the verdict is a rejection or a path is outside
+                the allowed directory.
+        """
+        if verdict.error is not None:
+            raise PolicyViolation(verdict.error)
+        stages = [list(stage) for stage in verdict.stages]
+        for stage, index, path, part in verdict.paths:
+            try:
+                resolved = self.resolve_path(path)
+            except PolicyViolation as e:
+                if part:
+                    raise PolicyViolation(f"Invalid command part '{part}': {str(e)}")
+                raise
+            if stage >= 0:
+                stages[stage][index] = resolved
+        # From the back, since a pattern may turn into several words
+        for stage, index, pattern, part in sorted(verdict.globs, reverse=True):
+            try:
+                matches = self.expand_glob(pattern)
+            except PolicyViolation as e:
+                if part:
+                    raise PolicyViolation(f"Invalid command part '{part}': {str(e)}")
+                raise
+            if stage >= 0:
+                stages[stage][index : index + 1] = matches
+        if verdict.shell:
+            return ValidatedCommand("", [], shell=True, stages=stages)
+        return ValidatedCommand(stages[0][0], stages[0][1:], stages=stages)
+
+    def resolve_path(self, path: str) -> str:
+        """
+        Resolves a path, relative ones against the allowed directory.
+
+        Raises:
+            PolicyViolation: If the resolved path is outside of the allowed directory.
+        """
+        try:
+            if self.resolver is not None:
+                real_path = self.resolver.resolve(path)
+            else:
+                real_path = os.path.abspath(os.path.realpath(os.path.join(self.root, path)))
+        except Exception as e:
+            raise PolicyViolation(f"Invalid path '{path}': {str(e)}")
+        # A plain prefix test would let /work2 pass for /work
+        if not is_within(real_path, self.root):
+            raise PolicyViolation(
+                f"Path '{path}' is outside of allowed directory: {self.allowed_dir}"
+            )
+        return real_path
+
+    def expand_glob(self, pattern: str) -> List[str]:
+        """
+        Expands a glob pattern against the allowed directory, as a shell would.
+
+        Matches are sorted. A pattern without matches is kept as it is. Matches
+        starting with "-" are given as ./name, so they cannot act as flags.
+
+        Raises:
+            PolicyViolation: If the pattern looks outside of the allowed directory
+                or a match resolves outside of it.
+        """
+        literal = []
+        for component in pattern.split("/"):
+            if any(c in component for c in "*?["):
+                break
+            literal.append(component)
+        # The directory the pattern starts from is checked before it is listed
+        base = "/".join(literal) or ("/" if pattern.startswith("/") else ".")
+        try:
+            self.resolve_path(base)
+            matches = sorted(glob.glob(pattern, root_dir=self.root))
+            for match in matches:
+                self.resolve_path(match)
+        except PolicyViolation:
+            raise PolicyViolation(
+                f"Pattern '{pattern}' matches paths outside of allowed directory: {self.allowed_dir}"
+            )
+        if not matches:
+            return [pattern]
+        return [f"./{match}" if match.startswith("-") else match for match in matches]
+
+    def _check_words(self, words: List[str], globs: Sequence[int] = ()) -> List[Tuple[int, str]]:
+        """
+        Checks the argv of a simple command and returns its (index, path) arguments.
+
+        The words at the indexes in globs are patterns, whose matches are
+        checked when they are expanded.
+        """
+        command = words[0]
+        if not self.allow_all_commands and command not in self.allowed_commands:
+            raise PolicyViolation(f"Command '{command}' is not allowed")
+
+        paths = []
+        for index, arg in enumerate(words[1:], start=1):
+            if arg.startswith("-"):
+                if not self.allow_all_flags and arg not in self.allowed_flags:
+                    raise PolicyViolation(f"Flag '{arg}' is not allowed")
+            elif index in globs:
+                continue
+            elif "/" in arg or "\\" in arg or arg == ".":
+                # Absolute paths contain "/" as well
+                if not URL_PATTERN.match(arg):
+                    paths.append((index, arg))
+        return paths
+
+    def _check_with_operators(self, command_string: str, tokens: List[Token]) -> Verdict:
+        # Simple commands are the runs of tokens between control operators
+        commands: List[List[Token]] = [[]]
+        for token in tokens:
+            if token.kind == OPERATOR:
+                commands.append([])
+            else:
+                commands[-1].append(token)
+            if token.substitution:
+                raise PolicyViolation(
+                    "Command substitution is not supported in commands run by a shell"
+                )
+            if token.expands:
+                raise PolicyViolation(
+                    "Variable and tilde expansion are not supported in commands run by a "
+                    f"shell: '{command_string[token.start:token.end].strip()}'"
+                )
+            if token.shell_syntax:
+                raise PolicyViolation(
+                    "Brace expansion and glob qualifiers are not supported in commands run "
+                    f"by a shell: '{command_string[token.start:token.end].strip()}'"
+                )
+            if token.glob:
+                _check_shell_glob(token.value)
+
+        pipeline = all(token.value == "|" for token in tokens if token.kind == OPERATOR)
+        stages = []
+        paths = []
+        globs = []
+        for command in commands:
+            if not command:
+                continue
+            part = command_string[command[0].start : command[-1].end]
+            words = []
+            tokens_iter = iter(command)
+            for token in tokens_iter:
+                if token.kind == REDIRECT:
+                    pipeline = False
+                    target = next(tokens_iter, None)
+                    if target is None or target.kind != WORD:
+                        raise PolicyViolation(
+                            f"Invalid command part '{part}': '{token.value}' needs a target"
+                        )
+                    if not self._redirect_target_is_path(token.value, target.value):
+                        continue
+                    paths.append((-1, 0, target.value, part))
+                    if target.glob:
+                        globs.append((-1, 0, target.value, part))
+                elif token.kind == WORD:
+                    if token.glob and words:
+                        globs.append((len(stages), len(words), token.value, part))
+                    words.append(token.value)
+                else:
+                    pipeline = False
+            if not words:
+                # Only redirections, e.g. "> file"
+                continue
+            try:
+                word_paths = self._check_words(
+                    words, [index for stage, index, _, _ in globs if stage == len(stages)]
+                )
+            except PolicyViolation as e:
+                raise PolicyViolation(f"Invalid command part '{part}': {str(e)}")
+            paths.extend((len(stages), index, path, part) for index, path in word_paths)
+            stages.append(tuple(words))
+
+        if not pipeline:
+            # Without stages every path and glob match is only checked
+            paths = [(-1, 0, path, part) for _, _, path, part in paths]
+            globs = [(-1, 0, pattern, part) for _, _, pattern, part in globs]
+            stages = []
+        return Verdict(shell=True, stages=tuple(stages), paths=tuple(paths), globs=tuple(globs))
+
+    @staticmethod
+    def _redirect_target_is_path(operator: str, target: str) -> bool:
+        if operator in HEREDOC_REDIRECTS or operator == HERESTRING_REDIRECT:
+            return False
+        if operator in FD_REDIRECTS and (target.isdigit() or target == "-"):
+            return False
+        return True
+
+
+def _check_shell_glob(pattern: str) -> None:
+    """
+    Refuses glob patterns with which a shell could match "." or "..".
+
+    Shells only match a leading dot given literally, and some shells then
+    match the "." and ".." entries as well.
+    """
+    for component in pattern.split("/"):
+        if component.startswith(".") and any(c in component for c in "*?["):
+            raise PolicyViolation(
+                f"Glob pattern '{pattern}' could match '..' in a command run by a shell"
+            )
+
+
+def _display(operator: str) -> str:
+    return "newline" if operator == "\n" else operator
+
+
+class VerdictCache:
+    """
+    Least recently used verdicts by command string.
+    """
+
+    def __init__(self, max_entries: int = DEFAULT_VERDICT_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Verdict]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, command_string: str) -> Optional[Verdict]:
+        verdict = self._entries.get(command_string)
+        if verdict is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(command_string)
+        self.hits += 1
+        return verdict
+
+    def put(self, command_string: str, verdict: Verdict) -> None:
+        if self.max_entries <= 0:
+            return
+        self._entries[command_string] = verdict
+        self._entries.move_to_end(command_string)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
@@ -0,0 +1,142 @@
+"""
+Security policy loaded from a file that is watched for changes.
+
+The file is a JSON object whose keys override the validation settings read
+from the environment, for example
+
+    {
+        "allowed_commands": ["ls", "cat", "git"],
+        "allowed_flags": "all",
+        "allow_shell_operators": true,
+        "max_command_length": 2048,
+        "command_timeout": 60
+    }
+
+PolicyFileWatcher polls the file's stat identity, so edits, atomic renames
+and symlink swaps such as Kubernetes ConfigMap updates are all noticed. A file
+that cannot be read or parsed is reported and the current policy stays.
+"""
+
+import asyncio
+import json
+import logging
+import os
+from typing import Any, Callable, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_POLICY_RELOAD_INTERVAL = 2.0
+
+
+class PolicyFileError(ValueError):
+    """A policy file cannot be read or holds invalid settings"""
+
+    pass
+
+
+def _names(key: str, value: Any) -> Dict[str, Any]:
+    # "all" lifts the restriction, like ALLOWED_COMMANDS=all
+    if value == "all":
+        return {key: set(), f"allow_all_{key[len('allowed_'):]}": True}
+    if not isinstance(value, list) or not all(isinstance(name, str) for name in value):
+        raise PolicyFileError(f"'{key}' must be \"all\" or a list of strings")
+    return {key: {name for name in value if name}, f"allow_all_{key[len('allowed_'):]}": False}
+
+
+def _flag(key: str, value: Any) -> Dict[str, Any]:
+    if not isinstance(value, bool):
+        raise PolicyFileError(f"'{key}' must be true or false")
+    return {key: value}
+
+
+def _positive(key: str, value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool) or not isinstance(value, int) or value <= 0:
+        raise PolicyFileError(f"'{key}' must be a positive integer")
+    return {key: value}
+
+
+# Settings a policy file may change, by key, with the parser of their value
+POLICY_FILE_KEYS: Dict[str, Callable[[str, Any], Dict[str, Any]]] = {
+    "allowed_commands": _names,
+    "allowed_flags": _names,
+    "allow_shell_operators": _flag,
+    "max_command_length": _positive,
+    "command_timeout": _positive,
+}
+
+
+def load_policy_file(path: str) -> Dict[str, Any]:
+    """
+    Reads a policy file and returns the SecurityConfig fields it sets.
+
+    Raises:
+        PolicyFileError: If the file cannot be read or a setting is invalid.
+    """
+    try:
+        with open(path, encoding="utf-8") as f:
+            settings = json.load(f)
+    except (OSError, ValueError) as e:
+        raise PolicyFileError(f"Cannot read policy file {path}: {str(e)}")
+    if not isinstance(settings, dict):
+        raise PolicyFileError(f"Policy file {path} must hold a JSON object")
+    unknown = sorted(set(settings) - set(POLICY_FILE_KEYS))
+    if unknown:
+        raise PolicyFileError(f"Unknown settings in policy file {path}: {', '.join(unknown)}")
+    fields: Dict[str, Any] = {}
+    for key, value in settings.items():
+        fields.update(POLICY_FILE_KEYS[key](key, value))
+    return fields
+
+
+def file_identity(path: str) -> Optional[Tuple[int, int, int, int]]:
+    """Returns the (device, inode, mtime, size) the path points to, or None if it is missing."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_dev, st.st_ino, st.st_mtime_ns, st.st_size)
+
+
+class PolicyFileWatcher:
+    """
+    Calls on_change whenever the file at path changes, checking every interval seconds.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        on_change: Callable[[], None],
+        interval: float = DEFAULT_POLICY_RELOAD_INTERVAL,
+    ):
+        self.path = path
+        self.on_change = on_change
+        self.interval = interval
+        self._identity = file_identity(path)
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        if self._task is None and self.interval > 0:
+            self._task = asyncio.ensure_future(self._run())
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def check(self) -> bool:
+        """Calls on_change if the file changed since the last check. Returns whether it did."""
+        identity = file_identity(self.path)
+        if identity == self._identity:
+            return False
+        self._identity = identity
+        self.on_change()
+        return True
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                self.check()
+            except Exception as e:
+                logger.warning(f"Checking policy file {self.path} failed: {str(e)}")
@@ -0,0 +1,453 @@
+"""
+Child processes with resource accounting and process group cleanup.
+
+asyncio's subprocess support reaps children with waitpid, which throws away
+their resource usage. ChildProcess starts commands with subprocess.Popen and
+reaps them with os.wait4 as soon as a pidfd reports their exit, so CPU time and
+peak memory of every command are known. Resource limits are applied in the
+child between fork and exec.
+
+All processes of a command share a ProcessGroup, so the command can be
+stopped together with everything it started. Every process also inherits a
+marker environment variable naming its command, which lets the OrphanSweeper
+find processes that left the group (e.g. with setsid) after their command
+finished.
+"""
+
+import asyncio
+import logging
+import os
+import resource
+import signal
+import subprocess
+import sys
+import time
+from dataclasses import asdict, dataclass
+from typing import Any, Callable, Dict, List, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+# Environment variable naming the command a process belongs to
+COMMAND_MARKER_ENV = "CLI_USE_COMMAND"
+
+# Seconds between SIGTERM and SIGKILL when stopping a process group
+DEFAULT_KILL_GRACE_PERIOD = 2.0
+
+# Seconds between two sweeps for orphaned command processes
+DEFAULT_SWEEP_INTERVAL = 30.0
+
+# How often a terminating process group is checked for survivors
+GROUP_POLL_INTERVAL = 0.05
+
+
+@dataclass
+class ResourceLimits:
+    """
+    Per-command rlimits; None leaves a limit unchanged.
+
+    max_processes is RLIMIT_NPROC, which counts all processes of the user, not
+    only those started by the command.
+    """
+
+    cpu_seconds: Optional[int] = None
+    address_space_bytes: Optional[int] = None
+    open_files: Optional[int] = None
+    max_processes: Optional[int] = None
+
+    @property
+    def enabled(self) -> bool:
+        return any(value is not None for value in asdict(self).values())
+
+    def _limits(self) -> List[tuple]:
+        return [
+            (limit, value)
+            for limit, value in (
+                (resource.RLIMIT_CPU, self.cpu_seconds),
+                (resource.RLIMIT_AS, self.address_space_bytes),
+                (resource.RLIMIT_NOFILE, self.open_files),
+                (resource.RLIMIT_NPROC, self.max_processes),
+            )
+            if value is not None
+        ]
+
+    def apply(self) -> None:
+        """Lowers the limits of the current process; used as Popen preexec_fn."""
+        for limit, value in self._limits():
+            _, hard = resource.getrlimit(limit)
+            if hard != resource.RLIM_INFINITY:
+                value = min(value, hard)
+            resource.setrlimit(limit, (value, hard))
+
+    def ulimit_command(self) -> str:
+        """Returns the equivalent `ulimit` shell command, or "" if no limit is set."""
+        options = []
+        if self.cpu_seconds is not None:
+            options.append(f"-t {self.cpu_seconds}")
+        if self.address_space_bytes is not None:
+            options.append(f"-v {self.address_space_bytes // 1024}")
+        if self.open_files is not None:
+            options.append(f"-n {self.open_files}")
+        if self.max_processes is not None:
+            options.append(f"-u {self.max_processes}")
+        return " && ".join(f"ulimit {option}" for option in options)
+
+
+@dataclass
+class ResourceUsage:
+    """
+    Resources used by one command, summed over all of its processes.
+
+    CPU times and max_rss_kb are None when they could not be measured. Linux
+    carries the peak RSS of a process over exec, so a child forked from the
+    server reports at least the server's own peak. max_rss_kb is therefore only
+    set when a command's peak exceeds that; smaller peaks are indistinguishable.
+    """
+
+    wall_time: float = 0.0
+    user_time: Optional[float] = None
+    system_time: Optional[float] = None
+    max_rss_kb: Optional[int] = None
+    stdout_bytes: int = 0
+    stderr_bytes: int = 0
+
+    def add_cpu(self, user_time: float, system_time: float) -> None:
+        self.user_time = (self.user_time or 0.0) + user_time
+        self.system_time = (self.system_time or 0.0) + system_time
+
+    def add_rusage(self, rusage: Any, inherited_rss_kb: int = 0) -> None:
+        self.add_cpu(rusage.ru_utime, rusage.ru_stime)
+        if rusage.ru_maxrss > inherited_rss_kb:
+            self.max_rss_kb = max(self.max_rss_kb or 0, rusage.ru_maxrss)
+
+    @property
+    def cpu_time(self) -> float:
+        return (self.user_time or 0.0) + (self.system_time or 0.0)
+
+    def as_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+    def summary(self) -> str:
+        parts = [f"wall {self.wall_time:.3f}s"]
+        if self.user_time is not None:
+            parts.append(f"user {self.user_time:.3f}s")
+            parts.append(f"sys {self.system_time:.3f}s")
+        if self.max_rss_kb is not None:
+            parts.append(f"max RSS {self.max_rss_kb / 1024:.1f} MiB")
+        parts.append(f"output {self.stdout_bytes + self.stderr_bytes} bytes")
+        return ", ".join(parts)
+
+
+class ChildProcess:
+    """
+    A running command, reaped with os.wait4 as soon as it exits.
+
+    Reaping does not depend on anyone awaiting wait(), so exited children never
+    linger as zombies. Until the child is reaped its pid cannot be reused, which
+    makes kill() safe to call at any time.
+    """
+
+    def __init__(self, popen: subprocess.Popen):
+        self.popen = popen
+        self.pid = popen.pid
+        self.returncode: Optional[int] = None
+        self.rusage = None
+        # Peak RSS the child inherits from the server, see ResourceUsage
+        self.inherited_rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        self._loop = asyncio.get_running_loop()
+        self._exited: asyncio.Future = self._loop.create_future()
+        self._pidfd = -1
+        self._watch()
+
+    @classmethod
+    def spawn(
+        cls,
+        argv: List[str],
+        executable: Optional[str] = None,
+        limits: Optional[ResourceLimits] = None,
+        process_group: Optional[int] = None,
+        **popen_args: Any,
+    ) -> "ChildProcess":
+        """
+        Starts argv with subprocess.Popen; popen_args are passed through.
+
+        process_group is the process group to join, 0 to lead a new one.
+        Must be called from a running event loop.
+        """
+        setup: List[Callable[[], None]] = []
+        if limits is not None and limits.enabled:
+            setup.append(limits.apply)
+        if process_group is not None:
+            if sys.version_info >= (3, 11):
+                popen_args["process_group"] = process_group
+            else:
+                setup.append(lambda: os.setpgid(0, process_group))
+
+        def preexec() -> None:
+            for step in setup:
+                step()
+
+        popen = subprocess.Popen(
+            argv, executable=executable, preexec_fn=preexec if setup else None, **popen_args
+        )
+        return cls(popen)
+
+    def _watch(self) -> None:
+        try:
+            self._pidfd = os.pidfd_open(self.pid)
+        except (AttributeError, OSError):
+            # No pidfd support: block on wait4 in a worker thread instead
+            task = self._loop.run_in_executor(None, os.wait4, self.pid, 0)
+            task.add_done_callback(self._on_thread_wait)
+            return
+        self._loop.add_reader(self._pidfd, self._on_pidfd_readable)
+
+    def _on_pidfd_readable(self) -> None:
+        try:
+            pid, status, rusage = os.wait4(self.pid, os.WNOHANG)
+        except ChildProcessError:
+            pid, status, rusage = self.pid, 255 << 8, None
+        if pid == 0:
+            return
+        self._loop.remove_reader(self._pidfd)
+        os.close(self._pidfd)
+        self._pidfd = -1
+        self._set_exited(status, rusage)
+
+    def _on_thread_wait(self, task: asyncio.Future) -> None:
+        try:
+            _, status, rusage = task.result()
+        except ChildProcessError:
+            status, rusage = 255 << 8, None
+        self._set_exited(status, rusage)
+
+    def _set_exited(self, status: int, rusage: Any) -> None:
+        self.returncode = os.waitstatus_to_exitcode(status)
+        self.rusage = rusage
+        # Keep Popen from trying to reap the child again
+        self.popen.returncode = self.returncode
+        if not self._exited.done():
+            self._exited.set_result(self.returncode)
+
+    async def wait(self) -> int:
+        """Waits for the child to exit and returns its exit code (negative for a signal)."""
+        return await asyncio.shield(self._exited)
+
+    def send_signal(self, sig: int) -> None:
+        if self.returncode is not None:
+            return
+        try:
+            os.kill(self.pid, sig)
+        except ProcessLookupError:
+            pass
+
+    def kill(self) -> None:
+        self.send_signal(signal.SIGKILL)
+
+    def add_usage_to(self, usage: ResourceUsage) -> None:
+        """Adds the resources of the exited child to usage."""
+        if self.rusage is not None:
+            usage.add_rusage(self.rusage, self.inherited_rss_kb)
+
+
+async def open_reader(pipe: Any) -> asyncio.StreamReader:
+    """Wraps the read end of a pipe, such as Popen.stdout, in an asyncio StreamReader."""
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader(loop=loop)
+    await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader, loop=loop), pipe)
+    return reader
+
+
+class OrphanSweeper:
+    """
+    Tracks the commands that are running and stops what they leave behind.
+
+    Every command gets an id that its processes inherit through
+    COMMAND_MARKER_ENV. Once a command finished, any process still carrying its
+    id is an orphan, such as a dev server started in the background or a
+    daemon that called setsid. sweep() scans /proc for them and kills them;
+    start() runs it periodically. Killed orphans are reaped by init, so a
+    server running as PID 1 in a container needs an init such as tini.
+    """
+
+    def __init__(
+        self,
+        interval: float = DEFAULT_SWEEP_INTERVAL,
+        grace_period: float = DEFAULT_KILL_GRACE_PERIOD,
+    ):
+        self.interval = interval
+        self.grace_period = grace_period
+        self.prefix = f"{os.getpid()}-"
+        self.active: Set[str] = set()
+        self.stats: Dict[str, int] = {
+            "sweeps": 0,
+            "groups_terminated": 0,
+            "sigkill_escalations": 0,
+            "orphans_killed": 0,
+        }
+        self._counter = 0
+        self._task: Optional[asyncio.Task] = None
+        self._background: Set[asyncio.Task] = set()
+
+    def register(self) -> str:
+        """Returns a new command id and marks the command as running."""
+        self._counter += 1
+        command_id = f"{self.prefix}{self._counter}"
+        self.active.add(command_id)
+        return command_id
+
+    def unregister(self, command_id: str) -> None:
+        self.active.discard(command_id)
+
+    def start(self) -> None:
+        if self._task is None and self.interval > 0:
+            self._task = asyncio.ensure_future(self._run())
+
+    async def close(self) -> None:
+        tasks = list(self._background)
+        if self._task is not None:
+            tasks.append(self._task)
+            self._task.cancel()
+            self._task = None
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                self.sweep()
+            except Exception as e:
+                logger.warning(f"Orphan sweep failed: {str(e)}")
+
+    def run_in_background(self, coroutine: Any) -> None:
+        """Runs a cleanup coroutine that must not be tied to the caller's task."""
+        task = asyncio.ensure_future(coroutine)
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    def sweep(self) -> int:
+        """Kills orphaned command processes and returns how many were found."""
+        self.stats["sweeps"] += 1
+        killed = 0
+        try:
+            entries = os.listdir("/proc")
+        except OSError:
+            return 0
+        for entry in entries:
+            if not entry.isdigit():
+                continue
+            pid = int(entry)
+            if self._is_orphan(pid):
+                try:
+                    os.kill(pid, signal.SIGKILL)
+                    killed += 1
+                except ProcessLookupError:
+                    pass
+        self.stats["orphans_killed"] += killed
+        return killed
+
+    def _is_orphan(self, pid: int) -> bool:
+        try:
+            with open(f"/proc/{pid}/environ", "rb") as f:
+                environ = f.read()
+        except OSError:
+            return False
+        marker = f"{COMMAND_MARKER_ENV}={self.prefix}".encode()
+        for variable in environ.split(b"\0"):
+            if variable.startswith(marker):
+                command_id = variable.split(b"=", 1)[1].decode()
+                return command_id not in self.active
+        return False
+
+
+class ProcessGroup:
+    """
+    The processes of one command, started in a process group of their own.
+
+    The first process spawned leads the group, later ones join it. All of them
+    carry the command's marker so the sweeper can find those that escape the
+    group. Call close() once the command is done.
+    """
+
+    def __init__(self, sweeper: OrphanSweeper):
+        self.sweeper = sweeper
+        self.command_id = sweeper.register()
+        self.pgid: Optional[int] = None
+
+    def spawn(
+        self,
+        argv: List[str],
+        executable: Optional[str] = None,
+        limits: Optional[ResourceLimits] = None,
+        new_session: bool = False,
+        env: Optional[Dict[str, str]] = None,
+        **popen_args: Any,
+    ) -> ChildProcess:
+        """
+        Starts a process of this command; see ChildProcess.spawn.
+
+        With new_session the first process also starts a new session, which a
+        process that takes over a terminal needs.
+        """
+        env = dict(os.environ if env is None else env)
+        env[COMMAND_MARKER_ENV] = self.command_id
+        if self.pgid is None and new_session:
+            process = ChildProcess.spawn(
+                argv, executable, limits, start_new_session=True, env=env, **popen_args
+            )
+        else:
+            process = ChildProcess.spawn(
+                argv, executable, limits, process_group=self.pgid or 0, env=env, **popen_args
+            )
+        if self.pgid is None:
+            self.pgid = process.pid
+        return process
+
+    def alive(self) -> bool:
+        """True while any process of the group exists."""
+        if self.pgid is None:
+            return False
+        try:
+            os.killpg(self.pgid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            # The pgid now belongs to someone else
+            return False
+        return True
+
+    def signal(self, sig: int) -> None:
+        if self.pgid is None:
+            return
+        try:
+            os.killpg(self.pgid, sig)
+        except (ProcessLookupError, PermissionError):
+            pass
+
+    async def terminate(self, grace_period: Optional[float] = None) -> None:
+        """
+        Sends SIGTERM to the group and SIGKILL to whatever is left after grace_period.
+        """
+        if not self.alive():
+            return
+        if grace_period is None:
+            grace_period = self.sweeper.grace_period
+        self.sweeper.stats["groups_terminated"] += 1
+        self.signal(signal.SIGTERM)
+        # Stopped processes only act on SIGTERM once continued
+        self.signal(signal.SIGCONT)
+        deadline = time.monotonic() + grace_period
+        while self.alive():
+            if time.monotonic() >= deadline:
+                self.sweeper.stats["sigkill_escalations"] += 1
+                self.signal(signal.SIGKILL)
+                break
+            await asyncio.sleep(GROUP_POLL_INTERVAL)
+
+    def terminate_in_background(self) -> None:
+        """Starts terminate() without waiting for it, e.g. from a cancelled task."""
+        if self.alive():
+            self.sweeper.run_in_background(self.terminate())
+
+    def close(self) -> None:
+        """Marks the command as finished; processes it left behind are orphans from now on."""
+        self.sweeper.unregister(self.command_id)
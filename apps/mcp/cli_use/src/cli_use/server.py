@@ -1,7 +1,12 @@
+import codecs
+import concurrent.futures
+import functools
 import os
 import pty
 import re
 import shlex
+import shutil
+import signal
 import subprocess
 import asyncio
 import sys
@@ -9,21 +14,75 @@ import json
 import base64
 import hashlib
 import hmac
+import heapq
 import time
-from dataclasses import dataclass
-from typing import List, Dict, Any, Optional, Set
+import logging
+import weakref
+from dataclasses import dataclass, field, replace
+from typing import List, Dict, Any, Optional, Set, Tuple, Callable, Awaitable, Hashable
 from urllib.parse import parse_qsl
 
 import aiohttp
-import mcp.server.stdio
 import mcp.types as types
 from mcp.server import NotificationOptions, Server
 from mcp.server.models import InitializationOptions
 
+from .admission import BACKGROUND_WEIGHT, AdmissionController, AdmissionRejected
+from .batch import BatchError, parse_batch, run_batch
+from .cache import CachedResult, ResultCache
+from .cancellation import CallCancelledError, current_calls, serve
+from .connection import ConnectionContext, current_connection
+from .jobs import JobError, JobManager
+from .paths import PathResolver
+from .lexer import WORD, LexError, tokenize
+from .policy import PolicyViolation, SecurityPolicy, ValidatedCommand, VerdictCache
+from .policy_file import PolicyFileError, PolicyFileWatcher, load_policy_file
+from .stdio import stdio_transport
+from .output import OutputBuffer, OutputStore
+from .process import (
+    COMMAND_MARKER_ENV,
+    ChildProcess,
+    OrphanSweeper,
+    ProcessGroup,
+    ResourceLimits,
+    ResourceUsage,
+    open_reader,
+)
+from .sessions import DEFAULT_MAX_SESSIONS, DEFAULT_SESSION_IDLE_TIMEOUT
+from .shell_pool import ShellWorkerError, ShellWorkerPool
+from .state import StateBackend, create_state_backend
+
+logger = logging.getLogger(__name__)
+
 server = Server("cli_use")
 
-# Global session management
-authenticated_sessions: Set[str] = set()
+# Global session management, shared with other workers by the sqlite backend
+state_backend = create_state_backend(
+    os.getenv("STATE_BACKEND", "memory"),
+    os.getenv("STATE_DB_PATH"),
+    idle_timeout=float(os.getenv("SESSION_IDLE_TIMEOUT", str(DEFAULT_SESSION_IDLE_TIMEOUT))),
+    max_sessions=int(os.getenv("MAX_SESSIONS", str(DEFAULT_MAX_SESSIONS))),
+)
+
+# Bytes requested per read when collecting command output
+OUTPUT_CHUNK_SIZE = 65536
+
+# Number of most CPU-intensive commands listed in the metrics
+MOST_EXPENSIVE_COMMANDS = 10
+ASSIGNMENT_PATTERN = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*=")
+
+# Receives (stream name, decoded text) for every chunk of command output
+OutputCallback = Callable[[str, str], Awaitable[None]]
+
+# Telegram login data is accepted for this long after its auth_date
+AUTH_MAX_AGE = 86400
+
+# Connections kept open to the auth service, and for how long when idle
+AUTH_SERVICE_CONNECTIONS = 8
+AUTH_SERVICE_KEEPALIVE = 60
+
+# Verified logins remembered until they expire
+AUTH_CACHE_SIZE = 1024
 
 class TelegramAuthError(Exception):
     """Telegram authentication related errors"""
@@ -34,12 +93,75 @@ class SessionError(Exception):
     pass
 
 class TelegramAuthValidator:
-    """Validates Telegram authentication tokens using bot token"""
+    """
+    Validates Telegram authentication tokens using bot token
+
+    Without a bot token logins are refused, unless CODER_AUTH_FALLBACK=true
+    lets the auth service at CODER_AUTH_URL verify them instead. Requests to
+    the auth service share one pooled HTTP session, opened by start() or on
+    first use and closed by close(). Verified logins are
+    remembered by (id, auth_date, hash) until they expire, so clients that
+    reconnect with the same login are not verified again.
+    """
     
-    def __init__(self, bot_token: Optional[str] = None, coder_auth_url: Optional[str] = None):
+    def __init__(
+        self,
+        bot_token: Optional[str] = None,
+        coder_auth_url: Optional[str] = None,
+        coder_auth_fallback: Optional[bool] = None,
+    ):
         self.bot_token = bot_token or os.getenv("TELEGRAM_BOT_TOKEN")
         self.coder_auth_url = coder_auth_url or os.getenv("CODER_AUTH_URL", "http://localhost:1780/api/telegram/auth")
+        if coder_auth_fallback is None:
+            coder_auth_fallback = os.getenv("CODER_AUTH_FALLBACK", "false").lower() in ("true", "1", "yes")
+        self.coder_auth_fallback = coder_auth_fallback
         self.allowed_users = self._parse_allowed_users(os.getenv("TELEGRAM_ALLOWED_USERS", "everyone"))
+        self._http: Optional[aiohttp.ClientSession] = None
+        # (id, auth_date, hash) -> (expiry, all fields of the login, user info)
+        self._verified: Dict[tuple, tuple] = {}
+        self.cache_hits = 0
+
+    async def start(self) -> None:
+        """Opens the pooled session used for the auth service."""
+        if self._http is None or self._http.closed:
+            self._http = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(
+                    limit=AUTH_SERVICE_CONNECTIONS, keepalive_timeout=AUTH_SERVICE_KEEPALIVE
+                ),
+                timeout=aiohttp.ClientTimeout(total=10),
+            )
+
+    async def close(self) -> None:
+        if self._http is not None:
+            await self._http.close()
+            self._http = None
+
+    def _cached_user(self, auth_data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        key = (str(auth_data['id']), str(auth_data['auth_date']), auth_data['hash'])
+        entry = self._verified.get(key)
+        if entry is None:
+            return None
+        expiry, fields, user = entry
+        if time.time() >= expiry:
+            del self._verified[key]
+            return None
+        # The hash covers every field, so a login that differs elsewhere is a new one
+        if fields != _login_fields(auth_data):
+            return None
+        self.cache_hits += 1
+        return dict(user)
+
+    def _remember(self, auth_data: Dict[str, Any], user: Dict[str, Any]) -> None:
+        now = time.time()
+        if len(self._verified) >= AUTH_CACHE_SIZE:
+            self._verified = {
+                key: entry for key, entry in self._verified.items() if entry[0] > now
+            }
+            while len(self._verified) >= AUTH_CACHE_SIZE:
+                del self._verified[next(iter(self._verified))]
+        key = (str(auth_data['id']), str(auth_data['auth_date']), auth_data['hash'])
+        expiry = int(auth_data['auth_date']) + AUTH_MAX_AGE
+        self._verified[key] = (expiry, _login_fields(auth_data), dict(user))
     
     def _parse_allowed_users(self, allowed_users_str: str) -> set:
         """Parse allowed users from environment variable"""
@@ -80,20 +202,22 @@ class TelegramAuthValidator:
             auth_json = json.dumps(auth_data)
             base64_token = base64.b64encode(auth_json.encode()).decode()
             
-            async with aiohttp.ClientSession() as session:
-                async with session.post(
-                    self.coder_auth_url,
-                    json={"tgAuthResult": base64_token},
-                    headers={"Content-Type": "application/json"},
-                    timeout=aiohttp.ClientTimeout(total=10)
-                ) as response:
-                    result = await response.json()
+            if self._http is None or self._http.closed:
+                await self.start()
+            async with self._http.post(
+                self.coder_auth_url,
+                json={"tgAuthResult": base64_token},
+                headers={"Content-Type": "application/json"},
+            ) as response:
+                result = await response.json()
+                
+                if result.get("success"):
+                    return result.get("user", {})
+                else:
+                    raise TelegramAuthError(f"Authentication failed: {result.get('error', 'Unknown error')}")
                     
-                    if result.get("success"):
-                        return result.get("user", {})
-                    else:
-                        raise TelegramAuthError(f"Authentication failed: {result.get('error', 'Unknown error')}")
-                        
+        except TelegramAuthError:
+            raise
         except aiohttp.ClientError as e:
             raise TelegramAuthError(f"Failed to connect to auth service: {str(e)}")
         except Exception as e:
@@ -125,7 +249,7 @@ class TelegramAuthValidator:
         return hmac.compare_digest(calculated_hash, auth_hash)
     
     async def validate_auth_data(self, auth_data: Dict[str, Any]) -> Dict[str, Any]:
-        """Main validation method - tries Coder service first, falls back to local"""
+        """Main validation method - checks the hash with the bot token, or asks the Coder service if enabled"""
         # Validate required fields
         required_fields = ['id', 'first_name', 'auth_date', 'hash']
         missing_fields = [field for field in required_fields if field not in auth_data]
@@ -135,31 +259,32 @@ class TelegramAuthValidator:
         # Check auth_date (24 hour expiry)
         auth_date = int(auth_data.get('auth_date', 0))
         current_time = int(time.time())
-        if current_time - auth_date > 86400:  # 24 hours
+        if current_time - auth_date > AUTH_MAX_AGE:  # 24 hours
             raise TelegramAuthError("Authentication token expired")
         
         # Check user access before validation
         username = auth_data.get('username')
-        print(f"🔍 DEBUG: Checking access for user: {username}")
-        print(f"🔍 DEBUG: Allowed users: {self.allowed_users}")
+        logger.debug(f"Checking access for user: {username}")
+        logger.debug(f"Allowed users: {self.allowed_users}")
         
         if not self._is_user_allowed(username):
-            print(f"❌ DEBUG: User {username} not in allowed list")
+            logger.debug(f"User {username} not in allowed list")
             raise TelegramAuthError(f"Access denied. User @{username or 'unknown'} is not authorized to access this system.")
         
-        print(f"✅ DEBUG: User {username} access granted")
-        
-        # TEMPORARY: Skip Coder service, use local validation directly
-        print(f"🔍 DEBUG: Validating auth data: {auth_data}")
+        logger.debug(f"User {username} access granted")
+
+        cached = self._cached_user(auth_data)
+        if cached is not None:
+            return cached
         
         if self.bot_token:
             auth_data_copy = auth_data.copy()
-            print(f"🔍 DEBUG: Using bot token: {self.bot_token[:10]}...")
+            logger.debug(f"Validating login of user {auth_data['id']} with the bot token")
             
             if self.validate_hash_locally(auth_data_copy):
-                print(f"✅ DEBUG: Local validation SUCCESS")
+                logger.debug("Local validation succeeded")
                 # Return user info for successful local validation
-                return {
+                user = {
                     'id': auth_data['id'],
                     'first_name': auth_data['first_name'],
                     'last_name': auth_data.get('last_name', ''),
@@ -167,11 +292,25 @@ class TelegramAuthValidator:
                     'auth_date': auth_data['auth_date']
                 }
             else:
-                print(f"❌ DEBUG: Local validation FAILED")
+                logger.debug("Local validation failed")
                 raise TelegramAuthError("Invalid hash")
+        elif self.coder_auth_fallback:
+            logger.debug("No bot token configured, asking auth service")
+            user = await self.validate_with_coder_service(auth_data)
         else:
-            print(f"❌ DEBUG: No bot token configured")
+            logger.debug("No bot token configured")
             raise TelegramAuthError("Bot token not configured for local validation")
+        self._remember(auth_data, user)
+        return dict(user)
+
+
+def _login_fields(auth_data: Dict[str, Any]) -> tuple:
+    """The fields of a Telegram login that its hash covers, in a comparable form."""
+    return tuple(sorted((str(k), str(v)) for k, v in auth_data.items() if k != 'hash'))
+
+# Connections of sessions that were not started through serve()
+_session_connections: "weakref.WeakKeyDictionary[Any, ConnectionContext]" = weakref.WeakKeyDictionary()
+_local_connection = ConnectionContext()
 
 class SessionManager:
     """Manages authenticated sessions"""
@@ -183,26 +322,101 @@ class SessionManager:
         return hashlib.sha256(session_data.encode()).hexdigest()[:16]
     
     @staticmethod
-    def authenticate_session(session_id: str) -> None:
-        """Mark a session as authenticated"""
-        authenticated_sessions.add(session_id)
+    def authenticate_session(session_id: str, expires_at: Optional[float] = None) -> None:
+        """Mark a session as authenticated, at most until expires_at"""
+        state_backend.add_session(session_id, expires_at)
     
     @staticmethod
     def is_authenticated(session_id: str) -> bool:
-        """Check if a session is authenticated"""
-        return session_id in authenticated_sessions
+        """Check if a session is authenticated, extending its idle timeout"""
+        return state_backend.touch_session(session_id)
     
     @staticmethod
     def deauthenticate_session(session_id: str) -> None:
         """Remove session authentication"""
-        authenticated_sessions.discard(session_id)
+        state_backend.discard_session(session_id)
     
+    @staticmethod
+    def get_connection() -> ConnectionContext:
+        """
+        Context of the connection the current request came in on.
+
+        Connections served through serve() carry their own context. Requests of
+        sessions run without it are told apart by their mcp ServerSession, and
+        calls outside of any request share one local context.
+        """
+        connection = current_connection()
+        if connection is not None:
+            return connection
+        try:
+            session = server.request_context.session
+        except LookupError:
+            return _local_connection
+        connection = _session_connections.get(session)
+        if connection is None:
+            connection = _session_connections[session] = ConnectionContext()
+        return connection
+
     @staticmethod
     def get_session_id_from_request() -> Optional[str]:
         """Extract session ID from current request context"""
-        # In a real implementation, this would extract from HTTP headers or connection context
-        # For now, we'll use a simple approach with connection tracking
-        return getattr(server, '_current_session_id', None)
+        return SessionManager.get_connection().session_id
+
+    @staticmethod
+    def get_session_key() -> str:
+        """Key that identifies the caller, e.g. as the owner of background jobs"""
+        session_id = SessionManager.get_session_id_from_request()
+        if session_id:
+            return session_id
+        try:
+            # Unique across the workers sharing the state backend
+            return f"connection-{os.getpid()}-{id(server.request_context.session)}"
+        except LookupError:
+            return "local"
+
+class ToolListSubscribers:
+    """
+    Connections that listed the tools, to be notified when the list changes.
+
+    Sessions are held weakly and forgotten once their connection is gone.
+    """
+
+    def __init__(self) -> None:
+        self._sessions: "weakref.WeakSet[Any]" = weakref.WeakSet()
+        self._tasks: Set[asyncio.Task] = set()
+        self.notifications = 0
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def add_current(self) -> None:
+        """Subscribes the session of the request being handled, if any."""
+        try:
+            self._sessions.add(server.request_context.session)
+        except LookupError:
+            pass
+
+    def notify(self, *_: Any) -> None:
+        """Sends tools/list_changed to every subscribed session."""
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        for session in list(self._sessions):
+            task = asyncio.ensure_future(self._send(session))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _send(self, session: Any) -> None:
+        try:
+            await session.send_tool_list_changed()
+            self.notifications += 1
+        except Exception as e:
+            logger.debug(f"Dropping tool list subscriber: {str(e)}")
+            self._sessions.discard(session)
+
+
+tool_list_subscribers = ToolListSubscribers()
 
 def require_authentication(func):
     """Decorator to require authentication for tool calls"""
@@ -260,16 +474,227 @@ class SecurityConfig:
     allow_all_commands: bool = False
     allow_all_flags: bool = False
     allow_shell_operators: bool = False
+    max_concurrent_commands: int = 32
+    command_rate_limit: float = 10.0
+    command_burst: int = 40
+    max_queued_per_session: int = 32
+    shell_pool_size: int = 0
+    shell_pool_max_commands: int = 100
+    output_memory_limit: int = 1024 * 1024
+    output_spill_limit: int = 256 * 1024 * 1024
+    output_preview_bytes: int = 64 * 1024
+    cacheable_commands: set[str] = field(default_factory=set)
+    result_cache_bytes: int = 16 * 1024 * 1024
+    max_jobs_per_session: int = 4
+    max_finished_jobs_per_session: int = 16
+    job_timeout: int = 3600
+    max_batch_commands: int = 32
+    batch_max_parallel: int = 8
+    command_cpu_limit: Optional[int] = None
+    command_memory_limit: Optional[int] = None
+    command_max_open_files: Optional[int] = None
+    command_max_processes: Optional[int] = None
+    kill_grace_period: float = 2.0
+    orphan_sweep_interval: float = 30.0
+    validation_cache_size: int = 4096
+    path_cache_size: int = 4096
+    policy_file: Optional[str] = None
+    policy_reload_interval: float = 2.0
+
+
+@dataclass
+class CommandResult:
+    """
+    Result of a command run by CommandExecutor.execute_async
+
+    stdout and stderr hold the complete output when it fits in
+    output_preview_bytes, otherwise a head/tail preview. In that case the full
+    output is kept in the executor's output store under output_id, for the
+    session that ran the command.
+    """
+
+    args: str
+    returncode: int
+    stdout: str
+    stderr: str
+    output_id: Optional[str] = None
+    stdout_bytes: int = 0
+    stderr_bytes: int = 0
+    usage: Optional[ResourceUsage] = None
+
+
+def _command_name(command_string: str) -> str:
+    """The name of the program a command string starts, without its directory."""
+    try:
+        tokens = tokenize(command_string)
+    except LexError:
+        return ""
+    for token in tokens:
+        # Variable assignments before the command may carry secrets as well
+        if token.kind == WORD and not ASSIGNMENT_PATTERN.match(token.value):
+            return os.path.basename(token.value)
+    return ""
 
 
 class CommandExecutor:
-    def __init__(self, allowed_dir: str, security_config: SecurityConfig):
+    def __init__(
+        self,
+        allowed_dir: str,
+        security_config: SecurityConfig,
+        state: Optional[StateBackend] = None,
+    ):
         if not allowed_dir or not os.path.exists(allowed_dir):
             raise ValueError("Valid ALLOWED_DIR is required")
         self.allowed_dir = os.path.abspath(os.path.realpath(allowed_dir))
+        # Settings from the environment, which a policy file overrides
+        self.base_config = security_config
+        self.policy_watcher: Optional[PolicyFileWatcher] = None
+        if security_config.policy_file:
+            try:
+                security_config = replace(
+                    security_config, **load_policy_file(security_config.policy_file)
+                )
+            except PolicyFileError as e:
+                raise ValueError(str(e))
+            self.policy_watcher = PolicyFileWatcher(
+                security_config.policy_file,
+                self.reload_policy,
+                interval=security_config.policy_reload_interval,
+            )
         self.security_config = security_config
         self.shell_path = self._detect_shell()
-    
+        # Rate limits sessions and shares the execution slots fairly between them
+        self.admission = AdmissionController(
+            security_config.max_concurrent_commands,
+            rate=security_config.command_rate_limit,
+            burst=security_config.command_burst,
+            max_queued_per_session=security_config.max_queued_per_session,
+        )
+        self.outputs = OutputStore()
+        self.limits = ResourceLimits(
+            cpu_seconds=security_config.command_cpu_limit,
+            address_space_bytes=security_config.command_memory_limit,
+            open_files=security_config.command_max_open_files,
+            max_processes=security_config.command_max_processes,
+        )
+        self.sweeper = OrphanSweeper(
+            interval=security_config.orphan_sweep_interval,
+            grace_period=security_config.kill_grace_period,
+        )
+        self.paths = PathResolver(self.allowed_dir, max_entries=security_config.path_cache_size)
+        self.policy = SecurityPolicy.compile(self.allowed_dir, security_config, self.paths)
+        self.verdicts = VerdictCache(security_config.validation_cache_size)
+        # Called with the new policy after every reload
+        self.policy_listeners: List[Callable[[SecurityPolicy], None]] = []
+        self._policy_reloads = {"reloads": 0, "failures": 0}
+        self.shell_pool: Optional[ShellWorkerPool] = None
+        if security_config.shell_pool_size > 0:
+            self.shell_pool = ShellWorkerPool(
+                self._build_worker_args(),
+                self.allowed_dir,
+                size=security_config.shell_pool_size,
+                max_commands=security_config.shell_pool_max_commands,
+                prelude=self.limits.ulimit_command(),
+                grace_period=security_config.kill_grace_period,
+            )
+        # Totals over all executed commands, and the ones that used the most CPU
+        self._usage_totals: Dict[str, float] = {
+            "commands": 0,
+            "wall_time": 0.0,
+            "user_time": 0.0,
+            "system_time": 0.0,
+            "output_bytes": 0,
+            "max_rss_kb": 0,
+            "cancelled": 0,
+        }
+        self._most_expensive: List[tuple] = []
+        self._usage_counter = 0
+        self.result_cache: Optional[ResultCache] = None
+        if security_config.cacheable_commands:
+            self.result_cache = ResultCache(
+                self.allowed_dir,
+                security_config.cacheable_commands,
+                max_bytes=security_config.result_cache_bytes,
+            )
+        self.jobs = JobManager(
+            self,
+            max_running_per_owner=security_config.max_jobs_per_session,
+            max_finished_per_owner=security_config.max_finished_jobs_per_session,
+            timeout=security_config.job_timeout,
+            state=state,
+        )
+
+    async def start(self) -> None:
+        """
+        Prepares long-lived execution resources, such as pre-warming the shell pool,
+        watching allowed_dir for the result and path caches and sweeping for orphans.
+        """
+        self.sweeper.start()
+        self.paths.start()
+        if self.policy_watcher is not None:
+            self.policy_watcher.start()
+        if self.result_cache is not None:
+            self.result_cache.start()
+        if self.shell_pool is not None:
+            await self.shell_pool.start()
+
+    async def close(self) -> None:
+        """
+        Releases long-lived execution resources, cancelling background jobs.
+        """
+        await self.jobs.close()
+        if self.policy_watcher is not None:
+            await self.policy_watcher.close()
+        if self.shell_pool is not None:
+            await self.shell_pool.close()
+        if self.result_cache is not None:
+            self.result_cache.stop()
+        self.paths.stop()
+        await self.sweeper.close()
+        self.outputs.clear()
+
+    def metrics(self) -> Dict[str, Any]:
+        """
+        Returns counters describing the executor's work so far.
+        """
+        return {
+            "commands": dict(self._usage_totals),
+            "most_expensive_commands": [
+                {"command": command, **usage}
+                for _, _, command, usage in sorted(self._most_expensive, reverse=True)
+            ],
+            "processes": {"running_commands": len(self.sweeper.active), **self.sweeper.stats},
+            "admission": self.admission.stats(),
+            "validation_cache": self.verdicts.stats(),
+            "path_cache": self.paths.stats(),
+            "policy": {
+                "version": self.policy.version,
+                "file": self.base_config.policy_file,
+                **self._policy_reloads,
+            },
+            "result_cache": self.result_cache.stats() if self.result_cache is not None else None,
+        }
+
+    def _record_usage(self, command_string: str, usage: ResourceUsage) -> None:
+        """
+        Adds a command's resource usage to the totals reported by metrics().
+        """
+        totals = self._usage_totals
+        totals["commands"] += 1
+        totals["wall_time"] += usage.wall_time
+        totals["user_time"] += usage.user_time or 0.0
+        totals["system_time"] += usage.system_time or 0.0
+        totals["output_bytes"] += usage.stdout_bytes + usage.stderr_bytes
+        totals["max_rss_kb"] = max(totals["max_rss_kb"], usage.max_rss_kb or 0)
+
+        self._usage_counter += 1
+        # /metrics is served without authentication, so arguments are left out
+        entry = (usage.cpu_time, self._usage_counter, _command_name(command_string), usage.as_dict())
+        if len(self._most_expensive) < MOST_EXPENSIVE_COMMANDS:
+            heapq.heappush(self._most_expensive, entry)
+        else:
+            heapq.heappushpop(self._most_expensive, entry)
+
     def _detect_shell(self) -> str:
         """
         Detect the available shell, preferring zsh but falling back to bash or sh.
@@ -281,30 +706,51 @@ class CommandExecutor:
         # Fallback to system shell
         return os.environ.get("SHELL", "/bin/sh")
 
-    def _normalize_path(self, path: str) -> str:
+    def _build_shell_args(self, command_string: str) -> List[str]:
         """
-        Normalizes a path and ensures it's within allowed directory.
+        Builds the argv used to run a command string through the detected shell.
         """
-        try:
-            if os.path.isabs(path):
-                # If absolute path, check directly
-                real_path = os.path.abspath(os.path.realpath(path))
-            else:
-                # If relative path, combine with allowed_dir first
-                real_path = os.path.abspath(
-                    os.path.realpath(os.path.join(self.allowed_dir, path))
-                )
+        if "zsh" in self.shell_path:
+            return [self.shell_path, "-l", "-c", command_string]
+        return [self.shell_path, "-c", command_string]
 
-            if not self._is_path_safe(real_path):
-                raise CommandSecurityError(
-                    f"Path '{path}' is outside of allowed directory: {self.allowed_dir}"
-                )
+    def _plan_direct_exec(
+        self, command: str, args: List[str]
+    ) -> Optional[List[tuple[str, List[str]]]]:
+        """
+        Plans a validated command as a single stage executed without a shell.
 
-            return real_path
-        except CommandSecurityError:
-            raise
-        except Exception as e:
-            raise CommandSecurityError(f"Invalid path '{path}': {str(e)}")
+        Returns None when the command is not an executable on PATH (for example a
+        shell builtin, or a tool only added to PATH by the login profile), in which
+        case it has to go through the shell.
+        """
+        executable = shutil.which(command)
+        if executable is None:
+            return None
+        return [(executable, [command] + args)]
+
+    def _plan_pipeline(self, argvs: List[List[str]]) -> Optional[List[tuple[str, List[str]]]]:
+        """
+        Plans the validated stages of a single command or '|' pipeline as directly
+        wired processes.
+
+        Returns None if a stage cannot be executed directly.
+        """
+        stages = []
+        for argv in argvs:
+            stage = self._plan_direct_exec(argv[0], argv[1:])
+            if stage is None:
+                return None
+            stages.extend(stage)
+        return stages
+
+    def _build_worker_args(self) -> List[str]:
+        """
+        Builds the argv of a persistent shell worker that reads commands from stdin.
+        """
+        if "zsh" in self.shell_path:
+            return [self.shell_path, "-l", "-s"]
+        return [self.shell_path, "-s"]
 
     def validate_command(self, command_string: str) -> tuple[str, List[str]]:
         """
@@ -317,300 +763,197 @@ class CommandExecutor:
         For commands without shell operators, splits into command and arguments and validates
         each part according to security rules.
 
+        The command string is tokenized once, honoring quotes and escapes, so an
+        operator inside quotes is part of an argument. Redirection targets are
+        validated as paths. Verdicts are computed by the compiled SecurityPolicy
+        and cached per command string. Paths are resolved again on every call.
+        Unquoted glob patterns are expanded against the allowed directory, and
+        every match is checked like a path argument.
+
         Args:
             command_string (str): The command string to validate and parse.
 
         Returns:
             tuple[str, List[str]]: A tuple containing:
                 - For regular commands: The command name (str) and list of arguments (List[str])
-                - For commands with shell operators: The full command string and empty args list
+                - For commands run by a shell: The full command string and empty args list
 
         Raises:
             CommandSecurityError: If any part of the command fails security validation.
         """
+        validated = self._validate(command_string)
+        if validated.shell:
+            return command_string, []
+        return validated.command, validated.args
 
-        # Define shell operators
-        shell_operators = ["&&", "||", "|", ">", ">>", "<", "<<", ";"]
-
-        # Check if command contains shell operators
-        contains_shell_operator = any(
-            operator in command_string for operator in shell_operators
-        )
-
-        if contains_shell_operator:
-            # Check if shell operators are allowed
-            if not self.security_config.allow_shell_operators:
-                # If shell operators are not allowed, raise an error
-                for operator in shell_operators:
-                    if operator in command_string:
-                        raise CommandSecurityError(
-                            f"Shell operator '{operator}' is not supported. Set ALLOW_SHELL_OPERATORS=true to enable."
-                        )
-
-            # Split the command by shell operators and validate each part
-            return self._validate_command_with_operators(
-                command_string, shell_operators
-            )
-
-        # Process single command without shell operators
-        return self._validate_single_command(command_string)
-
-    def _is_url_path(self, path: str) -> bool:
-        """
-        Checks if a given path is a URL of type http or https.
-
-        Args:
-            path (str): The path to check.
-
-        Returns:
-            bool: True if the path is a URL, False otherwise.
+    def reload_policy(self) -> bool:
         """
-        url_pattern = re.compile(r"^https?://")
-        return bool(url_pattern.match(path))
-
-    def _is_path_safe(self, path: str) -> bool:
-        """
-        Checks if a given path is safe to access within allowed directory boundaries.
-
-        Validates that the absolute resolved path is within the allowed directory
-        to prevent directory traversal attacks.
+        Reads the policy file again and swaps in the policy compiled from it.
 
-        Args:
-            path (str): The path to validate.
+        The settings, the compiled policy and the verdict cache are replaced
+        together without yielding to the event loop, so every command is
+        checked against either the old or the new policy as a whole. Commands
+        that already passed validation finish under the old one. If the file is
+        invalid, the current policy stays.
 
         Returns:
-            bool: True if path is within allowed directory, False otherwise.
-                Returns False if path resolution fails for any reason.
-
-        Private method intended for internal use only.
+            bool: Whether a changed policy was swapped in.
         """
+        if not self.base_config.policy_file:
+            return False
         try:
-            # Resolve any symlinks and get absolute path
-            real_path = os.path.abspath(os.path.realpath(path))
-            allowed_dir_real = os.path.abspath(os.path.realpath(self.allowed_dir))
-
-            # Check if the path starts with allowed_dir
-            return real_path.startswith(allowed_dir_real)
-        except Exception:
+            security_config = replace(
+                self.base_config, **load_policy_file(self.base_config.policy_file)
+            )
+        except PolicyFileError as e:
+            self._policy_reloads["failures"] += 1
+            logger.error(f"Keeping security policy version {self.policy.version}: {str(e)}")
+            return False
+        if security_config == self.security_config:
             return False
+        policy = SecurityPolicy.compile(
+            self.allowed_dir, security_config, self.paths, version=self.policy.version + 1
+        )
+        self.security_config = security_config
+        self.policy = policy
+        self.verdicts.clear()
+        self._policy_reloads["reloads"] += 1
+        logger.info(f"Loaded security policy version {policy.version}")
+        for listener in list(self.policy_listeners):
+            try:
+                listener(policy)
+            except Exception as e:
+                logger.warning(f"Policy listener failed: {str(e)}")
+        return True
 
-    def _validate_single_command(self, command_string: str) -> tuple[str, List[str]]:
+    def _validate(self, command_string: str) -> ValidatedCommand:
         """
-        Validates a single command without shell operators.
-
-        Args:
-            command_string (str): The command string to validate.
-
-        Returns:
-            tuple[str, List[str]]: A tuple containing the command and validated arguments.
-
-        Raises:
-            CommandSecurityError: If the command fails validation.
+        Validates a command string like validate_command, returning how to run it.
         """
+        verdict = self.verdicts.get(command_string)
+        if verdict is None:
+            verdict = self.policy.check(command_string)
+            self.verdicts.put(command_string, verdict)
         try:
-            parts = shlex.split(command_string)
-            if not parts:
-                raise CommandSecurityError("Empty command")
-
-            command, args = parts[0], parts[1:]
-
-            # Validate command if not in allow-all mode
-            if (
-                not self.security_config.allow_all_commands
-                and command not in self.security_config.allowed_commands
-            ):
-                raise CommandSecurityError(f"Command '{command}' is not allowed")
-
-            # Process and validate arguments
-            validated_args = []
-            for arg in args:
-                if arg.startswith("-"):
-                    if (
-                        not self.security_config.allow_all_flags
-                        and arg not in self.security_config.allowed_flags
-                    ):
-                        raise CommandSecurityError(f"Flag '{arg}' is not allowed")
-                    validated_args.append(arg)
-                    continue
-
-                # For any path-like argument, validate it
-                if "/" in arg or "\\" in arg or os.path.isabs(arg) or arg == ".":
-                    if self._is_url_path(arg):
-                        # If it's a URL, we don't need to normalize it
-                        validated_args.append(arg)
-                        continue
-
-                    normalized_path = self._normalize_path(arg)
-                    validated_args.append(normalized_path)
-                else:
-                    # For non-path arguments, add them as-is
-                    validated_args.append(arg)
-
-            return command, validated_args
-
-        except ValueError as e:
-            raise CommandSecurityError(f"Invalid command format: {str(e)}")
-
-    def _validate_command_with_operators(
-        self, command_string: str, shell_operators: List[str]
-    ) -> tuple[str, List[str]]:
+            validated = self.policy.apply(verdict)
+        except PolicyViolation as e:
+            raise CommandSecurityError(str(e))
+        if validated.shell:
+            validated.command = command_string
+        return validated
+
+    async def _execute_with_pty(
+        self,
+        command_string: str,
+        buffers: Dict[str, OutputBuffer],
+        on_output: Optional[OutputCallback] = None,
+        timeout: Optional[float] = None,
+        usage: Optional[ResourceUsage] = None,
+    ) -> int:
         """
-        Validates a command string that contains shell operators.
-
-        Splits the command string by shell operators and validates each part individually.
-        If all parts are valid, returns the original command to be executed with shell=True.
-
-        Args:
-            command_string (str): The command string containing shell operators.
-            shell_operators (List[str]): List of shell operators to split by.
-
-        Returns:
-            tuple[str, List[str]]: A tuple containing the command and empty args list
-                                  (since the command will be executed with shell=True)
+        Execute command using PTY for better terminal compatibility.
 
-        Raises:
-            CommandSecurityError: If any part of the command fails validation.
+        The PTY master is read from an event loop reader callback, so output is
+        picked up as soon as the child writes it instead of on a polling interval.
+        Reads of OUTPUT_CHUNK_SIZE bytes go into the stdout buffer and are decoded
+        with an incremental UTF-8 decoder, so multibyte characters split across
+        reads are kept intact. Child exit is awaited through the loop's child
+        watcher. stdout and stderr share the terminal, so all output is reported
+        as stdout. The command runs in a session of its own, which is terminated
+        with it. Returns the exit code.
         """
-        # Create a regex pattern to split by any of the shell operators
-        # We need to escape special regex characters in the operators
-        escaped_operators = [re.escape(op) for op in shell_operators]
-        pattern = "|".join(escaped_operators)
-
-        # Split the command string by shell operators, keeping the operators
-        parts = re.split(f"({pattern})", command_string)
-
-        # Filter out empty parts and whitespace-only parts
-        parts = [part.strip() for part in parts if part.strip()]
-
-        # Group commands and operators
-        commands = []
-        i = 0
-        while i < len(parts):
-            if i + 1 < len(parts) and parts[i + 1] in shell_operators:
-                # If next part is an operator, current part is a command
-                if parts[i]:  # Skip empty commands
-                    commands.append(parts[i])
-                i += 2  # Skip the operator
-            else:
-                # If no operator follows, this is the last command
-                if (
-                    parts[i] and parts[i] not in shell_operators
-                ):  # Skip if it's an operator
-                    commands.append(parts[i])
-                i += 1
-
-        # Validate each command individually
-        for cmd in commands:
-            try:
-                # Use the extracted validation method for each command
-                self._validate_single_command(cmd)
-            except CommandSecurityError as e:
-                raise CommandSecurityError(f"Invalid command part '{cmd}': {str(e)}")
-            except ValueError as e:
-                raise CommandSecurityError(
-                    f"Invalid command format in '{cmd}': {str(e)}"
-                )
+        timeout = timeout or self.security_config.command_timeout
+        loop = asyncio.get_running_loop()
+        master, slave = pty.openpty()
+        group = ProcessGroup(self.sweeper)
+        try:
+            os.set_blocking(master, False)
+            process = group.spawn(
+                self._build_shell_args(command_string),
+                limits=self.limits,
+                new_session=True,
+                stdin=slave,
+                stdout=slave,
+                stderr=slave,
+                cwd=self.allowed_dir,
+            )
+        except Exception as e:
+            os.close(master)
+            group.close()
+            raise CommandExecutionError(f"PTY execution failed: {str(e)}")
+        finally:
+            # The child holds its own copies of the slave side
+            os.close(slave)
 
-        # If we get here, all commands passed validation
-        # Return the original command string to be executed with shell=True
-        return command_string, []
+        output = buffers["stdout"]
+        chunks: asyncio.Queue = asyncio.Queue()
 
-    def _execute_with_pty(self, command_string: str) -> subprocess.CompletedProcess:
-        """
-        Execute command using PTY for better terminal compatibility.
-        """
-        import signal
-        import time
-        import select
-        
-        # Create a result object to mimic subprocess.CompletedProcess
-        class PTYResult:
-            def __init__(self):
-                self.stdout = ""
-                self.stderr = ""
-                self.returncode = 0
-        
-        result = PTYResult()
-        shell_path = self.shell_path  # Store shell path for child process
-        
-        try:
-            # Create PTY
-            master, slave = pty.openpty()
-            
-            # Fork process
-            pid = os.fork()
-            if pid == 0:  # Child process
-                os.close(master)
-                os.dup2(slave, 0)  # stdin
-                os.dup2(slave, 1)  # stdout
-                os.dup2(slave, 2)  # stderr
-                os.close(slave)
-                
-                # Change to allowed directory
-                os.chdir(self.allowed_dir)
-                
-                # Execute command in shell
-                shell_args = [shell_path, "-c", command_string]
-                if "zsh" in shell_path:
-                    shell_args = [shell_path, "-l", "-c", command_string]
-                os.execve(shell_path, shell_args, os.environ)
-            else:  # Parent process
-                os.close(slave)
-                
-                # Set non-blocking on master
-                import fcntl
-                flags = fcntl.fcntl(master, fcntl.F_GETFL)
-                fcntl.fcntl(master, fcntl.F_SETFL, flags | os.O_NONBLOCK)
-                
-                output = ""
-                start_time = time.time()
-                
-                while True:
-                    # Check if process is still running
-                    try:
-                        pid_result = os.waitpid(pid, os.WNOHANG)
-                        if pid_result[0] != 0:  # Process has exited
-                            result.returncode = pid_result[1]
-                            break
-                    except OSError:
-                        break
-                    
-                    # Check for timeout
-                    if time.time() - start_time > self.security_config.command_timeout:
-                        os.kill(pid, signal.SIGTERM)
-                        time.sleep(0.1)
-                        try:
-                            os.kill(pid, signal.SIGKILL)
-                        except:
-                            pass
-                        raise CommandTimeoutError(f"Command timed out after {self.security_config.command_timeout} seconds")
-                    
-                    # Read available data
-                    try:
-                        ready, _, _ = select.select([master], [], [], 0.1)
-                        if ready:
-                            data = os.read(master, 1024).decode('utf-8', errors='ignore')
-                            output += data
-                    except OSError:
-                        break
-                
-                # Read any remaining data
+        def read_master() -> bool:
+            """Reads what is currently available; returns False once the PTY is closed."""
+            while True:
                 try:
-                    while True:
-                        data = os.read(master, 1024).decode('utf-8', errors='ignore')
-                        if not data:
-                            break
-                        output += data
+                    data = os.read(master, OUTPUT_CHUNK_SIZE)
+                except BlockingIOError:
+                    return True
                 except OSError:
-                    pass
-                
-                os.close(master)
-                result.stdout = output
-                
-        except Exception as e:
-            raise CommandExecutionError(f"PTY execution failed: {str(e)}")
-        
-        return result
+                    # EIO: every slave descriptor has been closed
+                    return False
+                if not data:
+                    return False
+                output.write(data)
+                if on_output is not None:
+                    chunks.put_nowait(data)
+
+        def on_readable() -> None:
+            if not read_master():
+                loop.remove_reader(master)
+
+        async def forward_chunks() -> None:
+            decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+            while True:
+                data = await chunks.get()
+                if data is None:
+                    break
+                if on_output is not None:
+                    text = decoder.decode(data)
+                    if text:
+                        await on_output("stdout", text)
+            if on_output is not None:
+                text = decoder.decode(b"", final=True)
+                if text:
+                    await on_output("stdout", text)
+
+        loop.add_reader(master, on_readable)
+        forwarder = asyncio.ensure_future(forward_chunks())
+        try:
+            try:
+                await asyncio.wait_for(process.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                await group.terminate()
+                await process.wait()
+                raise CommandTimeoutError(
+                    f"Command timed out after {timeout} seconds"
+                )
+            except asyncio.CancelledError:
+                group.terminate_in_background()
+                raise
+            # Stop background processes the command left on the terminal
+            await group.terminate()
+            # Collect whatever the child wrote right before exiting. Background
+            # processes may keep the PTY open, so do not wait for EOF.
+            loop.remove_reader(master)
+            read_master()
+            chunks.put_nowait(None)
+            await forwarder
+        finally:
+            loop.remove_reader(master)
+            forwarder.cancel()
+            os.close(master)
+            group.close()
+            if usage is not None:
+                process.add_usage_to(usage)
+
+        return process.returncode
 
     def execute(self, command_string: str) -> subprocess.CompletedProcess:
         """
@@ -643,53 +986,29 @@ class CommandExecutor:
             )
 
         try:
-            command, args = self.validate_command(command_string)
-
-            # Check if this is a command with shell operators
-            shell_operators = ["&&", "||", "|", ">", ">>", "<", "<<", ";"]
-            use_shell = any(operator in command_string for operator in shell_operators)
-
-            # Double-check that shell operators are allowed if they are present
-            if use_shell and not self.security_config.allow_shell_operators:
-                for operator in shell_operators:
-                    if operator in command_string:
-                        raise CommandSecurityError(
-                            f"Shell operator '{operator}' is not supported. Set ALLOW_SHELL_OPERATORS=true to enable."
-                        )
+            validated = self._validate(command_string)
+            command, args, use_shell = validated.command, validated.args, validated.shell
 
             # Try PTY for claude commands to get better terminal environment
             if "claude" in command_string:
-                return self._execute_with_pty(command_string)
+                shell_command = command if use_shell else shlex.join([command] + args)
+                return self._execute_with_pty_sync(command_string, shell_command)
             
             if use_shell:
                 # For commands with shell operators, execute through detected shell
-                shell_args = [self.shell_path, "-c", command]
-                if "zsh" in self.shell_path:
-                    shell_args = [self.shell_path, "-l", "-c", command]
-                return subprocess.run(
-                    shell_args,
-                    shell=False,
-                    text=True,
-                    capture_output=True,
-                    timeout=self.security_config.command_timeout,
-                    cwd=self.allowed_dir,
-                    env=os.environ,
-                )
+                shell_args = self._build_shell_args(command)
             else:
                 # For regular commands, execute through detected shell
-                full_command = shlex.join([command] + args)
-                shell_args = [self.shell_path, "-c", full_command]
-                if "zsh" in self.shell_path:
-                    shell_args = [self.shell_path, "-l", "-c", full_command]
-                return subprocess.run(
-                    shell_args,
-                    shell=False,
-                    text=True,
-                    capture_output=True,
-                    timeout=self.security_config.command_timeout,
-                    cwd=self.allowed_dir,
-                    env=os.environ,
-                )
+                shell_args = self._build_shell_args(shlex.join([command] + args))
+            return subprocess.run(
+                shell_args,
+                shell=False,
+                text=True,
+                capture_output=True,
+                timeout=self.security_config.command_timeout,
+                cwd=self.allowed_dir,
+                env=os.environ,
+            )
         except subprocess.TimeoutExpired:
             raise CommandTimeoutError(
                 f"Command timed out after {self.security_config.command_timeout} seconds"
@@ -699,6 +1018,524 @@ class CommandExecutor:
         except Exception as e:
             raise CommandExecutionError(f"Command execution failed: {str(e)}")
 
+    def _execute_with_pty_sync(
+        self, command_string: str, shell_command: str
+    ) -> subprocess.CompletedProcess:
+        """
+        Runs _execute_with_pty for execute() and returns its CompletedProcess.
+
+        The PTY is read on an event loop of its own. When the caller already
+        runs a loop in this thread, that loop runs in a worker thread instead.
+        """
+        buffers = self.new_output_buffers()
+
+        def run() -> int:
+            return asyncio.run(self._execute_with_pty(shell_command, buffers))
+
+        try:
+            try:
+                asyncio.get_running_loop()
+            except RuntimeError:
+                returncode = run()
+            else:
+                with concurrent.futures.ThreadPoolExecutor(max_workers=1) as pool:
+                    returncode = pool.submit(run).result()
+            return subprocess.CompletedProcess(
+                command_string, returncode, buffers["stdout"].text(), buffers["stderr"].text()
+            )
+        finally:
+            self._close_buffers(buffers)
+
+    async def execute_async(
+        self,
+        command_string: str,
+        on_output: Optional[OutputCallback] = None,
+        owner: Hashable = "local",
+    ) -> CommandResult:
+        """
+        Executes a command string without blocking the event loop.
+
+        Applies the same validation as execute(), then runs the command through
+        asyncio.create_subprocess_exec so other clients, tool listings and health
+        checks keep being served while it runs. At most
+        security_config.max_concurrent_commands commands run at once; further
+        calls wait for a free execution slot, which the admission controller
+        hands to the waiting sessions in turn.
+
+        Output is captured in OutputBuffers bounded by output_memory_limit and
+        output_spill_limit. Output larger than output_preview_bytes is returned as
+        a head/tail preview and kept in self.outputs for paging.
+
+        Results of commands listed in security_config.cacheable_commands are
+        served from the result cache while nothing they read has changed.
+
+        Args:
+            command_string (str): The command string to execute.
+            on_output (Optional[OutputCallback]): Awaited with ("stdout" | "stderr", text)
+                for every chunk of output as soon as it is read. Output is still
+                captured for the result.
+            owner (Hashable): Session the command runs for, see SessionManager.get_session_key().
+
+        Returns:
+            CommandResult: The result of the command execution containing
+                stdout, stderr, and return code.
+
+        Raises:
+            CommandSecurityError: If the command fails security validation.
+            CommandTimeoutError: If the command exceeds security_config.command_timeout.
+            CommandExecutionError: If the command could not be executed.
+            AdmissionRejected: If too many commands of owner are waiting to run.
+        """
+        if len(command_string) > self.security_config.max_command_length:
+            raise CommandSecurityError(
+                f"Command exceeds maximum length of {self.security_config.max_command_length}"
+            )
+
+        buffers = self.new_output_buffers()
+        try:
+            validated = self._validate(command_string)
+
+            cache_key = None
+            if self.result_cache is not None and not validated.shell:
+                cache_key = self.result_cache.key_for(validated.command, validated.args)
+            if cache_key is not None:
+                cached = self.result_cache.get(cache_key)
+                if cached is not None:
+                    self._close_buffers(buffers)
+                    return await self._cached_result(command_string, cached, on_output)
+                cache_generation = self.result_cache.generation
+
+            usage = ResourceUsage()
+            returncode = await self._run_validated(
+                command_string, validated, buffers, on_output, None, usage, owner
+            )
+        except (CommandError, AdmissionRejected):
+            self._close_buffers(buffers)
+            raise
+        except Exception as e:
+            self._close_buffers(buffers)
+            raise CommandExecutionError(f"Command execution failed: {str(e)}")
+        except BaseException:
+            self._close_buffers(buffers)
+            raise
+
+        result = self._finish_result(command_string, returncode, buffers, owner)
+        result.usage = usage
+        if cache_key is not None and result.output_id is None:
+            self.result_cache.put(
+                cache_key, result.returncode, result.stdout, result.stderr, cache_generation
+            )
+        return result
+
+    async def _cached_result(
+        self, command_string: str, cached: CachedResult, on_output: Optional[OutputCallback]
+    ) -> CommandResult:
+        """
+        Builds the CommandResult of a cache hit, replaying its output to on_output.
+        """
+        if on_output is not None:
+            for name, text in (("stdout", cached.stdout), ("stderr", cached.stderr)):
+                if text:
+                    await on_output(name, text)
+        return CommandResult(
+            args=command_string,
+            returncode=cached.returncode,
+            stdout=cached.stdout,
+            stderr=cached.stderr,
+            stdout_bytes=len(cached.stdout.encode()),
+            stderr_bytes=len(cached.stderr.encode()),
+        )
+
+    async def execute_into(
+        self,
+        command_string: str,
+        buffers: Dict[str, OutputBuffer],
+        on_output: Optional[OutputCallback] = None,
+        timeout: Optional[float] = None,
+        usage: Optional[ResourceUsage] = None,
+        owner: Hashable = "local",
+    ) -> int:
+        """
+        Executes a command string, writing its output into caller-owned buffers.
+
+        Validation and the concurrency limit are the same as for execute_async,
+        but results are never cached and the buffers stay open, so the caller can
+        read them while the command runs. Used for background jobs, which get a
+        BACKGROUND_WEIGHT share of the execution slots of their session.
+
+        Args:
+            command_string (str): The command string to execute.
+            buffers (Dict[str, OutputBuffer]): "stdout" and "stderr" buffers, see new_output_buffers().
+            on_output (Optional[OutputCallback]): Awaited for every chunk of output.
+            timeout (Optional[float]): Seconds before the command is killed, defaults to
+                security_config.command_timeout.
+            usage (Optional[ResourceUsage]): Filled in with the resources the command used.
+            owner (Hashable): Session the command runs for.
+
+        Returns:
+            int: The exit code of the command.
+
+        Raises:
+            CommandSecurityError: If the command fails security validation.
+            CommandTimeoutError: If the command exceeds the timeout.
+            CommandExecutionError: If the command could not be executed.
+            AdmissionRejected: If too many commands of owner are waiting to run.
+        """
+        if len(command_string) > self.security_config.max_command_length:
+            raise CommandSecurityError(
+                f"Command exceeds maximum length of {self.security_config.max_command_length}"
+            )
+
+        try:
+            validated = self._validate(command_string)
+
+            return await self._run_validated(
+                command_string,
+                validated,
+                buffers,
+                on_output,
+                timeout,
+                usage or ResourceUsage(),
+                owner,
+                BACKGROUND_WEIGHT,
+            )
+        except (CommandError, AdmissionRejected):
+            raise
+        except Exception as e:
+            raise CommandExecutionError(f"Command execution failed: {str(e)}")
+
+    async def _run_validated(
+        self,
+        command_string: str,
+        validated: ValidatedCommand,
+        buffers: Dict[str, OutputBuffer],
+        on_output: Optional[OutputCallback],
+        timeout: Optional[float],
+        usage: ResourceUsage,
+        owner: Hashable,
+        weight: float = 1.0,
+    ) -> int:
+        """
+        Runs a validated command in an execution slot of owner, accounting for its resources.
+
+        If the awaiting task is cancelled, the command's processes are stopped and
+        the slot is released right away.
+        """
+        async with self.admission.slot(owner, weight):
+            started = time.monotonic()
+            try:
+                return await self._dispatch(
+                    command_string, validated, buffers, on_output, timeout, usage
+                )
+            except asyncio.CancelledError:
+                self._usage_totals["cancelled"] += 1
+                raise
+            finally:
+                usage.wall_time = time.monotonic() - started
+                usage.stdout_bytes = buffers["stdout"].total_bytes
+                usage.stderr_bytes = buffers["stderr"].total_bytes
+                self._record_usage(command_string, usage)
+
+    async def _dispatch(
+        self,
+        command_string: str,
+        validated: ValidatedCommand,
+        buffers: Dict[str, OutputBuffer],
+        on_output: Optional[OutputCallback],
+        timeout: Optional[float] = None,
+        usage: Optional[ResourceUsage] = None,
+    ) -> int:
+        """
+        Picks the cheapest way to run a validated command and returns its exit code.
+        """
+        if validated.shell:
+            shell_command = validated.command
+        else:
+            shell_command = shlex.join([validated.command] + validated.args)
+
+        # Try PTY for claude commands to get better terminal environment
+        if "claude" in command_string:
+            return await self._execute_with_pty(
+                shell_command, buffers, on_output, timeout, usage
+            )
+
+        # Run validated argv directly when no shell features are needed
+        if validated.stages:
+            stages = self._plan_pipeline(validated.stages)
+            if stages is not None:
+                return await self._run_pipeline(stages, buffers, on_output, timeout, usage)
+
+        if self.shell_pool is not None:
+            return await self._run_in_shell_pool(
+                shell_command, buffers, on_output, timeout, usage
+            )
+        return await self._run_pipeline(
+            [(None, self._build_shell_args(shell_command))], buffers, on_output, timeout, usage
+        )
+
+    def new_output_buffers(self) -> Dict[str, OutputBuffer]:
+        """
+        Creates the bounded stdout/stderr capture buffers for one command.
+        """
+        return {
+            name: OutputBuffer(
+                memory_limit=self.security_config.output_memory_limit,
+                spill_limit=self.security_config.output_spill_limit,
+                tail_size=self.security_config.output_preview_bytes // 2,
+            )
+            for name in ("stdout", "stderr")
+        }
+
+    def _close_buffers(self, buffers: Dict[str, OutputBuffer]) -> None:
+        for buffer in buffers.values():
+            buffer.close()
+
+    def _finish_result(
+        self,
+        command_string: str,
+        returncode: int,
+        buffers: Dict[str, OutputBuffer],
+        owner: Hashable = "local",
+    ) -> CommandResult:
+        """
+        Builds the CommandResult, retaining the full output for owner if it does not fit the preview.
+        """
+        preview_bytes = self.security_config.output_preview_bytes
+        output_id = None
+        if all(buffer.fits(preview_bytes) for buffer in buffers.values()):
+            stdout, stderr = buffers["stdout"].text(), buffers["stderr"].text()
+            self._close_buffers(buffers)
+        else:
+            stdout = buffers["stdout"].preview(preview_bytes)
+            stderr = buffers["stderr"].preview(preview_bytes)
+            output_id = self.outputs.add(buffers, owner)
+        return CommandResult(
+            args=command_string,
+            returncode=returncode,
+            stdout=stdout,
+            stderr=stderr,
+            output_id=output_id,
+            stdout_bytes=buffers["stdout"].total_bytes,
+            stderr_bytes=buffers["stderr"].total_bytes,
+        )
+
+    async def _run_pipeline(
+        self,
+        stages: List[tuple[Optional[str], List[str]]],
+        buffers: Dict[str, OutputBuffer],
+        on_output: Optional[OutputCallback] = None,
+        timeout: Optional[float] = None,
+        usage: Optional[ResourceUsage] = None,
+    ) -> int:
+        """
+        Spawns one or more processes connected stdout-to-stdin and collects their output.
+
+        Each stage is an (executable, argv) pair; with executable None, argv[0] is
+        looked up on PATH. Stages are connected with os.pipe directly, without a
+        shell in between. stdout of the last stage and stderr of every stage are
+        read concurrently in chunks of OUTPUT_CHUNK_SIZE into buffers and forwarded
+        to on_output as they arrive. The first stage reads /dev/null so a command
+        can never consume the server's own stdin (the MCP stream in stdio mode).
+
+        Like a shell pipeline, the return code is the one of the last stage. All
+        stages run in one process group. Once they exited, anything they left
+        running in the group is terminated; the same happens to the whole group
+        when the timeout expires or the awaiting task is cancelled.
+        """
+        timeout = timeout or self.security_config.command_timeout
+        group = ProcessGroup(self.sweeper)
+        processes: List[ChildProcess] = []
+        readers: List[asyncio.StreamReader] = []
+        stdin_fd: Optional[int] = None
+        try:
+            for index, (executable, argv) in enumerate(stages):
+                last = index == len(stages) - 1
+                read_fd = write_fd = None
+                if not last:
+                    read_fd, write_fd = os.pipe()
+                try:
+                    process = group.spawn(
+                        argv,
+                        executable=executable,
+                        limits=self.limits,
+                        stdin=subprocess.DEVNULL if stdin_fd is None else stdin_fd,
+                        stdout=subprocess.PIPE if last else write_fd,
+                        stderr=subprocess.PIPE,
+                        cwd=self.allowed_dir,
+                    )
+                except Exception:
+                    if read_fd is not None:
+                        os.close(read_fd)
+                    raise
+                finally:
+                    # The children hold their own copies of the pipe ends
+                    if stdin_fd is not None:
+                        os.close(stdin_fd)
+                    if write_fd is not None:
+                        os.close(write_fd)
+                    stdin_fd = None
+                processes.append(process)
+                stdin_fd = read_fd
+
+            readers.append(await open_reader(processes[-1].popen.stdout))
+            for process in processes:
+                readers.append(await open_reader(process.popen.stderr))
+        except BaseException:
+            group.signal(signal.SIGKILL)
+            group.close()
+            raise
+
+        pumps = [self._pump_stream(readers[0], "stdout", buffers["stdout"], on_output)]
+        pumps.extend(
+            self._pump_stream(reader, "stderr", buffers["stderr"], on_output)
+            for reader in readers[1:]
+        )
+        pumping = asyncio.ensure_future(asyncio.gather(*pumps))
+
+        async def wait_for_command() -> None:
+            await asyncio.gather(*(process.wait() for process in processes))
+            # Background processes would keep the pipes open until the timeout
+            await group.terminate()
+            await pumping
+
+        try:
+            await asyncio.wait_for(wait_for_command(), timeout=timeout)
+        except asyncio.TimeoutError:
+            await group.terminate()
+            await asyncio.gather(*(process.wait() for process in processes))
+            await asyncio.gather(pumping, return_exceptions=True)
+            raise CommandTimeoutError(
+                f"Command timed out after {timeout} seconds"
+            )
+        except asyncio.CancelledError:
+            group.terminate_in_background()
+            pumping.cancel()
+            # Nobody awaits the pumps any more, so retrieve their outcome here
+            pumping.add_done_callback(lambda future: future.cancelled() or future.exception())
+            raise
+        finally:
+            group.close()
+            if usage is not None:
+                for process in processes:
+                    process.add_usage_to(usage)
+
+        return processes[-1].returncode
+
+    async def _run_in_shell_pool(
+        self,
+        shell_command: str,
+        buffers: Dict[str, OutputBuffer],
+        on_output: Optional[OutputCallback] = None,
+        timeout: Optional[float] = None,
+        usage: Optional[ResourceUsage] = None,
+    ) -> int:
+        """
+        Runs an already validated shell command on a pre-warmed shell worker.
+        """
+        timeout = timeout or self.security_config.command_timeout
+        # Lets the sweeper find processes the command leaves running in the worker
+        command_id = self.sweeper.register()
+        try:
+            return await self.shell_pool.run(
+                shell_command,
+                timeout,
+                buffers["stdout"],
+                buffers["stderr"],
+                on_output,
+                usage,
+                environment={COMMAND_MARKER_ENV: command_id},
+            )
+        except asyncio.TimeoutError:
+            raise CommandTimeoutError(
+                f"Command timed out after {timeout} seconds"
+            )
+        except ShellWorkerError as e:
+            raise CommandExecutionError(str(e))
+        finally:
+            self.sweeper.unregister(command_id)
+
+    async def _pump_stream(
+        self,
+        stream: asyncio.StreamReader,
+        name: str,
+        buffer: OutputBuffer,
+        on_output: Optional[OutputCallback],
+    ) -> None:
+        """
+        Reads a process pipe until EOF into buffer while streaming decoded text.
+
+        An incremental decoder is used so multibyte characters split across reads
+        are delivered intact.
+        """
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        while True:
+            data = await stream.read(OUTPUT_CHUNK_SIZE)
+            if not data:
+                break
+            buffer.write(data)
+            if on_output is not None:
+                text = decoder.decode(data)
+                if text:
+                    await on_output(name, text)
+        if on_output is not None:
+            text = decoder.decode(b"", final=True)
+            if text:
+                await on_output(name, text)
+
+
+class OutputStreamer:
+    """
+    Forwards command output chunks to the MCP client while a tool call runs.
+
+    Chunks are sent as notifications/message log entries and, when the client
+    supplied a progressToken, as notifications/progress carrying the chunk in
+    their message field. Works the same over stdio and SSE since both go
+    through the request's ServerSession.
+    """
+
+    def __init__(self, session, progress_token: Optional[types.ProgressToken] = None):
+        self.session = session
+        self.progress_token = progress_token
+        self.bytes_sent = 0
+
+    async def __call__(self, stream: str, text: str) -> None:
+        self.bytes_sent += len(text.encode())
+        await self.session.send_log_message(
+            level="error" if stream == "stderr" else "info",
+            data={"stream": stream, "text": text},
+            logger="run_command",
+        )
+        if self.progress_token is not None:
+            await self.session.send_notification(
+                types.ServerNotification(
+                    types.ProgressNotification(
+                        method="notifications/progress",
+                        params=types.ProgressNotificationParams(
+                            progressToken=self.progress_token,
+                            progress=self.bytes_sent,
+                            message=text,
+                        ),
+                    )
+                )
+            )
+
+
+async def run_cancellable(coroutine: Awaitable[Any]) -> Any:
+    """
+    Awaits the work of the current tool call so that the client can cancel it.
+
+    Raises:
+        CallCancelledError: If the client sent notifications/cancelled for the call.
+    """
+    calls = current_calls()
+    try:
+        request_id = server.request_context.request_id
+    except LookupError:
+        request_id = None
+    if calls is None or request_id is None:
+        return await coroutine
+    return await calls.run(request_id, coroutine)
+
 
 # Load security configuration from environment
 def load_security_config() -> SecurityConfig:
@@ -718,6 +1555,32 @@ def load_security_config() -> SecurityConfig:
             - allow_all_commands: Whether all commands are allowed
             - allow_all_flags: Whether all flags are allowed
             - allow_shell_operators: Whether shell operators (&&, ||, |, etc.) are allowed
+            - max_concurrent_commands: Maximum number of commands executing at once
+            - command_rate_limit: Commands per second a session may start on average
+            - command_burst: Commands a session may start at once before the rate limit applies
+            - max_queued_per_session: Commands of one session waiting for an execution slot
+            - shell_pool_size: Number of persistent shell workers (0 disables the pool)
+            - shell_pool_max_commands: Commands a shell worker runs before it is recycled
+            - output_memory_limit: Bytes of output per stream kept in memory before spilling to disk
+            - output_spill_limit: Bytes of output per stream kept at most, in memory or on disk
+            - output_preview_bytes: Bytes of output per stream returned inline before truncating
+            - cacheable_commands: Read-only commands whose results may be cached
+            - result_cache_bytes: Memory budget of the result cache
+            - max_jobs_per_session: Background jobs a session may run at once
+            - max_finished_jobs_per_session: Finished background jobs kept per session
+            - job_timeout: Maximum run time of a background job in seconds
+            - max_batch_commands: Maximum number of commands in one run_commands call
+            - batch_max_parallel: Commands of one run_commands call running at once
+            - command_cpu_limit: CPU seconds a command may use (RLIMIT_CPU)
+            - command_memory_limit: Bytes of address space a command may use (RLIMIT_AS)
+            - command_max_open_files: Open files per command process (RLIMIT_NOFILE)
+            - command_max_processes: Processes of the server's user (RLIMIT_NPROC)
+            - kill_grace_period: Seconds between SIGTERM and SIGKILL when stopping a command
+            - orphan_sweep_interval: Seconds between sweeps for processes left behind by commands
+            - validation_cache_size: Validation verdicts cached by command string
+            - path_cache_size: Resolved directories cached for path arguments
+            - policy_file: JSON file overriding the validation settings, reloaded on change
+            - policy_reload_interval: Seconds between checks of the policy file for changes
 
     Environment Variables:
         ALLOWED_COMMANDS: Comma-separated list of allowed commands or 'all' (default: "ls,cat,pwd")
@@ -726,10 +1589,37 @@ def load_security_config() -> SecurityConfig:
         COMMAND_TIMEOUT: Command timeout in seconds (default: 30)
         ALLOW_SHELL_OPERATORS: Whether to allow shell operators like &&, ||, |, >, etc. (default: false)
                               Set to "true" or "1" to enable, any other value to disable.
+        MAX_CONCURRENT_COMMANDS: Maximum number of commands executed concurrently (default: 32)
+        COMMAND_RATE_LIMIT: Commands per second a session may start, 0 to disable (default: 10)
+        COMMAND_BURST: Commands a session may start in a burst (default: 40)
+        MAX_QUEUED_PER_SESSION: Commands of a session waiting for an execution slot (default: 32)
+        SHELL_POOL_SIZE: Number of pre-warmed shell workers, 0 to start a shell per command (default: 0)
+        SHELL_POOL_MAX_COMMANDS: Commands run by a shell worker before it is replaced (default: 100)
+        OUTPUT_MEMORY_LIMIT: Bytes of output per stream buffered in memory (default: 1048576)
+        OUTPUT_SPILL_LIMIT: Bytes of output per stream kept at most, spilling to a temp file (default: 268435456)
+        OUTPUT_PREVIEW_BYTES: Bytes of output per stream returned inline (default: 65536)
+        CACHEABLE_COMMANDS: Comma-separated list of read-only commands whose results are cached (default: "")
+        RESULT_CACHE_BYTES: Memory budget of the result cache (default: 16777216)
+        MAX_JOBS_PER_SESSION: Background jobs a session may run at once (default: 4)
+        MAX_FINISHED_JOBS_PER_SESSION: Finished background jobs kept per session (default: 16)
+        JOB_TIMEOUT: Background job timeout in seconds (default: 3600)
+        MAX_BATCH_COMMANDS: Maximum number of commands in one run_commands call (default: 32)
+        BATCH_MAX_PARALLEL: Commands of one run_commands call running at once (default: 8)
+        COMMAND_CPU_LIMIT: CPU seconds per command, unset or 0 for no limit
+        COMMAND_MEMORY_LIMIT: Address space in bytes per command, unset or 0 for no limit
+        COMMAND_MAX_OPEN_FILES: Open files per command process, unset or 0 for no limit
+        COMMAND_MAX_PROCESSES: Processes of the server's user while running a command, unset or 0 for no limit
+        COMMAND_KILL_GRACE_PERIOD: Seconds between SIGTERM and SIGKILL when stopping a command (default: 2)
+        ORPHAN_SWEEP_INTERVAL: Seconds between sweeps for orphaned command processes, 0 to disable (default: 30)
+        VALIDATION_CACHE_SIZE: Validation verdicts cached by command string, 0 to disable (default: 4096)
+        PATH_CACHE_SIZE: Resolved directories cached for path arguments, 0 to disable (default: 4096)
+        SECURITY_POLICY_FILE: JSON file overriding the validation settings above, reloaded when it changes
+        POLICY_RELOAD_INTERVAL: Seconds between checks of the policy file, 0 to load it only at startup (default: 2)
     """
     allowed_commands = os.getenv("ALLOWED_COMMANDS", "ls,cat,pwd")
     allowed_flags = os.getenv("ALLOWED_FLAGS", "-l,-a,--help")
     allow_shell_operators_env = os.getenv("ALLOW_SHELL_OPERATORS", "false")
+    cacheable_commands = os.getenv("CACHEABLE_COMMANDS", "")
 
     allow_all_commands = allowed_commands.lower() == "all"
     allow_all_flags = allowed_flags.lower() == "all"
@@ -745,26 +1635,57 @@ def load_security_config() -> SecurityConfig:
         allow_all_commands=allow_all_commands,
         allow_all_flags=allow_all_flags,
         allow_shell_operators=allow_shell_operators,
+        max_concurrent_commands=int(os.getenv("MAX_CONCURRENT_COMMANDS", "32")),
+        command_rate_limit=float(os.getenv("COMMAND_RATE_LIMIT", "10")),
+        command_burst=int(os.getenv("COMMAND_BURST", "40")),
+        max_queued_per_session=int(os.getenv("MAX_QUEUED_PER_SESSION", "32")),
+        shell_pool_size=int(os.getenv("SHELL_POOL_SIZE", "0")),
+        shell_pool_max_commands=int(os.getenv("SHELL_POOL_MAX_COMMANDS", "100")),
+        output_memory_limit=int(os.getenv("OUTPUT_MEMORY_LIMIT", str(1024 * 1024))),
+        output_spill_limit=int(os.getenv("OUTPUT_SPILL_LIMIT", str(256 * 1024 * 1024))),
+        output_preview_bytes=int(os.getenv("OUTPUT_PREVIEW_BYTES", str(64 * 1024))),
+        cacheable_commands={
+            command.strip() for command in cacheable_commands.split(",") if command.strip()
+        },
+        result_cache_bytes=int(os.getenv("RESULT_CACHE_BYTES", str(16 * 1024 * 1024))),
+        max_jobs_per_session=int(os.getenv("MAX_JOBS_PER_SESSION", "4")),
+        max_finished_jobs_per_session=int(os.getenv("MAX_FINISHED_JOBS_PER_SESSION", "16")),
+        job_timeout=int(os.getenv("JOB_TIMEOUT", "3600")),
+        max_batch_commands=int(os.getenv("MAX_BATCH_COMMANDS", "32")),
+        batch_max_parallel=int(os.getenv("BATCH_MAX_PARALLEL", "8")),
+        command_cpu_limit=_optional_limit("COMMAND_CPU_LIMIT"),
+        command_memory_limit=_optional_limit("COMMAND_MEMORY_LIMIT"),
+        command_max_open_files=_optional_limit("COMMAND_MAX_OPEN_FILES"),
+        command_max_processes=_optional_limit("COMMAND_MAX_PROCESSES"),
+        kill_grace_period=float(os.getenv("COMMAND_KILL_GRACE_PERIOD", "2")),
+        orphan_sweep_interval=float(os.getenv("ORPHAN_SWEEP_INTERVAL", "30")),
+        validation_cache_size=int(os.getenv("VALIDATION_CACHE_SIZE", "4096")),
+        path_cache_size=int(os.getenv("PATH_CACHE_SIZE", "4096")),
+        policy_file=os.getenv("SECURITY_POLICY_FILE") or None,
+        policy_reload_interval=float(os.getenv("POLICY_RELOAD_INTERVAL", "2")),
     )
 
 
+def _optional_limit(name: str) -> Optional[int]:
+    """Reads a resource limit from the environment; unset or 0 means no limit."""
+    value = int(os.getenv(name, "0") or "0")
+    return value if value > 0 else None
+
+
 executor = CommandExecutor(
-    allowed_dir=os.getenv("ALLOWED_DIR", ""), security_config=load_security_config()
+    allowed_dir=os.getenv("ALLOWED_DIR", ""),
+    security_config=load_security_config(),
+    state=state_backend,
 )
 
+executor.policy_listeners.append(tool_list_subscribers.notify)
+
 # Initialize Telegram auth validator
 auth_validator = TelegramAuthValidator()
 
 
-@server.list_tools()
-async def handle_list_tools() -> list[types.Tool]:
-    # In test mode, bypass authentication
-    if os.getenv("TEST_MODE") == "true":
-        is_authenticated = True
-    else:
-        session_id = SessionManager.get_session_id_from_request()
-        is_authenticated = session_id and SessionManager.is_authenticated(session_id)
-    
+def _build_tools(is_authenticated: bool) -> List[types.Tool]:
+    """Renders the tools offered to authenticated or unauthenticated sessions."""
     # Always available tools
     tools = [
         types.Tool(
@@ -816,12 +1737,12 @@ async def handle_list_tools() -> list[types.Tool]:
         commands_desc = (
             "all commands"
             if executor.security_config.allow_all_commands
-            else ", ".join(executor.security_config.allowed_commands)
+            else ", ".join(sorted(executor.security_config.allowed_commands))
         )
         flags_desc = (
             "all flags"
             if executor.security_config.allow_all_flags
-            else ", ".join(executor.security_config.allowed_flags)
+            else ", ".join(sorted(executor.security_config.allowed_flags))
         )
         
         tools.extend([
@@ -839,11 +1760,172 @@ async def handle_list_tools() -> list[types.Tool]:
                         "command": {
                             "type": "string",
                             "description": "Single command to execute (example: 'ls -l' or 'cat file.txt')",
-                        }
+                        },
+                        "stream": {
+                            "type": "boolean",
+                            "description": (
+                                "Send output chunks as log/progress notifications while the command "
+                                "runs; the final result then only summarizes the return code"
+                            ),
+                        },
+                        "detach": {
+                            "type": "boolean",
+                            "description": (
+                                "Run the command as a background job and return its job id right away. "
+                                f"Jobs may run for up to {executor.security_config.job_timeout} seconds"
+                            ),
+                        },
+                        "resources": {
+                            "type": "boolean",
+                            "description": (
+                                "Add the wall time, CPU time, memory and output bytes the command "
+                                "used to the result"
+                            ),
+                        },
                     },
                     "required": ["command"],
                 },
             ),
+            types.Tool(
+                name="run_commands",
+                description=(
+                    "🔒 AUTHENTICATED: Run several commands in one call, in parallel where possible.\n\n"
+                    "Every command is validated like in run_command before any of them runs. A command with "
+                    "depends_on only starts after those commands succeeded and is skipped otherwise. "
+                    "Returns a JSON list with the id, status (ok, failed, error or skipped), return code and "
+                    "output of each command, in the given order."
+                ),
+                inputSchema={
+                    "type": "object",
+                    "properties": {
+                        "commands": {
+                            "type": "array",
+                            "maxItems": executor.security_config.max_batch_commands,
+                            "items": {
+                                "type": "object",
+                                "properties": {
+                                    "id": {
+                                        "type": "string",
+                                        "description": "Id referenced by depends_on (default: position in the list)",
+                                    },
+                                    "command": {
+                                        "type": "string",
+                                        "description": "Single command to execute",
+                                    },
+                                    "depends_on": {
+                                        "type": "array",
+                                        "items": {"type": "string"},
+                                        "description": "Ids of commands that must succeed first",
+                                    },
+                                },
+                                "required": ["command"],
+                            },
+                        },
+                    },
+                    "required": ["commands"],
+                },
+            ),
+            types.Tool(
+                name="job_status",
+                description=(
+                    "🔒 AUTHENTICATED: Show the status of a background job started with run_command detach, "
+                    "or of all jobs of this session when no job_id is given."
+                ),
+                inputSchema={
+                    "type": "object",
+                    "properties": {
+                        "job_id": {
+                            "type": "string",
+                            "description": "Job id reported by run_command",
+                        },
+                    },
+                },
+            ),
+            types.Tool(
+                name="job_output",
+                description=(
+                    "🔒 AUTHENTICATED: Read the output of a background job, also while it is running.\n\n"
+                    "Pass the next_offset of the previous call as offset to follow new output, or a negative "
+                    "offset to read the last bytes."
+                ),
+                inputSchema={
+                    "type": "object",
+                    "properties": {
+                        "job_id": {
+                            "type": "string",
+                            "description": "Job id reported by run_command",
+                        },
+                        "stream": {
+                            "type": "string",
+                            "enum": ["stdout", "stderr"],
+                            "description": "Which output stream to read (default: stdout)",
+                        },
+                        "offset": {
+                            "type": "integer",
+                            "description": "First byte to return, negative to count from the end (default: 0)",
+                        },
+                        "length": {
+                            "type": "integer",
+                            "description": "Number of bytes to return, capped at the preview size",
+                        },
+                    },
+                    "required": ["job_id"],
+                },
+            ),
+            types.Tool(
+                name="job_cancel",
+                description="🔒 AUTHENTICATED: Cancel a running background job and kill its processes.",
+                inputSchema={
+                    "type": "object",
+                    "properties": {
+                        "job_id": {
+                            "type": "string",
+                            "description": "Job id reported by run_command",
+                        },
+                    },
+                    "required": ["job_id"],
+                },
+            ),
+            types.Tool(
+                name="read_command_output",
+                description=(
+                    "🔒 AUTHENTICATED: Page through the full output of a run_command call whose output was "
+                    "truncated to a head/tail preview.\n\n"
+                    "Pass the output_id from the run_command result and either a byte range (offset, length) "
+                    "or a line range (start_line, line_count)."
+                ),
+                inputSchema={
+                    "type": "object",
+                    "properties": {
+                        "output_id": {
+                            "type": "string",
+                            "description": "Output id reported by run_command",
+                        },
+                        "stream": {
+                            "type": "string",
+                            "enum": ["stdout", "stderr"],
+                            "description": "Which output stream to read (default: stdout)",
+                        },
+                        "offset": {
+                            "type": "integer",
+                            "description": "First byte to return (default: 0)",
+                        },
+                        "length": {
+                            "type": "integer",
+                            "description": "Number of bytes to return, capped at the preview size",
+                        },
+                        "start_line": {
+                            "type": "integer",
+                            "description": "First line to return, 0-based. Takes precedence over offset",
+                        },
+                        "line_count": {
+                            "type": "integer",
+                            "description": "Number of lines to return (default: 100)",
+                        },
+                    },
+                    "required": ["output_id"],
+                },
+            ),
             types.Tool(
                 name="show_security_rules",
                 description=(
@@ -871,6 +1953,99 @@ async def handle_list_tools() -> list[types.Tool]:
     return tools
 
 
+def _build_security_rules() -> Tuple[str, str]:
+    """Renders show_security_rules, split where the session id goes."""
+    commands_desc = (
+        "All commands allowed"
+        if executor.security_config.allow_all_commands
+        else ", ".join(sorted(executor.security_config.allowed_commands))
+    )
+    flags_desc = (
+        "All flags allowed"
+        if executor.security_config.allow_all_flags
+        else ", ".join(sorted(executor.security_config.allowed_flags))
+    )
+
+    head = (
+        "🔒 AUTHENTICATED Security Configuration:\n"
+        f"==========================================\n"
+        f"Working Directory: {executor.allowed_dir}\n"
+    )
+    tail = (
+        f"\nAllowed Commands:\n"
+        f"----------------\n"
+        f"{commands_desc}\n"
+        f"\nAllowed Flags:\n"
+        f"-------------\n"
+        f"{flags_desc}\n"
+        f"\nSecurity Limits:\n"
+        f"---------------\n"
+        f"Max Command Length: {executor.security_config.max_command_length} characters\n"
+        f"Command Timeout: {executor.security_config.command_timeout} seconds\n"
+        f"Shell Operators: {'Enabled' if executor.security_config.allow_shell_operators else 'Disabled'}\n"
+        f"Policy Version: {executor.policy.version}\n"
+    )
+    return head, tail
+
+
+class ToolCatalog:
+    """
+    The tool lists and security rules of the executor's current policy.
+
+    Everything rendered here only changes together with executor.policy, so
+    each rendering is kept until the policy is replaced. The lists hold
+    validated Tool models, which the session serializes as they are.
+    """
+
+    def __init__(self) -> None:
+        self._policy: Optional[SecurityPolicy] = None
+        self._tools: Dict[bool, List[types.Tool]] = {}
+        self._security_rules: Optional[Tuple[str, str]] = None
+        self.hits = 0
+        self.renders = 0
+
+    def tools(self, is_authenticated: bool) -> List[types.Tool]:
+        self._check_policy()
+        tools = self._tools.get(is_authenticated)
+        if tools is None:
+            tools = self._tools[is_authenticated] = _build_tools(is_authenticated)
+            self.renders += 1
+        else:
+            self.hits += 1
+        return list(tools)
+
+    def security_rules(self, session_id: Optional[str]) -> str:
+        self._check_policy()
+        if self._security_rules is None:
+            self._security_rules = _build_security_rules()
+            self.renders += 1
+        else:
+            self.hits += 1
+        head, tail = self._security_rules
+        return f"{head}Session ID: {session_id}\n{tail}"
+
+    def _check_policy(self) -> None:
+        if executor.policy is not self._policy:
+            self._policy = executor.policy
+            self._tools.clear()
+            self._security_rules = None
+
+
+tool_catalog = ToolCatalog()
+
+
+@server.list_tools()
+async def handle_list_tools() -> list[types.Tool]:
+    tool_list_subscribers.add_current()
+    # In test mode, bypass authentication
+    if os.getenv("TEST_MODE") == "true":
+        is_authenticated = True
+    else:
+        session_id = SessionManager.get_session_id_from_request()
+        is_authenticated = bool(session_id and SessionManager.is_authenticated(session_id))
+    return tool_catalog.tools(is_authenticated)
+
+
 @server.call_tool()
 async def handle_call_tool(
     name: str, arguments: Optional[Dict[str, Any]]
@@ -890,10 +2065,13 @@ async def handle_call_tool(
             
             # Create session
             session_id = SessionManager.create_session_id(user_data)
-            SessionManager.authenticate_session(session_id)
+            # The login itself is only valid for AUTH_MAX_AGE after auth_date
+            SessionManager.authenticate_session(
+                session_id, int(user_data['auth_date']) + AUTH_MAX_AGE
+            )
             
-            # Store session in server context (simple approach for demo)
-            server._current_session_id = session_id
+            # Bind the session to this connection only
+            SessionManager.get_connection().session_id = session_id
             
             return [types.TextContent(
                 type="text",
@@ -903,6 +2081,8 @@ async def handle_call_tool(
                      f"Session ID: {session_id}\n\n"
                      f"🔓 CLI tools are now unlocked:\n"
                      f"• run_command - Execute CLI commands\n"
+                     f"• run_commands - Execute several CLI commands at once\n"
+                     f"• job_status, job_output, job_cancel - Manage background jobs\n"
                      f"• show_security_rules - View security configuration"
             )]
             
@@ -936,15 +2116,75 @@ async def handle_call_tool(
                 types.TextContent(type="text", text="No command provided", error=True)
             ]
 
+        owner = SessionManager.get_session_key()
+        try:
+            executor.admission.check(owner)
+        except AdmissionRejected as e:
+            return [types.TextContent(type="text", text=f"Rejected: {str(e)}", error=True)]
+
+        if arguments.get("detach"):
+            try:
+                job = executor.jobs.start(owner, arguments["command"])
+            except CommandSecurityError as e:
+                return [
+                    types.TextContent(
+                        type="text", text=f"Security violation: {str(e)}", error=True
+                    )
+                ]
+            except JobError as e:
+                return [types.TextContent(type="text", text=f"Error: {str(e)}", error=True)]
+            return [
+                types.TextContent(
+                    type="text",
+                    text=(
+                        f"Started background job {job.job_id}\n"
+                        f"Use job_status, job_output and job_cancel with job_id '{job.job_id}'."
+                    ),
+                )
+            ]
+
+        stream_output = bool(arguments.get("stream"))
+        streamer = None
         try:
-            result = executor.execute(arguments["command"])
+            request_context = server.request_context
+        except LookupError:
+            # Called outside of an MCP request (e.g. directly from tests)
+            request_context = None
+        if request_context is not None:
+            progress_token = request_context.meta.progressToken if request_context.meta else None
+            if stream_output or progress_token is not None:
+                streamer = OutputStreamer(request_context.session, progress_token)
+
+        try:
+            result = await run_cancellable(
+                executor.execute_async(arguments["command"], on_output=streamer, owner=owner)
+            )
 
             response = []
-            if result.stdout:
-                response.append(types.TextContent(type="text", text=result.stdout))
-            if result.stderr:
+            if stream_output and streamer is not None:
                 response.append(
-                    types.TextContent(type="text", text=result.stderr, error=True)
+                    types.TextContent(
+                        type="text",
+                        text=f"Streamed {streamer.bytes_sent} bytes of output",
+                    )
+                )
+            else:
+                if result.stdout:
+                    response.append(types.TextContent(type="text", text=result.stdout))
+                if result.stderr:
+                    response.append(
+                        types.TextContent(type="text", text=result.stderr, error=True)
+                    )
+            if result.output_id:
+                response.append(
+                    types.TextContent(
+                        type="text",
+                        text=(
+                            f"\nOutput was truncated to a head/tail preview "
+                            f"({result.stdout_bytes} bytes of stdout, {result.stderr_bytes} bytes of stderr). "
+                            f"Use read_command_output with output_id '{result.output_id}' to page through it."
+                        ),
+                    )
                 )
 
             response.append(
@@ -953,6 +2193,10 @@ async def handle_call_tool(
                     text=f"\nCommand completed with return code: {result.returncode}",
                 )
             )
+            if arguments.get("resources") and result.usage is not None:
+                response.append(
+                    types.TextContent(type="text", text=f"Resources: {result.usage.summary()}")
+                )
 
             return response
 
@@ -962,6 +2206,10 @@ async def handle_call_tool(
                     type="text", text=f"Security violation: {str(e)}", error=True
                 )
             ]
+        except AdmissionRejected as e:
+            return [types.TextContent(type="text", text=f"Rejected: {str(e)}", error=True)]
+        except CallCancelledError:
+            return [types.TextContent(type="text", text="Command cancelled", error=True)]
         except subprocess.TimeoutExpired:
             return [
                 types.TextContent(
@@ -973,43 +2221,144 @@ async def handle_call_tool(
         except Exception as e:
             return [types.TextContent(type="text", text=f"Error: {str(e)}", error=True)]
 
-    elif name == "show_security_rules":
-        commands_desc = (
-            "All commands allowed"
-            if executor.security_config.allow_all_commands
-            else ", ".join(sorted(executor.security_config.allowed_commands))
-        )
-        flags_desc = (
-            "All flags allowed"
-            if executor.security_config.allow_all_flags
-            else ", ".join(sorted(executor.security_config.allowed_flags))
+    elif name == "read_command_output":
+        if not arguments or "output_id" not in arguments:
+            return [
+                types.TextContent(type="text", text="No output_id provided", error=True)
+            ]
+
+        stream = arguments.get("stream", "stdout")
+        # Output of other sessions is reported as missing
+        buffer = executor.outputs.get(
+            arguments["output_id"], stream, SessionManager.get_session_key()
         )
+        if buffer is None:
+            return [
+                types.TextContent(
+                    type="text",
+                    text=f"No {stream} output found for output_id '{arguments['output_id']}'. It may have expired.",
+                    error=True,
+                )
+            ]
+
+        max_bytes = executor.security_config.output_preview_bytes
+        try:
+            if "start_line" in arguments:
+                start_line = int(arguments["start_line"])
+                data, lines = buffer.read_lines(
+                    start_line, int(arguments.get("line_count", 100)), max_bytes
+                )
+                position = f"{lines} lines from line {start_line} (next start_line: {start_line + lines})"
+            else:
+                offset = int(arguments.get("offset", 0))
+                length = min(int(arguments.get("length", max_bytes)), max_bytes)
+                data = buffer.read(offset, length)
+                position = f"Bytes {offset}-{offset + len(data)} of {buffer.stored_bytes}"
+        except ValueError as e:
+            return [types.TextContent(type="text", text=f"Error: {str(e)}", error=True)]
 
-        security_info = (
-            "🔒 AUTHENTICATED Security Configuration:\n"
-            f"==========================================\n"
-            f"Working Directory: {executor.allowed_dir}\n"
-            f"Session ID: {session_id}\n"
-            f"\nAllowed Commands:\n"
-            f"----------------\n"
-            f"{commands_desc}\n"
-            f"\nAllowed Flags:\n"
-            f"-------------\n"
-            f"{flags_desc}\n"
-            f"\nSecurity Limits:\n"
-            f"---------------\n"
-            f"Max Command Length: {executor.security_config.max_command_length} characters\n"
-            f"Command Timeout: {executor.security_config.command_timeout} seconds\n"
-            f"Shell Operators: {'Enabled' if executor.security_config.allow_shell_operators else 'Disabled'}\n"
+        if buffer.dropped_bytes:
+            position += f"; {buffer.dropped_bytes} bytes beyond the output size cap were discarded"
+        return [
+            types.TextContent(type="text", text=data.decode(errors="replace")),
+            types.TextContent(type="text", text=f"\n{position}"),
+        ]
+
+    elif name == "run_commands":
+        try:
+            commands = parse_batch(
+                (arguments or {}).get("commands"), executor.security_config.max_batch_commands
+            )
+        except BatchError as e:
+            return [types.TextContent(type="text", text=f"Error: {str(e)}", error=True)]
+
+        # Refuse the whole batch if any command is not allowed
+        violations = []
+        for command in commands:
+            try:
+                if len(command.command) > executor.security_config.max_command_length:
+                    raise CommandSecurityError(
+                        f"Command exceeds maximum length of {executor.security_config.max_command_length}"
+                    )
+                executor.validate_command(command.command)
+            except CommandSecurityError as e:
+                violations.append(f"{command.id}: {str(e)}")
+        if violations:
+            return [
+                types.TextContent(
+                    type="text",
+                    text="Security violation, no command was run:\n" + "\n".join(violations),
+                    error=True,
+                )
+            ]
+
+        owner = SessionManager.get_session_key()
+        try:
+            executor.admission.check(owner, len(commands))
+        except AdmissionRejected as e:
+            return [types.TextContent(type="text", text=f"Rejected: {str(e)}", error=True)]
+
+        try:
+            results = await run_cancellable(
+                run_batch(
+                    commands,
+                    functools.partial(executor.execute_async, owner=owner),
+                    executor.security_config.batch_max_parallel,
+                )
+            )
+        except CallCancelledError:
+            return [types.TextContent(type="text", text="Commands cancelled", error=True)]
+        return [types.TextContent(type="text", text=json.dumps(results, indent=2))]
+
+    elif name in ("job_status", "job_output", "job_cancel"):
+        owner = SessionManager.get_session_key()
+        arguments = arguments or {}
+        try:
+            if name == "job_status" and "job_id" not in arguments:
+                text = "\n\n".join(executor.jobs.summaries(owner)) or "No background jobs"
+                return [types.TextContent(type="text", text=text)]
+            if "job_id" not in arguments:
+                return [types.TextContent(type="text", text="No job_id provided", error=True)]
+
+            if name == "job_cancel":
+                job = await executor.jobs.cancel(owner, arguments["job_id"])
+                return [types.TextContent(type="text", text=job.summary())]
+
+            job = executor.jobs.get(owner, arguments["job_id"])
+            if name == "job_status":
+                return [types.TextContent(type="text", text=job.summary())]
+
+            buffer = job.buffers[arguments.get("stream", "stdout")]
+            max_bytes = executor.security_config.output_preview_bytes
+            offset = int(arguments.get("offset", 0))
+            if offset < 0:
+                offset = max(0, buffer.stored_bytes + offset)
+            length = min(int(arguments.get("length", max_bytes)), max_bytes)
+            data = buffer.read(offset, length)
+        except (JobError, KeyError, ValueError) as e:
+            return [types.TextContent(type="text", text=f"Error: {str(e)}", error=True)]
+
+        position = (
+            f"Bytes {offset}-{offset + len(data)} of {buffer.stored_bytes}, "
+            f"next_offset: {offset + len(data)}, job {job.status}"
         )
+        if buffer.dropped_bytes:
+            position += f"; {buffer.dropped_bytes} bytes beyond the output size cap were discarded"
+        return [
+            types.TextContent(type="text", text=data.decode(errors="replace")),
+            types.TextContent(type="text", text=f"\n{position}"),
+        ]
+
+    elif name == "show_security_rules":
+        security_info = tool_catalog.security_rules(SessionManager.get_session_id_from_request())
         return [types.TextContent(type="text", text=security_info)]
 
     elif name == "telegram_logout":
         session_id = SessionManager.get_session_id_from_request()
         if session_id:
             SessionManager.deauthenticate_session(session_id)
-            # Clear session from server context
-            server._current_session_id = None
+            # Unbind the session from this connection
+            SessionManager.get_connection().session_id = None
             
             return [types.TextContent(
                 type="text",
@@ -1032,16 +2381,23 @@ async def handle_call_tool(
 
 async def main():
     # Default stdio mode
-    async with mcp.server.stdio.stdio_server() as (read_stream, write_stream):
-        await server.run(
-            read_stream,
-            write_stream,
-            InitializationOptions(
-                server_name="cli_use",
-                server_version="0.2.1",
-                capabilities=server.get_capabilities(
-                    notification_options=NotificationOptions(),
-                    experimental_capabilities={},
+    await executor.start()
+    await auth_validator.start()
+    try:
+        async with stdio_transport() as (read_stream, write_stream):
+            await serve(
+                server,
+                read_stream,
+                write_stream,
+                InitializationOptions(
+                    server_name="cli_use",
+                    server_version="0.2.1",
+                    capabilities=server.get_capabilities(
+                        notification_options=NotificationOptions(tools_changed=True),
+                        experimental_capabilities={},
+                    ),
                 ),
-            ),
-        )
+            )
+    finally:
+        await auth_validator.close()
+        await executor.close()
@@ -0,0 +1,300 @@
+"""
+Serving profiles of the HTTP transports, and routing between their workers.
+
+The development profile runs one uvicorn worker on the asyncio loop with
+Starlette's debug mode. The production profile runs one worker per CPU under
+uvicorn's supervisor, which binds the listening socket once and restarts
+workers that die. It uses uvloop and httptools when they are installed (the
+"production" extra), keeps idle connections open longer than the usual 60
+second load balancer timeout and leaves debug mode and access logs off.
+
+An SSE client holds its event stream on one worker but posts its messages on
+other connections, which the kernel may hand to any worker. With several
+workers, each one therefore announces a message endpoint of its own,
+/messages/<worker>/, and listens on a Unix socket in the run directory. A
+worker that receives a message for another worker passes it on through that
+worker's socket. Streamable HTTP sessions name their worker in the session
+id and are passed on the same way.
+"""
+
+import asyncio
+import logging
+import os
+import re
+import stat
+from dataclasses import dataclass, replace
+from typing import Any, Callable, Dict, Optional
+
+import aiohttp
+import anyio
+from aiohttp import web
+
+from .stdio import MAX_MESSAGE_BYTES
+
+logger = logging.getLogger(__name__)
+
+# Set for the workers by the process that starts them
+RUN_DIR_ENV = "CLI_USE_RUN_DIR"
+DEBUG_ENV = "CLI_USE_DEBUG"
+LOG_LEVEL_ENV = "CLI_USE_LOG_LEVEL"
+
+ASGIApp = Callable[..., Any]
+
+
+@dataclass(frozen=True)
+class ServingProfile:
+    """How uvicorn serves the HTTP transports"""
+
+    workers: int
+    loop: str
+    http: str
+    backlog: int
+    keep_alive: int
+    debug: bool
+    access_log: bool
+    log_level: str
+    # Seconds shutdown waits for open connections, such as SSE streams
+    graceful_shutdown: Optional[int]
+
+
+SERVING_PROFILES: Dict[str, ServingProfile] = {
+    "development": ServingProfile(
+        workers=1,
+        loop="asyncio",
+        http="h11",
+        backlog=2048,
+        keep_alive=5,
+        debug=True,
+        access_log=True,
+        log_level="info",
+        graceful_shutdown=None,
+    ),
+    "production": ServingProfile(
+        workers=os.cpu_count() or 1,
+        loop="auto",
+        http="auto",
+        backlog=4096,
+        keep_alive=75,
+        debug=False,
+        access_log=False,
+        log_level="warning",
+        graceful_shutdown=10,
+    ),
+}
+
+
+def serving_profile(name: str, **overrides: Any) -> ServingProfile:
+    """Returns the named profile with the settings in overrides that are not None."""
+    return replace(
+        SERVING_PROFILES[name], **{k: v for k, v in overrides.items() if v is not None}
+    )
+
+
+# Worker ids are process ids
+WORKER_ID = re.compile(r"[0-9]+")
+
+# Headers of one connection, not passed on between workers
+HOP_BY_HOP_HEADERS = frozenset(
+    {"connection", "content-length", "host", "keep-alive", "transfer-encoding", "upgrade"}
+)
+
+
+class WorkerRouter:
+    """
+    Passes requests that belong to another worker on to that worker.
+
+    Every worker serves its application to the others on a Unix socket in
+    run_dir, named after its worker id. Responses are streamed back as they
+    are written, so event streams can be passed on as well.
+    """
+
+    def __init__(self, run_dir: str):
+        self.run_dir = run_dir
+        self.worker = str(os.getpid())
+        self.forwarded = 0
+        self._runner: Optional[web.AppRunner] = None
+        self._app: Optional[ASGIApp] = None
+        self._peers: Dict[str, aiohttp.ClientSession] = {}
+
+    def socket_path(self, worker: str) -> str:
+        return os.path.join(self.run_dir, f"{worker}.sock")
+
+    def is_worker(self, worker: str) -> bool:
+        """Tells whether worker is the id of a worker serving on its socket in run_dir."""
+        if WORKER_ID.fullmatch(worker) is None:
+            return False
+        try:
+            return stat.S_ISSOCK(os.stat(self.socket_path(worker)).st_mode)
+        except OSError:
+            return False
+
+    async def start(self, app: ASGIApp) -> None:
+        """Serves app to the other workers."""
+        self._app = app
+        peer_app = web.Application(client_max_size=MAX_MESSAGE_BYTES)
+        peer_app.router.add_route("*", "/{path:.*}", self._handle_peer)
+        # Cancels the handler when the worker that passed the request on hangs up
+        self._runner = web.AppRunner(peer_app, access_log=None, handler_cancellation=True)
+        await self._runner.setup()
+        await web.UnixSite(self._runner, self.socket_path(self.worker)).start()
+
+    async def close(self) -> None:
+        for session in self._peers.values():
+            await session.close()
+        self._peers.clear()
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+        try:
+            os.unlink(self.socket_path(self.worker))
+        except FileNotFoundError:
+            pass
+
+    def route_messages(self, handle_post_message: ASGIApp) -> ASGIApp:
+        """ASGI app of the SSE /messages/ mount, which handles the messages of this worker."""
+
+        async def route(scope: Dict[str, Any], receive: Any, send: Any) -> None:
+            match = re.search(r"/messages/([0-9]+)/?$", scope.get("root_path", "") + scope["path"])
+            worker = match.group(1) if match else self.worker
+            if worker == self.worker:
+                await handle_post_message(scope, receive, send)
+            else:
+                await self.forward(worker, scope, receive, send)
+
+        return route
+
+    async def forward(self, worker: str, scope: Dict[str, Any], receive: Any, send: Any) -> None:
+        """
+        Passes the request in scope on to worker and streams its response back.
+
+        worker comes from the client, so anything but the id of a worker in
+        run_dir is answered with 404 without connecting anywhere. Bodies are
+        limited to MAX_MESSAGE_BYTES, like messages on stdio.
+        """
+        if not self.is_worker(worker):
+            await _send_response(send, 404, b"Could not find session")
+            return
+        chunks = []
+        size = 0
+        more_body = True
+        while more_body:
+            message = await receive()
+            chunk = message.get("body", b"")
+            size += len(chunk)
+            if size > MAX_MESSAGE_BYTES:
+                await _send_response(send, 413, b"Request body too large")
+                return
+            chunks.append(chunk)
+            more_body = message.get("more_body", False)
+        body = b"".join(chunks)
+
+        session = self._peers.get(worker)
+        if session is None:
+            session = self._peers[worker] = aiohttp.ClientSession(
+                connector=aiohttp.UnixConnector(path=self.socket_path(worker))
+            )
+        raw_path = scope.get("raw_path") or scope["path"].encode()
+        url = f"http://worker{raw_path.decode('latin-1')}"
+        if scope.get("query_string"):
+            url += f"?{scope['query_string'].decode('latin-1')}"
+        headers = [
+            (name.decode("latin-1"), value.decode("latin-1"))
+            for name, value in scope["headers"]
+            if name.decode("latin-1").lower() not in HOP_BY_HOP_HEADERS
+        ]
+
+        started = False
+        try:
+            async with session.request(
+                scope["method"], url, data=body, headers=headers
+            ) as response:
+                self.forwarded += 1
+                await send({
+                    "type": "http.response.start",
+                    "status": response.status,
+                    "headers": [
+                        (name.lower().encode("latin-1"), value.encode("latin-1"))
+                        for name, value in response.headers.items()
+                        if name.lower() not in HOP_BY_HOP_HEADERS
+                    ],
+                })
+                started = True
+                async with anyio.create_task_group() as tg:
+
+                    async def stop_on_disconnect() -> None:
+                        while (await receive())["type"] != "http.disconnect":
+                            pass
+                        tg.cancel_scope.cancel()
+
+                    tg.start_soon(stop_on_disconnect)
+                    async for chunk in response.content.iter_any():
+                        await send({"type": "http.response.body", "body": chunk, "more_body": True})
+                    tg.cancel_scope.cancel()
+                await send({"type": "http.response.body", "body": b""})
+        except aiohttp.ClientError as e:
+            logger.warning(f"Passing a request to worker {worker} failed: {str(e)}")
+            await self._peers.pop(worker).close()
+            if not started:
+                await _send_response(send, 404, b"Could not find session")
+
+    async def _handle_peer(self, request: web.Request) -> web.StreamResponse:
+        """Runs a request passed on by another worker through this worker's app."""
+        body = await request.read()
+        scope = {
+            "type": "http",
+            "asgi": {"version": "3.0"},
+            "http_version": "1.1",
+            "method": request.method,
+            "scheme": "http",
+            "path": request.path,
+            "raw_path": request.raw_path.split("?")[0].encode("latin-1"),
+            "root_path": "",
+            "query_string": request.query_string.encode("latin-1"),
+            "headers": [
+                (name.lower().encode("latin-1"), value.encode("latin-1"))
+                for name, value in request.headers.items()
+            ],
+            "client": None,
+            "server": None,
+        }
+        response = web.StreamResponse()
+        received = False
+
+        async def receive() -> Dict[str, Any]:
+            nonlocal received
+            if not received:
+                received = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            # Nothing more to read, the handler is cancelled when the peer hangs up
+            await asyncio.Future()
+
+        async def send(message: Dict[str, Any]) -> None:
+            if message["type"] == "http.response.start":
+                response.set_status(message["status"])
+                for name, value in message.get("headers", []):
+                    if name.decode("latin-1") not in HOP_BY_HOP_HEADERS:
+                        response.headers.add(name.decode("latin-1"), value.decode("latin-1"))
+            elif message["type"] == "http.response.body":
+                if not response.prepared:
+                    await response.prepare(request)
+                if message.get("body"):
+                    await response.write(message["body"])
+
+        try:
+            await self._app(scope, receive, send)
+            if not response.prepared:
+                await response.prepare(request)
+            await response.write_eof()
+        except ConnectionResetError:
+            # The worker that passed the request on hung up, e.g. with its client
+            pass
+        return response
+
+
+async def _send_response(send: Any, status: int, body: bytes) -> None:
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", b"text/plain; charset=utf-8")],
+    })
+    await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,130 @@
+"""
+Store of authenticated sessions.
+
+A session stays valid while it is used: every use moves its expiry
+idle_timeout seconds ahead, but never past the hard expiry it was created
+with, such as the end of a Telegram login's 24 hour validity. The store is
+capped at max_entries sessions and evicts the least recently used one when
+full. Expiry times are kept in a heap, so finding expired sessions costs
+O(log n) per session instead of a scan of the store.
+"""
+
+import heapq
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Tuple
+
+DEFAULT_SESSION_IDLE_TIMEOUT = 3600.0
+DEFAULT_MAX_SESSIONS = 10000
+
+
+@dataclass
+class _Session:
+    expires_at: float
+    hard_expiry: Optional[float]
+
+
+class SessionStore:
+    """
+    Authenticated session ids with sliding expiry and a size cap.
+
+    clock returns the current time in seconds since the epoch, the same scale
+    as the hard expiries passed to add().
+    """
+
+    def __init__(
+        self,
+        idle_timeout: float = DEFAULT_SESSION_IDLE_TIMEOUT,
+        max_entries: int = DEFAULT_MAX_SESSIONS,
+        clock: Callable[[], float] = time.time,
+    ):
+        self.idle_timeout = idle_timeout
+        self.max_entries = max(1, max_entries)
+        self.clock = clock
+        self._sessions: "OrderedDict[str, _Session]" = OrderedDict()
+        # (expires_at, session id); entries whose session moved on are skipped
+        self._expiries: List[Tuple[float, str]] = []
+        self.expired = 0
+        self.evicted = 0
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def __contains__(self, session_id: object) -> bool:
+        session = self._sessions.get(session_id)  # type: ignore[arg-type]
+        return session is not None and session.expires_at > self.clock()
+
+    def add(self, session_id: str, hard_expiry: Optional[float] = None) -> None:
+        """Adds or renews a session that may live until hard_expiry at most."""
+        now = self.clock()
+        self.expire(now)
+        self._sessions.pop(session_id, None)
+        while len(self._sessions) >= self.max_entries:
+            self._sessions.popitem(last=False)
+            self.evicted += 1
+        session = _Session(self._next_expiry(now, hard_expiry), hard_expiry)
+        if session.expires_at <= now:
+            return
+        self._sessions[session_id] = session
+        self._schedule(session_id, session)
+
+    def touch(self, session_id: str) -> bool:
+        """
+        Checks that a session is valid and extends its idle timeout.
+
+        Returns False for unknown and expired sessions.
+        """
+        now = self.clock()
+        self.expire(now)
+        session = self._sessions.get(session_id)
+        if session is None:
+            return False
+        self._sessions.move_to_end(session_id)
+        expires_at = self._next_expiry(now, session.hard_expiry)
+        if expires_at > session.expires_at:
+            session.expires_at = expires_at
+            self._schedule(session_id, session)
+        return True
+
+    def discard(self, session_id: str) -> None:
+        self._sessions.pop(session_id, None)
+
+    def clear(self) -> None:
+        self._sessions.clear()
+        self._expiries.clear()
+
+    def expire(self, now: Optional[float] = None) -> int:
+        """Removes the sessions that expired by now and returns how many there were."""
+        if now is None:
+            now = self.clock()
+        removed = 0
+        while self._expiries and self._expiries[0][0] <= now:
+            expires_at, session_id = heapq.heappop(self._expiries)
+            session = self._sessions.get(session_id)
+            if session is not None and session.expires_at == expires_at:
+                del self._sessions[session_id]
+                removed += 1
+        self.expired += removed
+        return removed
+
+    def stats(self) -> Dict[str, int]:
+        self.expire()
+        return {"live": len(self._sessions), "expired": self.expired, "evicted": self.evicted}
+
+    def _next_expiry(self, now: float, hard_expiry: Optional[float]) -> float:
+        expires_at = now + self.idle_timeout
+        if hard_expiry is not None:
+            expires_at = min(expires_at, hard_expiry)
+        return expires_at
+
+    def _schedule(self, session_id: str, session: _Session) -> None:
+        heapq.heappush(self._expiries, (session.expires_at, session_id))
+        # Every renewal leaves an outdated entry behind, drop them now and then
+        if len(self._expiries) > 2 * len(self._sessions) + 64:
+            self._expiries = [
+                (expires_at, sid)
+                for expires_at, sid in self._expiries
+                if sid in self._sessions and self._sessions[sid].expires_at == expires_at
+            ]
+            heapq.heapify(self._expiries)
@@ -0,0 +1,378 @@
+"""
+Pool of long-lived shell processes for running validated commands.
+
+Starting a login shell per command means sourcing the user's profiles every
+time. The workers in this pool are started once inside the allowed directory
+and then receive commands over their stdin. Each command is framed with a
+random marker so its output and exit code can be told apart from the next one.
+"""
+
+import asyncio
+import codecs
+import logging
+import os
+import secrets
+import shlex
+import signal
+import time
+from typing import Awaitable, Callable, Dict, List, Optional, Protocol, Tuple
+
+from .process import DEFAULT_KILL_GRACE_PERIOD, GROUP_POLL_INTERVAL, ResourceUsage
+
+logger = logging.getLogger(__name__)
+
+# Bytes requested per read from a worker pipe
+READ_CHUNK_SIZE = 65536
+
+# How long a freshly started worker may take to source its profiles
+WORKER_START_TIMEOUT = 30
+
+
+class OutputSink(Protocol):
+    """Anything command output can be written to, such as an OutputBuffer"""
+
+    def write(self, data: bytes) -> None: ...
+
+
+class _Discard:
+    def write(self, data: bytes) -> None:
+        pass
+
+
+class ShellWorkerError(Exception):
+    """A shell worker died or broke the framing protocol"""
+
+    pass
+
+
+class ShellWorker:
+    """
+    A single persistent shell reading framed commands from its stdin.
+
+    Every command runs in a subshell that starts in the allowed directory with
+    /dev/null as stdin, so directory changes, variables and `exit` do not leak
+    into the next command. The worker runs in its own session so it can be
+    killed together with everything it started. prelude, such as a set of
+    `ulimit` calls, runs in each command's subshell before the command. On a
+    timeout the worker's group gets SIGTERM, then SIGKILL after grace_period.
+    """
+
+    def __init__(
+        self,
+        shell_args: List[str],
+        cwd: str,
+        prelude: str = "",
+        grace_period: float = DEFAULT_KILL_GRACE_PERIOD,
+    ):
+        self.shell_args = shell_args
+        self.cwd = cwd
+        self.prelude = prelude
+        self.grace_period = grace_period
+        self.process: Optional[asyncio.subprocess.Process] = None
+        self.commands_run = 0
+        # Set once the worker was killed, before its exit has been reaped
+        self.dead = False
+
+    @property
+    def alive(self) -> bool:
+        return not self.dead and self.process is not None and self.process.returncode is None
+
+    async def start(self) -> None:
+        """Starts the shell and waits until its profiles have been sourced."""
+        self.process = await asyncio.create_subprocess_exec(
+            *self.shell_args,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            cwd=self.cwd,
+            env=os.environ,
+            start_new_session=True,
+        )
+        # A no-op round trip only completes once the shell reads its stdin
+        await self.run(":", WORKER_START_TIMEOUT, _Discard(), _Discard())
+        self.commands_run = 0
+
+    async def run(
+        self,
+        command_string: str,
+        timeout: float,
+        stdout: OutputSink,
+        stderr: OutputSink,
+        on_output: Optional[Callable[[str, str], Awaitable[None]]] = None,
+        usage: Optional[ResourceUsage] = None,
+        environment: Optional[Dict[str, str]] = None,
+    ) -> int:
+        """
+        Runs one command on this worker, writing its output to stdout and stderr.
+
+        Returns the command's exit code. The CPU time of the command is added to
+        usage when it can be read from /proc. environment is exported in the
+        command's subshell only.
+
+        Raises:
+            asyncio.TimeoutError: If the command did not finish in time. The worker is killed.
+            ShellWorkerError: If the worker exited before completing the command.
+        """
+        if not self.alive:
+            raise ShellWorkerError("Shell worker is not running")
+
+        marker = f"__CLI_USE_{secrets.token_hex(12)}__"
+        prelude = "".join(
+            f"export {name}={shlex.quote(value)} && " for name, value in (environment or {}).items()
+        )
+        if self.prelude:
+            prelude += f"{self.prelude} && "
+        frame = (
+            f"( {prelude}cd -- {shlex.quote(self.cwd)} && eval {shlex.quote(command_string)} ) </dev/null\n"
+            f"printf '\\n%s:%d\\n' {marker} \"$?\"\n"
+            f"printf '\\n%s\\n' {marker} >&2\n"
+        )
+        self.commands_run += 1
+        cpu_before = self._children_cpu_times()
+        try:
+            self.process.stdin.write(frame.encode())
+            await self.process.stdin.drain()
+            exit_code, _ = await asyncio.wait_for(
+                asyncio.gather(
+                    self._read_frame(self.process.stdout, f"\n{marker}:".encode(), "stdout", stdout, on_output),
+                    self._read_frame(self.process.stderr, f"\n{marker}\n".encode(), "stderr", stderr, on_output),
+                ),
+                timeout=timeout,
+            )
+        except asyncio.TimeoutError:
+            await self.terminate()
+            raise
+        except asyncio.CancelledError:
+            self.kill()
+            raise
+        except (ConnectionError, ShellWorkerError) as e:
+            self.kill()
+            raise ShellWorkerError(f"Shell worker exited unexpectedly: {str(e)}")
+
+        cpu_after = self._children_cpu_times()
+        if usage is not None and cpu_before is not None and cpu_after is not None:
+            usage.add_cpu(cpu_after[0] - cpu_before[0], cpu_after[1] - cpu_before[1])
+        return int(exit_code)
+
+    def _children_cpu_times(self) -> Optional[Tuple[float, float]]:
+        """
+        Returns the user and system CPU seconds of the worker's reaped children.
+
+        Each command runs in a subshell the worker waits for, so the difference
+        before and after a command is the CPU time of that command.
+        """
+        try:
+            with open(f"/proc/{self.process.pid}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+        except (OSError, IndexError):
+            return None
+        ticks = os.sysconf("SC_CLK_TCK")
+        # cutime and cstime are fields 16 and 17; fields[0] is field 3
+        return int(fields[13]) / ticks, int(fields[14]) / ticks
+
+    async def _read_frame(
+        self,
+        stream: asyncio.StreamReader,
+        terminator: bytes,
+        name: str,
+        sink: OutputSink,
+        on_output: Optional[Callable[[str, str], Awaitable[None]]],
+    ) -> bytes:
+        """
+        Reads a stream up to the command's terminator, writing the output to sink.
+
+        Only the bytes that could still be the start of the terminator are held
+        back, so memory use stays constant however much the command prints. For
+        stdout the exit code written on the line after the terminator is returned.
+        """
+        buffer = bytearray()
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+
+        async def flush(end: int, final: bool = False) -> None:
+            data = bytes(buffer[:end])
+            del buffer[:end]
+            sink.write(data)
+            if on_output is not None:
+                text = decoder.decode(data, final=final)
+                if text:
+                    await on_output(name, text)
+
+        while True:
+            end = buffer.find(terminator)
+            if end != -1:
+                if name == "stderr":
+                    break
+                # Wait for the rest of the exit code line
+                if buffer.find(b"\n", end + len(terminator)) != -1:
+                    break
+            elif len(buffer) > len(terminator):
+                await flush(len(buffer) - len(terminator))
+
+            data = await stream.read(READ_CHUNK_SIZE)
+            if not data:
+                raise ShellWorkerError(f"unexpected end of {name}")
+            buffer.extend(data)
+
+        await flush(end, final=True)
+        trailer = bytes(buffer[len(terminator):])
+        return trailer.strip()
+
+    def kill(self, sig: int = signal.SIGKILL) -> None:
+        """Kills the worker and every process it started."""
+        if self.process is None:
+            return
+        if sig == signal.SIGKILL:
+            self.dead = True
+        try:
+            os.killpg(self.process.pid, sig)
+        except (ProcessLookupError, PermissionError):
+            pass
+
+    async def terminate(self) -> None:
+        """Sends SIGTERM to the worker's group, and SIGKILL after grace_period."""
+        self.kill(signal.SIGTERM)
+        self.kill(signal.SIGCONT)
+        deadline = time.monotonic() + self.grace_period
+        while self.alive and time.monotonic() < deadline:
+            await asyncio.sleep(GROUP_POLL_INTERVAL)
+        # Also catches processes of the group that outlive the shell
+        self.kill()
+
+    async def close(self) -> None:
+        """Stops the worker and waits for it to exit."""
+        if self.process is None:
+            return
+        self.kill()
+        await self.process.wait()
+
+
+class ShellWorkerPool:
+    """
+    Keeps a fixed number of pre-started ShellWorkers ready to run commands.
+
+    Workers are replaced after max_commands commands, after a timeout and
+    whenever they crash, so long-running servers do not accumulate shell state.
+    Callers are expected to validate commands before handing them to the pool.
+    """
+
+    def __init__(
+        self,
+        shell_args: List[str],
+        cwd: str,
+        size: int,
+        max_commands: int = 100,
+        prelude: str = "",
+        grace_period: float = DEFAULT_KILL_GRACE_PERIOD,
+    ):
+        self.shell_args = shell_args
+        self.cwd = cwd
+        self.prelude = prelude
+        self.grace_period = grace_period
+        self.size = size
+        self.max_commands = max_commands
+        self.workers_started = 0
+        self.spawn_failures = 0
+        self._last_spawn_error: Optional[str] = None
+        self._idle: Optional[asyncio.Queue] = None
+        self._workers: List[ShellWorker] = []
+        self._replacements: set = set()
+
+    async def start(self) -> None:
+        """Starts every worker up front so the first commands do not wait for profiles."""
+        if self._idle is not None:
+            return
+        self._idle = asyncio.Queue()
+        try:
+            await asyncio.gather(*(self._spawn() for _ in range(self.size)))
+        except Exception:
+            await self.close()
+            raise
+
+    async def _spawn(self) -> None:
+        worker = ShellWorker(self.shell_args, self.cwd, self.prelude, self.grace_period)
+        self._workers.append(worker)
+        try:
+            await worker.start()
+        except Exception:
+            self._workers.remove(worker)
+            await worker.close()
+            raise
+        self.workers_started += 1
+        self._idle.put_nowait(worker)
+
+    async def run(
+        self,
+        command_string: str,
+        timeout: float,
+        stdout: OutputSink,
+        stderr: OutputSink,
+        on_output: Optional[Callable[[str, str], Awaitable[None]]] = None,
+        usage: Optional[ResourceUsage] = None,
+        environment: Optional[Dict[str, str]] = None,
+    ) -> int:
+        """
+        Runs a command on the next idle worker and returns its exit code.
+
+        A busy worker is free again within timeout and a replaced one starts
+        within WORKER_START_TIMEOUT, so waiting longer than both for a worker
+        means the pool cannot serve the command.
+
+        Raises:
+            asyncio.TimeoutError: If the command did not finish in time.
+            ShellWorkerError: If no worker became available or the worker died.
+        """
+        await self.start()
+        if not self._workers:
+            raise ShellWorkerError(self._unavailable_message())
+        try:
+            worker = await asyncio.wait_for(self._idle.get(), timeout + WORKER_START_TIMEOUT)
+        except asyncio.TimeoutError:
+            raise ShellWorkerError(self._unavailable_message())
+        failed = True
+        try:
+            exit_code = await worker.run(
+                command_string, timeout, stdout, stderr, on_output, usage, environment
+            )
+            failed = False
+            return exit_code
+        finally:
+            self._release(worker, failed)
+
+    def _unavailable_message(self) -> str:
+        message = "No shell workers available"
+        if self._last_spawn_error:
+            message += f", last start failed: {self._last_spawn_error}"
+        return message
+
+    def _release(self, worker: ShellWorker, failed: bool = False) -> None:
+        # A worker whose command raised may be killed but not yet reaped
+        if not failed and worker.alive and worker.commands_run < self.max_commands:
+            self._idle.put_nowait(worker)
+            return
+        # Recycle in the background so the caller gets its result right away
+        task = asyncio.ensure_future(self._replace(worker))
+        self._replacements.add(task)
+        task.add_done_callback(self._replacements.discard)
+
+    async def _replace(self, worker: ShellWorker) -> None:
+        self._workers.remove(worker)
+        await worker.close()
+        try:
+            await self._spawn()
+        except Exception as e:
+            self.spawn_failures += 1
+            self._last_spawn_error = str(e) or type(e).__name__
+            logger.error(
+                f"Could not start a replacement shell worker, "
+                f"{len(self._workers)} of {self.size} left: {self._last_spawn_error}"
+            )
+            return
+        self._last_spawn_error = None
+
+    async def close(self) -> None:
+        """Stops all workers."""
+        for task in list(self._replacements):
+            task.cancel()
+        await asyncio.gather(*(worker.close() for worker in self._workers))
+        self._workers.clear()
+        self._idle = None
@@ -0,0 +1,340 @@
+"""
+State shared by the worker processes of one deployment.
+
+Authenticated sessions and the metadata of background jobs are kept in a
+StateBackend. MemoryStateBackend keeps them in the process, which is all a
+single worker needs. SQLiteStateBackend keeps them in a local SQLite database
+in WAL mode, so that several workers on one host, e.g. uvicorn workers behind
+one port, share them: a session authenticated on one worker is valid on all
+of them, and every worker lists the jobs of a session. A job's processes and
+output stay with the worker that started it.
+
+Both backends are called from the event loop. SQLite statements on these
+small tables take microseconds; WAL mode lets readers proceed while another
+worker writes, and writers wait at most BUSY_TIMEOUT for each other.
+"""
+
+import abc
+import contextlib
+import os
+import sqlite3
+import time
+from dataclasses import asdict, dataclass, fields
+from typing import Callable, Dict, Iterator, List, Optional
+
+from .sessions import DEFAULT_MAX_SESSIONS, DEFAULT_SESSION_IDLE_TIMEOUT, SessionStore
+
+STATE_BACKENDS = ("memory", "sqlite")
+
+# Seconds a write waits for another worker's transaction
+BUSY_TIMEOUT = 1.0
+
+
+class StateError(Exception):
+    """The state backend is misconfigured or cannot be opened"""
+
+    pass
+
+
+@dataclass
+class JobRecord:
+    """What every worker knows about a background job"""
+
+    job_id: str
+    owner: str
+    worker: int
+    command: str
+    status: str
+    started_at: float
+    finished_at: Optional[float] = None
+    returncode: Optional[int] = None
+    error: Optional[str] = None
+    stdout_bytes: int = 0
+    stderr_bytes: int = 0
+
+    def summary(self) -> str:
+        runtime = (self.finished_at or time.time()) - self.started_at
+        line = f"Job {self.job_id}: {self.status}"
+        if self.returncode is not None:
+            line += f" (return code {self.returncode})"
+        line += (
+            f", {runtime:.1f}s, stdout {self.stdout_bytes} bytes,"
+            f" stderr {self.stderr_bytes} bytes\n"
+            f"Command: {self.command}"
+        )
+        if self.worker != os.getpid():
+            line += f"\nWorker: {self.worker}"
+        if self.error:
+            line += f"\nError: {self.error}"
+        return line
+
+
+class StateBackend(abc.ABC):
+    """
+    Storage of sessions and job metadata.
+
+    Sessions follow the rules of sessions.SessionStore: each use extends a
+    session by the idle timeout up to its hard expiry, and the least recently
+    used session is evicted when the store is full.
+    """
+
+    @abc.abstractmethod
+    def add_session(self, session_id: str, hard_expiry: Optional[float] = None) -> None:
+        ...
+
+    @abc.abstractmethod
+    def touch_session(self, session_id: str) -> bool:
+        """Checks that a session is valid and extends its idle timeout."""
+
+    @abc.abstractmethod
+    def discard_session(self, session_id: str) -> None:
+        ...
+
+    @abc.abstractmethod
+    def session_stats(self) -> Dict[str, int]:
+        ...
+
+    @abc.abstractmethod
+    def put_job(self, record: JobRecord) -> None:
+        """Stores a job record, replacing the one with the same id."""
+
+    @abc.abstractmethod
+    def get_job(self, job_id: str) -> Optional[JobRecord]:
+        ...
+
+    @abc.abstractmethod
+    def list_jobs(self, owner: str) -> List[JobRecord]:
+        """Returns the jobs of owner, oldest first."""
+
+    @abc.abstractmethod
+    def delete_job(self, job_id: str) -> None:
+        ...
+
+    def close(self) -> None:
+        pass
+
+
+class MemoryStateBackend(StateBackend):
+    """State of a single worker process"""
+
+    def __init__(
+        self,
+        idle_timeout: float = DEFAULT_SESSION_IDLE_TIMEOUT,
+        max_sessions: int = DEFAULT_MAX_SESSIONS,
+        clock: Callable[[], float] = time.time,
+    ):
+        self.sessions = SessionStore(idle_timeout, max_sessions, clock)
+        self._jobs: Dict[str, JobRecord] = {}
+
+    def add_session(self, session_id: str, hard_expiry: Optional[float] = None) -> None:
+        self.sessions.add(session_id, hard_expiry)
+
+    def touch_session(self, session_id: str) -> bool:
+        return self.sessions.touch(session_id)
+
+    def discard_session(self, session_id: str) -> None:
+        self.sessions.discard(session_id)
+
+    def session_stats(self) -> Dict[str, int]:
+        return self.sessions.stats()
+
+    def put_job(self, record: JobRecord) -> None:
+        self._jobs[record.job_id] = JobRecord(**asdict(record))
+
+    def get_job(self, job_id: str) -> Optional[JobRecord]:
+        record = self._jobs.get(job_id)
+        return JobRecord(**asdict(record)) if record is not None else None
+
+    def list_jobs(self, owner: str) -> List[JobRecord]:
+        return sorted(
+            (JobRecord(**asdict(record)) for record in self._jobs.values() if record.owner == owner),
+            key=lambda record: record.started_at,
+        )
+
+    def delete_job(self, job_id: str) -> None:
+        self._jobs.pop(job_id, None)
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    session_id TEXT PRIMARY KEY,
+    expires_at REAL NOT NULL,
+    hard_expiry REAL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS sessions_expires_at ON sessions (expires_at);
+CREATE INDEX IF NOT EXISTS sessions_last_used ON sessions (last_used);
+CREATE TABLE IF NOT EXISTS counters (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id TEXT PRIMARY KEY,
+    owner TEXT NOT NULL,
+    worker INTEGER NOT NULL,
+    command TEXT NOT NULL,
+    status TEXT NOT NULL,
+    started_at REAL NOT NULL,
+    finished_at REAL,
+    returncode INTEGER,
+    error TEXT,
+    stdout_bytes INTEGER NOT NULL,
+    stderr_bytes INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_owner ON jobs (owner, started_at);
+"""
+
+_JOB_COLUMNS = tuple(field.name for field in fields(JobRecord))
+
+
+class SQLiteStateBackend(StateBackend):
+    """State shared through a SQLite database by the workers of one host"""
+
+    def __init__(
+        self,
+        path: str,
+        idle_timeout: float = DEFAULT_SESSION_IDLE_TIMEOUT,
+        max_sessions: int = DEFAULT_MAX_SESSIONS,
+        clock: Callable[[], float] = time.time,
+    ):
+        self.path = path
+        self.idle_timeout = idle_timeout
+        self.max_sessions = max(1, max_sessions)
+        self.clock = clock
+        try:
+            # Transactions are managed explicitly, see _transaction
+            self._db = sqlite3.connect(path, timeout=BUSY_TIMEOUT, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            with self._transaction():
+                for statement in _SCHEMA.split(";"):
+                    if statement.strip():
+                        self._db.execute(statement)
+        except sqlite3.Error as e:
+            raise StateError(f"Cannot open state database {path}: {str(e)}")
+
+    @contextlib.contextmanager
+    def _transaction(self) -> Iterator[None]:
+        """Runs a block as one write transaction, taking the database lock up front."""
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            self._db.execute("ROLLBACK")
+            raise
+        self._db.execute("COMMIT")
+
+    def add_session(self, session_id: str, hard_expiry: Optional[float] = None) -> None:
+        now = self.clock()
+        expires_at = now + self.idle_timeout
+        if hard_expiry is not None:
+            expires_at = min(expires_at, hard_expiry)
+        with self._transaction():
+            self._expire(now)
+            self._db.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+            (count,) = self._db.execute("SELECT COUNT(*) FROM sessions").fetchone()
+            excess = count - self.max_sessions + 1
+            if excess > 0:
+                self._db.execute(
+                    "DELETE FROM sessions WHERE session_id IN "
+                    "(SELECT session_id FROM sessions ORDER BY last_used LIMIT ?)",
+                    (excess,),
+                )
+                self._count("evicted", excess)
+            if expires_at > now:
+                self._db.execute(
+                    "INSERT INTO sessions (session_id, expires_at, hard_expiry, last_used) "
+                    "VALUES (?, ?, ?, ?)",
+                    (session_id, expires_at, hard_expiry, now),
+                )
+
+    def touch_session(self, session_id: str) -> bool:
+        now = self.clock()
+        with self._transaction():
+            cursor = self._db.execute(
+                "UPDATE sessions SET last_used = ?, "
+                "expires_at = MAX(expires_at, MIN(?, COALESCE(hard_expiry, ?))) "
+                "WHERE session_id = ? AND expires_at > ?",
+                (now, now + self.idle_timeout, now + self.idle_timeout, session_id, now),
+            )
+            return cursor.rowcount == 1
+
+    def discard_session(self, session_id: str) -> None:
+        with self._transaction():
+            self._db.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+
+    def session_stats(self) -> Dict[str, int]:
+        with self._transaction():
+            self._expire(self.clock())
+            (live,) = self._db.execute("SELECT COUNT(*) FROM sessions").fetchone()
+            counters = dict(self._db.execute("SELECT name, value FROM counters"))
+        return {
+            "live": live,
+            "expired": counters.get("expired", 0),
+            "evicted": counters.get("evicted", 0),
+        }
+
+    def put_job(self, record: JobRecord) -> None:
+        values = asdict(record)
+        with self._transaction():
+            self._db.execute(
+                f"INSERT OR REPLACE INTO jobs ({', '.join(_JOB_COLUMNS)}) "
+                f"VALUES ({', '.join('?' for _ in _JOB_COLUMNS)})",
+                tuple(values[column] for column in _JOB_COLUMNS),
+            )
+
+    def get_job(self, job_id: str) -> Optional[JobRecord]:
+        row = self._db.execute(
+            f"SELECT {', '.join(_JOB_COLUMNS)} FROM jobs WHERE job_id = ?", (job_id,)
+        ).fetchone()
+        return JobRecord(*row) if row is not None else None
+
+    def list_jobs(self, owner: str) -> List[JobRecord]:
+        rows = self._db.execute(
+            f"SELECT {', '.join(_JOB_COLUMNS)} FROM jobs WHERE owner = ? ORDER BY started_at",
+            (owner,),
+        )
+        return [JobRecord(*row) for row in rows]
+
+    def delete_job(self, job_id: str) -> None:
+        with self._transaction():
+            self._db.execute("DELETE FROM jobs WHERE job_id = ?", (job_id,))
+
+    def close(self) -> None:
+        self._db.close()
+
+    def _expire(self, now: float) -> None:
+        cursor = self._db.execute("DELETE FROM sessions WHERE expires_at <= ?", (now,))
+        if cursor.rowcount > 0:
+            self._count("expired", cursor.rowcount)
+
+    def _count(self, name: str, amount: int) -> None:
+        self._db.execute(
+            "INSERT INTO counters (name, value) VALUES (?, ?) "
+            "ON CONFLICT (name) DO UPDATE SET value = value + excluded.value",
+            (name, amount),
+        )
+
+
+def create_state_backend(
+    backend: str,
+    path: Optional[str] = None,
+    idle_timeout: float = DEFAULT_SESSION_IDLE_TIMEOUT,
+    max_sessions: int = DEFAULT_MAX_SESSIONS,
+) -> StateBackend:
+    """
+    Creates the backend named by STATE_BACKEND.
+
+    Raises:
+        StateError: If the backend is unknown, or sqlite is chosen without a path
+            or the database cannot be opened.
+    """
+    if backend == "memory":
+        return MemoryStateBackend(idle_timeout, max_sessions)
+    if backend == "sqlite":
+        if not path:
+            raise StateError("STATE_DB_PATH is required for the sqlite state backend")
+        return SQLiteStateBackend(path, idle_timeout, max_sessions)
+    raise StateError(
+        f"Unknown state backend '{backend}', expected one of: {', '.join(STATE_BACKENDS)}"
+    )
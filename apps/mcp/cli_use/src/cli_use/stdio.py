@@ -0,0 +1,219 @@
+"""
+Stdio transport on the event loop's pipe transports.
+
+Messages are newline-delimited JSON-RPC, framed on bytes: stdin is read in
+chunks through loop.connect_read_pipe and split at newlines without a thread
+hop per line, and responses go out through loop.connect_write_pipe. Responses
+that are ready together are joined into one write, and the writer waits for
+the client to read whenever more than WRITE_BUFFER_HIGH bytes are pending, so
+a client that stops reading slows the server down instead of growing its
+buffers without bound.
+
+The pipe transports need pipes, sockets or terminals. When stdin or stdout
+is a regular file, the transport of the mcp package is used instead.
+"""
+
+import asyncio
+import contextlib
+import os
+import stat
+import sys
+from typing import Any, AsyncIterator, BinaryIO, List, Optional, Tuple
+
+import anyio
+import anyio.lowlevel
+import mcp.server.stdio
+import mcp.types as types
+
+# Longest message accepted from the client
+MAX_MESSAGE_BYTES = 64 * 1024 * 1024
+
+# Pending output at which the writer waits for the client to read
+WRITE_BUFFER_HIGH = 256 * 1024
+
+# Messages buffered from the pipes to the server and back, and joined into one write at most
+MESSAGE_BUFFER = 64
+
+
+class _ReadProtocol(asyncio.Protocol):
+    """Queues the chunks read from stdin, pausing reads while the queue is full."""
+
+    def __init__(self, max_chunks: int = 16):
+        self.chunks: asyncio.Queue = asyncio.Queue()
+        self.max_chunks = max_chunks
+        self.transport: Optional[asyncio.ReadTransport] = None
+        self._paused = False
+
+    def connection_made(self, transport: asyncio.BaseTransport) -> None:
+        self.transport = transport  # type: ignore[assignment]
+
+    def data_received(self, data: bytes) -> None:
+        self.chunks.put_nowait(data)
+        if self.chunks.qsize() >= self.max_chunks and not self._paused:
+            self._paused = True
+            self.transport.pause_reading()
+
+    def eof_received(self) -> None:
+        self.chunks.put_nowait(b"")
+
+    def connection_lost(self, exc: Optional[Exception]) -> None:
+        self.chunks.put_nowait(b"")
+
+    async def read(self) -> bytes:
+        """Returns the next chunk, or b"" at the end of input."""
+        data = await self.chunks.get()
+        if self._paused and self.chunks.qsize() < self.max_chunks // 2:
+            self._paused = False
+            self.transport.resume_reading()
+        return data
+
+
+class _WriteProtocol(asyncio.Protocol):
+    """Lets the writer wait while the transport's buffer is above its high-water mark."""
+
+    def __init__(self) -> None:
+        self._writable = asyncio.Event()
+        self._writable.set()
+        self.closed = False
+
+    def pause_writing(self) -> None:
+        self._writable.clear()
+
+    def resume_writing(self) -> None:
+        self._writable.set()
+
+    def connection_lost(self, exc: Optional[Exception]) -> None:
+        self.closed = True
+        self._writable.set()
+
+    async def drain(self) -> None:
+        await self._writable.wait()
+        if self.closed:
+            raise ConnectionResetError("stdout was closed")
+
+
+def split_messages(buffer: bytearray, data: bytes) -> List[bytes]:
+    """
+    Appends data to buffer and removes and returns the complete lines in it.
+
+    Raises:
+        ValueError: If the incomplete line in buffer exceeds MAX_MESSAGE_BYTES.
+    """
+    start = len(buffer)
+    buffer += data
+    end = buffer.rfind(b"\n", start)
+    if end < 0:
+        if len(buffer) > MAX_MESSAGE_BYTES:
+            buffer.clear()
+            raise ValueError(f"Message exceeds {MAX_MESSAGE_BYTES} bytes")
+        return []
+    lines = bytes(buffer[:end]).split(b"\n")
+    del buffer[: end + 1]
+    return [line for line in lines if line.strip()]
+
+
+def _is_regular_file(file: BinaryIO) -> bool:
+    try:
+        return stat.S_ISREG(os.fstat(file.fileno()).st_mode)
+    except (OSError, ValueError):
+        return True
+
+
+@contextlib.asynccontextmanager
+async def stdio_transport(
+    stdin: Optional[BinaryIO] = None, stdout: Optional[BinaryIO] = None
+) -> AsyncIterator[Tuple[Any, Any]]:
+    """
+    Serves the MCP client on stdin and stdout.
+
+    Yields the (read_stream, write_stream) pair that serve() takes. The pipes
+    are switched to non-blocking mode while the transport runs, so nothing
+    else may write to stdout in the meantime.
+    """
+    stdin = stdin or sys.stdin.buffer
+    stdout = stdout or sys.stdout.buffer
+    if _is_regular_file(stdin) or _is_regular_file(stdout):
+        async with mcp.server.stdio.stdio_server() as streams:
+            yield streams
+        return
+
+    loop = asyncio.get_running_loop()
+    reader = _ReadProtocol()
+    # Duplicates, so that closing the transports leaves stdin and stdout open
+    read_transport, _ = await loop.connect_read_pipe(
+        lambda: reader, os.fdopen(os.dup(stdin.fileno()), "rb", buffering=0)
+    )
+    writer = _WriteProtocol()
+    write_transport, _ = await loop.connect_write_pipe(
+        lambda: writer, os.fdopen(os.dup(stdout.fileno()), "wb", buffering=0)
+    )
+    write_transport.set_write_buffer_limits(high=WRITE_BUFFER_HIGH)
+
+    read_stream_writer, read_stream = anyio.create_memory_object_stream(MESSAGE_BUFFER)
+    write_stream, write_stream_reader = anyio.create_memory_object_stream(MESSAGE_BUFFER)
+
+    async def read_messages() -> None:
+        buffer = bytearray()
+        try:
+            async with read_stream_writer:
+                while True:
+                    data = await reader.read()
+                    if not data:
+                        break
+                    try:
+                        lines = split_messages(buffer, data)
+                    except ValueError as exc:
+                        await read_stream_writer.send(exc)
+                        continue
+                    for line in lines:
+                        try:
+                            message = types.JSONRPCMessage.model_validate_json(line)
+                        except Exception as exc:
+                            await read_stream_writer.send(exc)
+                            continue
+                        await read_stream_writer.send(message)
+        except anyio.ClosedResourceError:
+            await anyio.lowlevel.checkpoint()
+
+    async def write_messages() -> None:
+        try:
+            async with write_stream_reader:
+                async for message in write_stream_reader:
+                    batch = [message]
+                    # Let the handlers that are ready add their responses, then
+                    # join everything that is waiting into one write
+                    await asyncio.sleep(0)
+                    while len(batch) < MESSAGE_BUFFER:
+                        try:
+                            batch.append(write_stream_reader.receive_nowait())
+                        except (anyio.WouldBlock, anyio.EndOfStream):
+                            break
+                    write_transport.write(
+                        b"".join(
+                            item.model_dump_json(by_alias=True, exclude_none=True).encode() + b"\n"
+                            for item in batch
+                        )
+                    )
+                    await writer.drain()
+        except anyio.ClosedResourceError:
+            await anyio.lowlevel.checkpoint()
+        except ConnectionResetError:
+            # The client closed its end, later responses have nowhere to go
+            pass
+
+    try:
+        async with anyio.create_task_group() as tg:
+            tg.start_soon(read_messages)
+            tg.start_soon(write_messages)
+            try:
+                yield read_stream, write_stream
+            finally:
+                # Flush the responses still queued and stop reading
+                await write_stream.aclose()
+                read_transport.close()
+    finally:
+        read_transport.close()
+        write_transport.close()
+        for file in (stdin, stdout):
+            with contextlib.suppress(OSError, ValueError):
+                os.set_blocking(file.fileno(), True)
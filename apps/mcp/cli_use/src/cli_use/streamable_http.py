@@ -0,0 +1,478 @@
+"""
+Streamable HTTP transport (MCP protocol revision 2025-03-26).
+
+Each client talks to a single endpoint. It POSTs its JSON-RPC messages
+there; a POST that carries requests is answered with a text/event-stream
+that is written in chunks as the responses become ready and ends after the
+last one, so the client reuses its keep-alive connection for the next POST.
+GET opens a stream of the messages the server sends on its own, such as
+notifications/tools/list_changed, and DELETE ends the session. The
+initialize request starts a session; its response names the session in the
+Mcp-Session-Id header, which the client sends from then on.
+
+Every event has an ID, and the last replay_events events of a session are
+kept. A client whose stream broke off sends GET with the Last-Event-ID
+header and receives the events of that stream that followed, then the rest
+of the stream if it is still open. The response of a tool call that was
+running when the connection dropped is thereby delivered late instead of
+lost, and the command does not have to run again. Streams of requests start
+with an event without data, so that there is an ID to resume from before the
+first response.
+"""
+
+import asyncio
+import itertools
+import json
+import logging
+import secrets
+import time
+from collections import OrderedDict, deque
+from typing import Any, AsyncIterator, Callable, Deque, Dict, List, Optional, Set, Tuple
+
+import anyio
+import mcp.types as types
+from mcp.server.lowlevel import Server
+from pydantic import ValidationError
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response, StreamingResponse
+
+from .cancellation import serve
+from .serving import WorkerRouter
+from .sessions import DEFAULT_MAX_SESSIONS, DEFAULT_SESSION_IDLE_TIMEOUT
+
+logger = logging.getLogger(__name__)
+
+SESSION_HEADER = "Mcp-Session-Id"
+LAST_EVENT_HEADER = "Last-Event-ID"
+
+# Events of a session kept for clients that resume a stream
+DEFAULT_REPLAY_EVENTS = 1024
+
+# Seconds between comments that keep an idle stream open through proxies
+PING_INTERVAL = 15.0
+
+# Messages buffered from the HTTP requests to the server and back
+MESSAGE_BUFFER = 64
+
+# Key of the stream of messages that answer no request
+STANDALONE = "standalone"
+
+# An event as it is queued for a connection: its ID and its data
+Event = Tuple[int, bytes]
+
+
+class EventBuffer:
+    """The last max_events events of one session, with IDs counting up from 1."""
+
+    def __init__(self, max_events: int = DEFAULT_REPLAY_EVENTS):
+        self._events: Deque[Tuple[int, str, bytes]] = deque(maxlen=max(1, max_events))
+        self.last_id = 0
+
+    def __len__(self) -> int:
+        return len(self._events)
+
+    def append(self, stream: str, data: bytes) -> int:
+        """Adds an event of stream and returns its ID."""
+        self.last_id += 1
+        self._events.append((self.last_id, stream, data))
+        return self.last_id
+
+    def replay(self, event_id: int) -> Tuple[str, List[Event]]:
+        """
+        Returns the stream of event event_id and the events of that stream after it.
+
+        Events are dropped oldest first, so all events after one that is kept
+        are kept as well.
+
+        Raises:
+            KeyError: If the event is no longer kept, or never existed.
+        """
+        first = self.last_id - len(self._events) + 1
+        if not first <= event_id <= self.last_id:
+            raise KeyError(event_id)
+        position = event_id - first
+        stream = self._events[position][1]
+        return stream, [
+            (later_id, data)
+            for later_id, later_stream, data in itertools.islice(self._events, position + 1, None)
+            if later_stream == stream
+        ]
+
+
+class _Stream:
+    """One stream of events and the connection that carries it at the moment, if any."""
+
+    def __init__(self, key: str, closed: bool = False):
+        self.key = key
+        # Requests whose responses are still to come on this stream
+        self.pending: Set[Any] = set()
+        self.closed = closed
+        self.listener: Optional[asyncio.Queue] = None
+
+    def attach(self, events: List[Event]) -> asyncio.Queue:
+        """Moves the stream onto a new connection, which first receives events."""
+        if self.listener is not None:
+            # Ends the connection that carried the stream so far
+            self.listener.put_nowait(None)
+        queue: asyncio.Queue = asyncio.Queue()
+        for event in events:
+            queue.put_nowait(event)
+        if self.closed:
+            queue.put_nowait(None)
+            self.listener = None
+        else:
+            self.listener = queue
+        return queue
+
+    def detach(self, queue: asyncio.Queue) -> None:
+        if self.listener is queue:
+            self.listener = None
+
+    def deliver(self, event: Event) -> None:
+        if self.listener is not None:
+            self.listener.put_nowait(event)
+
+    def close(self) -> None:
+        self.closed = True
+        if self.listener is not None:
+            self.listener.put_nowait(None)
+            self.listener = None
+
+
+class StreamableSession:
+    """One client of the streamable HTTP transport and the server task that serves it."""
+
+    def __init__(self, session_id: str, replay_events: int, clock: Callable[[], float]):
+        self.id = session_id
+        self.events = EventBuffer(replay_events)
+        self.streams: Dict[str, _Stream] = {STANDALONE: _Stream(STANDALONE)}
+        self.last_active = clock()
+        self.task: Optional[asyncio.Task] = None
+        self.read_writer, self._read_stream = anyio.create_memory_object_stream(MESSAGE_BUFFER)
+        self._write_stream, self._write_reader = anyio.create_memory_object_stream(MESSAGE_BUFFER)
+        # Streams of the requests in progress, by request id and by progress token
+        self._requests: Dict[Any, _Stream] = {}
+        self._progress: Dict[Any, _Stream] = {}
+        self._stream_ids = itertools.count(1)
+
+    def idle(self) -> bool:
+        """Whether no request is in progress and no connection carries a stream."""
+        return not self._requests and all(s.listener is None for s in self.streams.values())
+
+    def in_progress(self, request_id: Any) -> bool:
+        return request_id in self._requests
+
+    def open_stream(self, requests: List[types.JSONRPCRequest]) -> _Stream:
+        """Opens the stream that carries the responses to requests."""
+        stream = _Stream(str(next(self._stream_ids)))
+        self.streams[stream.key] = stream
+        for request in requests:
+            stream.pending.add(request.id)
+            self._requests[request.id] = stream
+            meta = (request.params or {}).get("_meta") or {}
+            if meta.get("progressToken") is not None:
+                self._progress[meta["progressToken"]] = stream
+        return stream
+
+    def resume(self, event_id: int) -> Tuple[_Stream, List[Event]]:
+        """
+        Returns the stream of event event_id and its events after it.
+
+        Raises:
+            KeyError: If the event is no longer kept.
+        """
+        key, events = self.events.replay(event_id)
+        # Streams that ended are only kept as their events
+        return self.streams.get(key) or _Stream(key, closed=True), events
+
+    def send(self, stream: _Stream, data: bytes) -> None:
+        event_id = self.events.append(stream.key, data)
+        stream.deliver((event_id, data))
+
+    def route(self, message: types.JSONRPCMessage) -> None:
+        """Sends a message of the server on the stream it belongs to."""
+        root = message.root
+        stream: Optional[_Stream] = None
+        if isinstance(root, (types.JSONRPCResponse, types.JSONRPCError)):
+            stream = self._requests.pop(root.id, None)
+        elif isinstance(root, types.JSONRPCNotification) and root.method == "notifications/progress":
+            stream = self._progress.get((root.params or {}).get("progressToken"))
+        if stream is None or stream.closed:
+            stream = self.streams[STANDALONE]
+
+        self.send(stream, message.model_dump_json(by_alias=True, exclude_none=True).encode())
+        if stream.key != STANDALONE and isinstance(
+            root, (types.JSONRPCResponse, types.JSONRPCError)
+        ):
+            stream.pending.discard(root.id)
+            if not stream.pending:
+                stream.close()
+                del self.streams[stream.key]
+                for token in [t for t, s in self._progress.items() if s is stream]:
+                    del self._progress[token]
+
+    async def run(self, server: Server, initialization_options: Any) -> None:
+        """Serves the session until its task is cancelled or the server stops."""
+
+        async def write_messages() -> None:
+            async with self._write_reader:
+                async for message in self._write_reader:
+                    self.route(message)
+
+        try:
+            async with anyio.create_task_group() as tg:
+                tg.start_soon(write_messages)
+                await serve(server, self._read_stream, self._write_stream, initialization_options)
+                tg.cancel_scope.cancel()
+        finally:
+            for stream in self.streams.values():
+                stream.close()
+
+
+class StreamableHTTPTransport:
+    """
+    ASGI app of the streamable HTTP endpoint.
+
+    Sessions without a request in progress and without an open stream expire
+    after idle_timeout seconds, and beyond max_sessions the least recently
+    active session is closed. With a router, requests of sessions that
+    another worker started are passed on to that worker.
+    """
+
+    def __init__(
+        self,
+        server: Server,
+        initialization_options: Any,
+        replay_events: int = DEFAULT_REPLAY_EVENTS,
+        idle_timeout: float = DEFAULT_SESSION_IDLE_TIMEOUT,
+        max_sessions: int = DEFAULT_MAX_SESSIONS,
+        router: Optional[WorkerRouter] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.server = server
+        self.initialization_options = initialization_options
+        self.replay_events = replay_events
+        self.idle_timeout = idle_timeout
+        self.max_sessions = max(1, max_sessions)
+        self.router = router
+        self.clock = clock
+        self._sessions: "OrderedDict[str, StreamableSession]" = OrderedDict()
+        self._sweeper: Optional[asyncio.Task] = None
+        self._counters = {
+            "sessions_started": 0,
+            "sessions_expired": 0,
+            "sessions_dropped": 0,
+            "streams_resumed": 0,
+            "events_replayed": 0,
+        }
+
+    async def start(self) -> None:
+        """Starts expiring idle sessions."""
+        self._sweeper = asyncio.ensure_future(self._sweep_periodically())
+
+    async def close(self) -> None:
+        """Closes all sessions, cancelling their requests in progress."""
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            self._sweeper = None
+        tasks = [session.task for session in self._sessions.values() if session.task is not None]
+        self._sessions.clear()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "sessions": len(self._sessions),
+            "connected_streams": sum(
+                1
+                for session in self._sessions.values()
+                for stream in session.streams.values()
+                if stream.listener is not None
+            ),
+            **self._counters,
+        }
+
+    async def __call__(self, scope: Dict[str, Any], receive: Any, send: Any) -> None:
+        request = Request(scope, receive)
+        session_id = request.headers.get(SESSION_HEADER)
+        if session_id and self.router is not None:
+            worker = session_id.partition("-")[0]
+            if worker != self.router.worker:
+                await self.router.forward(worker, scope, receive, send)
+                return
+
+        if request.method == "POST":
+            response = await self._handle_post(request, session_id)
+        elif request.method == "GET":
+            response = self._handle_get(request, session_id)
+        elif request.method == "DELETE":
+            response = self._handle_delete(session_id)
+        else:
+            response = Response(status_code=405, headers={"Allow": "GET, POST, DELETE"})
+        await response(scope, receive, send)
+
+    async def _handle_post(self, request: Request, session_id: Optional[str]) -> Response:
+        if not _accepts(request, "text/event-stream"):
+            return _error(406, types.INVALID_REQUEST, "Client must accept text/event-stream")
+        try:
+            body = json.loads(await request.body())
+            messages = [
+                types.JSONRPCMessage.model_validate(item)
+                for item in (body if isinstance(body, list) else [body])
+            ]
+        except ValueError as e:
+            if isinstance(e, ValidationError):
+                return _error(400, types.INVALID_REQUEST, "Invalid JSON-RPC message")
+            return _error(400, types.PARSE_ERROR, f"Parse error: {str(e)}")
+        if not messages:
+            return _error(400, types.INVALID_REQUEST, "Empty batch")
+
+        requests = [m.root for m in messages if isinstance(m.root, types.JSONRPCRequest)]
+        if any(r.method == "initialize" for r in requests):
+            if len(messages) > 1:
+                return _error(400, types.INVALID_REQUEST, "initialize must be sent on its own")
+            session = self._start_session()
+        else:
+            found = self._find_session(session_id)
+            if isinstance(found, Response):
+                return found
+            session = found
+        if any(session.in_progress(r.id) for r in requests):
+            return _error(400, types.INVALID_REQUEST, "Request id is already in progress")
+
+        session.last_active = self.clock()
+        self._sessions.move_to_end(session.id)
+        if requests:
+            stream = session.open_stream(requests)
+            queue = stream.attach([])
+            # An ID to resume from before the first response is ready
+            session.send(stream, b"")
+        try:
+            for message in messages:
+                await session.read_writer.send(message)
+        except (anyio.ClosedResourceError, anyio.BrokenResourceError):
+            return _error(404, types.INVALID_REQUEST, "Session not found")
+        if not requests:
+            return Response(status_code=202, headers={SESSION_HEADER: session.id})
+        return self._event_response(session, stream, queue)
+
+    def _handle_get(self, request: Request, session_id: Optional[str]) -> Response:
+        if not _accepts(request, "text/event-stream"):
+            return _error(406, types.INVALID_REQUEST, "Client must accept text/event-stream")
+        found = self._find_session(session_id)
+        if isinstance(found, Response):
+            return found
+        session = found
+        last_event_id = request.headers.get(LAST_EVENT_HEADER)
+        if last_event_id is None:
+            stream, events = session.streams[STANDALONE], []
+        else:
+            try:
+                stream, events = session.resume(int(last_event_id))
+            except (KeyError, ValueError):
+                return _error(
+                    400, types.INVALID_REQUEST, f"Event {last_event_id} is no longer available"
+                )
+            self._counters["streams_resumed"] += 1
+            self._counters["events_replayed"] += len(events)
+        session.last_active = self.clock()
+        self._sessions.move_to_end(session.id)
+        return self._event_response(session, stream, stream.attach(events))
+
+    def _handle_delete(self, session_id: Optional[str]) -> Response:
+        found = self._find_session(session_id)
+        if isinstance(found, Response):
+            return found
+        self._close_session(found)
+        return Response(status_code=200)
+
+    def _event_response(
+        self, session: StreamableSession, stream: _Stream, queue: asyncio.Queue
+    ) -> StreamingResponse:
+        async def events() -> AsyncIterator[bytes]:
+            try:
+                while True:
+                    try:
+                        event = await asyncio.wait_for(queue.get(), PING_INTERVAL)
+                    except asyncio.TimeoutError:
+                        yield b": ping\n\n"
+                        continue
+                    # Write the events that are ready together in one chunk
+                    chunk = []
+                    while event is not None:
+                        chunk.append(b"id: %d\ndata: %s\n\n" % event)
+                        if queue.empty():
+                            break
+                        event = queue.get_nowait()
+                    if chunk:
+                        yield b"".join(chunk)
+                    if event is None:
+                        return
+            finally:
+                stream.detach(queue)
+                session.last_active = self.clock()
+
+        return StreamingResponse(
+            events(),
+            media_type="text/event-stream",
+            headers={SESSION_HEADER: session.id, "Cache-Control": "no-cache"},
+        )
+
+    def _find_session(self, session_id: Optional[str]) -> Any:
+        """Returns the session named session_id, or the error response if there is none."""
+        if not session_id:
+            return _error(400, types.INVALID_REQUEST, f"Missing {SESSION_HEADER} header")
+        session = self._sessions.get(session_id)
+        if session is None:
+            # Tells the client to start a new session
+            return _error(404, types.INVALID_REQUEST, "Session not found")
+        return session
+
+    def _start_session(self) -> StreamableSession:
+        while len(self._sessions) >= self.max_sessions:
+            _, oldest = self._sessions.popitem(last=False)
+            self._close_session(oldest)
+            self._counters["sessions_dropped"] += 1
+
+        token = secrets.token_hex(16)
+        session_id = f"{self.router.worker}-{token}" if self.router is not None else token
+        session = StreamableSession(session_id, self.replay_events, self.clock)
+        session.task = asyncio.ensure_future(
+            session.run(self.server, self.initialization_options)
+        )
+        session.task.add_done_callback(lambda _: self._forget(session))
+        self._sessions[session_id] = session
+        self._counters["sessions_started"] += 1
+        return session
+
+    def _forget(self, session: StreamableSession) -> None:
+        if self._sessions.get(session.id) is session:
+            del self._sessions[session.id]
+
+    def _close_session(self, session: StreamableSession) -> None:
+        self._forget(session)
+        if session.task is not None:
+            session.task.cancel()
+
+    async def _sweep_periodically(self) -> None:
+        interval = min(60.0, max(self.idle_timeout, 1.0))
+        while True:
+            await asyncio.sleep(interval)
+            now = self.clock()
+            for session in list(self._sessions.values()):
+                if session.idle() and now - session.last_active > self.idle_timeout:
+                    self._close_session(session)
+                    self._counters["sessions_expired"] += 1
+
+
+def _accepts(request: Request, media_type: str) -> bool:
+    accept = request.headers.get("accept")
+    return accept is None or media_type in accept or "*/*" in accept
+
+
+def _error(status: int, code: int, message: str) -> JSONResponse:
+    return JSONResponse(
+        {"jsonrpc": "2.0", "id": None, "error": {"code": code, "message": message}},
+        status_code=status,
+    )
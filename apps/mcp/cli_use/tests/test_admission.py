@@ -0,0 +1,141 @@
+import os
+import asyncio
+import importlib
+import tempfile
+import unittest
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestAdmissionController(unittest.TestCase):
+    def setUp(self):
+        # Importing the package loads the server, which needs an ALLOWED_DIR
+        os.environ.setdefault("ALLOWED_DIR", tempfile.gettempdir())
+        import cli_use.admission as admission
+
+        self.admission = admission
+
+    def test_rate_limit_refills_over_time(self):
+        clock = FakeClock()
+        controller = self.admission.AdmissionController(4, rate=2, burst=3, clock=clock)
+        for _ in range(3):
+            controller.check("a")
+        with self.assertRaises(self.admission.AdmissionRejected) as rejected:
+            controller.check("a")
+        self.assertAlmostEqual(rejected.exception.retry_after, 0.5)
+        self.assertIn("retry after 0.5 seconds", str(rejected.exception))
+        # Other sessions have their own bucket
+        controller.check("b")
+
+        clock.now += 0.5
+        controller.check("a")
+        # A batch larger than the burst needs a full bucket
+        clock.now += 1.5
+        controller.check("a", cost=10)
+        self.assertEqual(controller.stats()["rate_limited"], 1)
+
+    def test_slots_are_shared_between_sessions_in_turn(self):
+        controller = self.admission.AdmissionController(1, max_queued_per_session=8)
+        order = []
+
+        async def command(session, release):
+            async with controller.slot(session):
+                order.append(session)
+                await release.wait()
+
+        async def scenario():
+            release = asyncio.Event()
+            release.set()
+            blocker = asyncio.Event()
+            first = asyncio.ensure_future(command("busy", blocker))
+            await asyncio.sleep(0)
+            # The busy session queues a backlog before the quiet one shows up
+            tasks = [asyncio.ensure_future(command("busy", release)) for _ in range(4)]
+            await asyncio.sleep(0)
+            tasks.append(asyncio.ensure_future(command("quiet", release)))
+            await asyncio.sleep(0)
+            self.assertEqual(controller.stats()["queued"], 5)
+            blocker.set()
+            await asyncio.gather(first, *tasks)
+
+        asyncio.run(scenario())
+        # The quiet session does not wait behind the busy one's backlog
+        self.assertEqual(order, ["busy", "quiet", "busy", "busy", "busy", "busy"])
+        stats = controller.stats()
+        self.assertEqual((stats["queued"], stats["running"], stats["admitted"]), (0, 0, 6))
+
+    def test_full_session_queue_is_rejected_and_cancelled_waits_free_it(self):
+        controller = self.admission.AdmissionController(1, max_queued_per_session=2)
+
+        async def hold(release, session="a"):
+            async with controller.slot(session):
+                await release.wait()
+
+        async def scenario():
+            release = asyncio.Event()
+            running = asyncio.ensure_future(hold(release))
+            await asyncio.sleep(0)
+            waiting = [asyncio.ensure_future(hold(release)) for _ in range(2)]
+            await asyncio.sleep(0)
+            with self.assertRaisesRegex(self.admission.AdmissionRejected, "already waiting"):
+                async with controller.slot("a"):
+                    pass
+            # Another session still gets a place in the queue
+            other = asyncio.ensure_future(hold(release, "b"))
+            waiting[0].cancel()
+            await asyncio.sleep(0)
+            self.assertEqual(controller.stats()["queued"], 2)
+            await asyncio.sleep(0.01)
+            release.set()
+            await asyncio.gather(running, waiting[1], other)
+
+        asyncio.run(scenario())
+        stats = controller.stats()
+        self.assertEqual(stats["queue_full"], 1)
+        self.assertEqual((stats["running"], stats["queued"]), (0, 0))
+        self.assertGreater(stats["wait_seconds_max"], 0)
+
+
+class TestRunCommandAdmission(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        os.environ["ALLOWED_DIR"] = self.tempdir.name
+        os.environ["TEST_MODE"] = "true"
+        os.environ["COMMAND_RATE_LIMIT"] = "0.01"
+        os.environ["COMMAND_BURST"] = "2"
+        import cli_use.server as server_module
+
+        self.server = importlib.reload(server_module)
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+        for name in ("TEST_MODE", "COMMAND_RATE_LIMIT", "COMMAND_BURST"):
+            os.environ.pop(name, None)
+
+    def test_flooding_session_is_rejected(self):
+        async def call(name, arguments):
+            return await self.server.handle_call_tool(name, arguments)
+
+        async def scenario():
+            first = await call("run_command", {"command": "pwd"})
+            second = await call("run_commands", {"commands": ["pwd"]})
+            third = await call("run_command", {"command": "pwd"})
+            return first, second, third
+
+        first, second, third = asyncio.run(scenario())
+        self.assertIn("return code: 0", first[-1].text)
+        self.assertIn('"status": "ok"', second[0].text)
+        self.assertTrue(third[0].text.startswith("Rejected: Rate limit"))
+        self.assertIn("retry after", third[0].text)
+        stats = self.server.executor.metrics()["admission"]
+        self.assertEqual((stats["admitted"], stats["rate_limited"]), (2, 1))
+
+
+if __name__ == "__main__":
+    unittest.main()
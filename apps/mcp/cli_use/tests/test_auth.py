@@ -0,0 +1,113 @@
+import os
+import time
+import asyncio
+import importlib
+import tempfile
+import unittest
+from unittest import mock
+
+from aiohttp import web
+
+
+class TestTelegramAuthValidator(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        os.environ["ALLOWED_DIR"] = self.tempdir.name
+        os.environ.pop("TELEGRAM_BOT_TOKEN", None)
+        os.environ.pop("CODER_AUTH_FALLBACK", None)
+
+        import cli_use.server as server_module
+
+        self.server = importlib.reload(server_module)
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def login(self, **fields):
+        login = {
+            "id": "42",
+            "first_name": "Ada",
+            "username": "ada",
+            "auth_date": str(int(time.time())),
+            "hash": "valid",
+        }
+        login.update(fields)
+        return login
+
+    def with_stub_service(self, scenario):
+        """Runs scenario(validator) against a local auth service, returning its result and the requests seen."""
+        requests = []
+
+        async def authenticate(request):
+            body = await request.json()
+            requests.append((body, request.transport.get_extra_info("peername")))
+            return web.json_response({"success": True, "user": {"id": "42", "first_name": "Ada"}})
+
+        async def run():
+            app = web.Application()
+            app.router.add_post("/api/telegram/auth", authenticate)
+            runner = web.AppRunner(app)
+            await runner.setup()
+            site = web.TCPSite(runner, "127.0.0.1", 0)
+            await site.start()
+            port = site._server.sockets[0].getsockname()[1]
+            validator = self.server.TelegramAuthValidator(
+                coder_auth_url=f"http://127.0.0.1:{port}/api/telegram/auth",
+                coder_auth_fallback=True,
+            )
+            await validator.start()
+            try:
+                return await scenario(validator)
+            finally:
+                await validator.close()
+                await runner.cleanup()
+
+        return asyncio.run(run()), requests
+
+    def test_verified_logins_are_cached(self):
+        login = self.login()
+
+        async def scenario(validator):
+            first = await validator.validate_auth_data(dict(login))
+            second = await validator.validate_auth_data(dict(login))
+            return first, second, validator.cache_hits
+
+        (first, second, hits), requests = self.with_stub_service(scenario)
+        self.assertEqual(first, second)
+        self.assertEqual(hits, 1)
+        self.assertEqual(len(requests), 1)
+
+    def test_changed_logins_are_verified_again_over_one_connection(self):
+        async def scenario(validator):
+            await validator.validate_auth_data(self.login())
+            # Same id, auth_date and hash, but a field the hash covers differs
+            await validator.validate_auth_data(self.login(username="eve"))
+            await validator.validate_auth_data(self.login(hash="other"))
+
+        _, requests = self.with_stub_service(scenario)
+        self.assertEqual(len(requests), 3)
+        self.assertEqual(len({peer for _, peer in requests}), 1)
+
+    def test_cached_logins_expire_with_their_auth_date(self):
+        login = self.login(auth_date=str(int(time.time()) - self.server.AUTH_MAX_AGE + 60))
+
+        async def scenario(validator):
+            await validator.validate_auth_data(dict(login))
+            later = time.time() + 120
+            with mock.patch.object(self.server.time, "time", lambda: later):
+                with self.assertRaisesRegex(self.server.TelegramAuthError, "expired"):
+                    await validator.validate_auth_data(dict(login))
+                self.assertIsNone(validator._cached_user(dict(login)))
+
+        _, requests = self.with_stub_service(scenario)
+        self.assertEqual(len(requests), 1)
+
+    def test_logins_without_bot_token_are_refused_by_default(self):
+        validator = self.server.TelegramAuthValidator()
+        self.assertFalse(validator.coder_auth_fallback)
+        with self.assertRaisesRegex(self.server.TelegramAuthError, "Bot token not configured"):
+            asyncio.run(validator.validate_auth_data(self.login()))
+
+
+if __name__ == "__main__":
+    unittest.main()
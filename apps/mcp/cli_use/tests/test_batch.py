@@ -0,0 +1,79 @@
+import os
+import json
+import importlib
+import asyncio
+import tempfile
+import time
+import unittest
+
+
+class TestRunCommands(unittest.TestCase):
+    def setUp(self):
+        os.environ["TEST_MODE"] = "true"
+        self.tempdir = tempfile.TemporaryDirectory()
+        os.environ["ALLOWED_DIR"] = self.tempdir.name
+        os.environ["ALLOWED_COMMANDS"] = "all"
+        os.environ["ALLOWED_FLAGS"] = "all"
+
+        import cli_use.server as server_module
+
+        self.server = importlib.reload(server_module)
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+        for name in ("TEST_MODE", "ALLOWED_COMMANDS", "ALLOWED_FLAGS"):
+            os.environ.pop(name, None)
+
+    def run_commands(self, commands):
+        result = asyncio.run(self.server.handle_call_tool("run_commands", {"commands": commands}))
+        return result[0]
+
+    def test_independent_commands_run_in_parallel(self):
+        started = time.monotonic()
+        content = self.run_commands(["sleep 0.5"] * 4 + ["echo done"])
+        elapsed = time.monotonic() - started
+
+        results = json.loads(content.text)
+        self.assertEqual([result["status"] for result in results], ["ok"] * 5)
+        self.assertEqual(results[4]["stdout"], "done\n")
+        self.assertEqual(results[4]["id"], "4")
+        self.assertLess(elapsed, 1.5, f"Commands did not overlap, took {elapsed:.2f}s")
+
+    def test_dependencies_run_in_order(self):
+        content = self.run_commands(
+            [
+                {"id": "list", "command": "ls build", "depends_on": ["make"]},
+                {"id": "make", "command": "mkdir build"},
+                {"id": "after", "command": "ls missing"},
+                {"id": "skipped", "command": "echo never", "depends_on": ["after"]},
+            ]
+        )
+        results = {result["id"]: result for result in json.loads(content.text)}
+        self.assertEqual(results["make"]["status"], "ok")
+        self.assertEqual(results["list"]["status"], "ok")
+        self.assertEqual(results["after"]["status"], "failed")
+        self.assertNotEqual(results["after"]["returncode"], 0)
+        self.assertEqual(results["skipped"]["status"], "skipped")
+        self.assertNotIn("stdout", results["skipped"])
+
+    def test_invalid_command_rejects_whole_batch(self):
+        content = self.run_commands(["mkdir created", "ls ../.."])
+        self.assertTrue(content.error)
+        self.assertIn("1: ", content.text)
+        self.assertFalse(os.path.exists(os.path.join(self.tempdir.name, "created")))
+
+    def test_malformed_batches_are_rejected(self):
+        cycle = self.run_commands(
+            [
+                {"id": "a", "command": "pwd", "depends_on": ["b"]},
+                {"id": "b", "command": "pwd", "depends_on": ["a"]},
+            ]
+        )
+        self.assertIn("cycle", cycle.text)
+        unknown = self.run_commands([{"command": "pwd", "depends_on": ["nope"]}])
+        self.assertIn("unknown id 'nope'", unknown.text)
+        self.assertIn("non-empty", self.run_commands([]).text)
+
+
+if __name__ == "__main__":
+    unittest.main()
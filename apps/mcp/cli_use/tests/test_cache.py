@@ -0,0 +1,131 @@
+import os
+import importlib
+import asyncio
+import tempfile
+import unittest
+
+
+class TestResultCache(unittest.TestCase):
+    def setUp(self):
+        os.environ["TEST_MODE"] = "true"
+        self.tempdir = tempfile.TemporaryDirectory()
+        os.environ["ALLOWED_DIR"] = self.tempdir.name
+        os.environ["ALLOWED_COMMANDS"] = "all"
+        os.environ["ALLOWED_FLAGS"] = "all"
+        os.environ["CACHEABLE_COMMANDS"] = "ls,cat,pwd"
+        with open(os.path.join(self.tempdir.name, "notes.txt"), "w") as f:
+            f.write("first\n")
+
+        import cli_use.server as server_module
+
+        self.server = importlib.reload(server_module)
+        self.executor = self.server.executor
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+        for name in (
+            "TEST_MODE",
+            "ALLOWED_COMMANDS",
+            "ALLOWED_FLAGS",
+            "CACHEABLE_COMMANDS",
+            "RESULT_CACHE_BYTES",
+        ):
+            os.environ.pop(name, None)
+
+    def run_with_executor(self, coro_factory):
+        async def run():
+            await self.executor.start()
+            try:
+                return await coro_factory()
+            finally:
+                await self.executor.close()
+
+        return asyncio.run(run())
+
+    async def settle(self):
+        # Give the event loop a chance to read pending inotify events
+        await asyncio.sleep(0.1)
+
+    def test_repeated_command_is_served_from_cache(self):
+        async def scenario():
+            first = await self.executor.execute_async("cat notes.txt")
+            second = await self.executor.execute_async("cat notes.txt")
+            return first, second, self.executor.metrics()["result_cache"]
+
+        first, second, stats = self.run_with_executor(scenario)
+        self.assertEqual(first.stdout, "first\n")
+        self.assertEqual(second.stdout, "first\n")
+        self.assertEqual(stats["hits"], 1)
+        self.assertEqual(stats["misses"], 1)
+
+    def test_change_below_directory_invalidates_listing(self):
+        path = os.path.join(self.tempdir.name, "notes.txt")
+
+        async def scenario():
+            before = await self.executor.execute_async("ls -l")
+            # Appending leaves the directory's own mtime untouched
+            with open(path, "a") as f:
+                f.write("more text\n")
+            await self.settle()
+            after = await self.executor.execute_async("ls -l")
+            return before, after, self.executor.metrics()["result_cache"]
+
+        before, after, stats = self.run_with_executor(scenario)
+        self.assertNotEqual(before.stdout, after.stdout)
+        self.assertEqual(stats["hits"], 0)
+        self.assertEqual(stats["invalidations"], 1)
+
+    def test_new_file_in_new_directory_is_noticed(self):
+        async def scenario():
+            os.mkdir(os.path.join(self.tempdir.name, "sub"))
+            await self.settle()
+            await self.executor.execute_async("ls sub")
+            with open(os.path.join(self.tempdir.name, "sub", "new.txt"), "w") as f:
+                f.write("x")
+            await self.settle()
+            return await self.executor.execute_async("ls sub")
+
+        result = self.run_with_executor(scenario)
+        self.assertEqual(result.stdout, "new.txt\n")
+
+    def test_only_configured_commands_are_cached(self):
+        async def scenario():
+            for _ in range(2):
+                await self.executor.execute_async("echo hello")
+            return self.executor.metrics()["result_cache"]
+
+        stats = self.run_with_executor(scenario)
+        self.assertEqual(stats["hits"], 0)
+        self.assertEqual(stats["entries"], 0)
+
+    def test_memory_budget_evicts_least_recently_used(self):
+        os.environ["RESULT_CACHE_BYTES"] = "600"
+        self.server = importlib.reload(self.server)
+        self.executor = self.server.executor
+        for name in ("a", "b", "c"):
+            with open(os.path.join(self.tempdir.name, name), "w") as f:
+                f.write(name * 100)
+
+        async def scenario():
+            for name in ("a", "b", "c"):
+                await self.executor.execute_async(f"cat {name}")
+            return self.executor.metrics()["result_cache"]
+
+        stats = self.run_with_executor(scenario)
+        self.assertEqual(stats["entries"], 1)
+        self.assertEqual(stats["evictions"], 2)
+        self.assertLessEqual(stats["bytes"], 600)
+
+    def test_cache_is_inactive_until_started(self):
+        async def scenario():
+            await self.executor.execute_async("pwd")
+            await self.executor.execute_async("pwd")
+            return self.executor.metrics()["result_cache"]
+
+        stats = asyncio.run(scenario())
+        self.assertFalse(stats["enabled"])
+        self.assertEqual(stats["hits"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,138 @@
+import os
+import time
+import asyncio
+import importlib
+import tempfile
+import unittest
+
+import anyio
+import mcp.types as types
+from mcp.client.session import ClientSession
+from mcp.shared.memory import create_client_server_memory_streams
+
+
+class TestCallCancellation(unittest.TestCase):
+    def setUp(self):
+        os.environ["TEST_MODE"] = "true"
+        self.tempdir = tempfile.TemporaryDirectory()
+        os.environ["ALLOWED_DIR"] = self.tempdir.name
+        os.environ["ALLOWED_COMMANDS"] = "all"
+        os.environ["ALLOWED_FLAGS"] = "all"
+        os.environ["ALLOW_SHELL_OPERATORS"] = "true"
+        os.environ["MAX_CONCURRENT_COMMANDS"] = "1"
+        self.reload()
+
+    def reload(self):
+        import cli_use.server as server_module
+
+        self.server = importlib.reload(server_module)
+        self.executor = self.server.executor
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+        for name in (
+            "TEST_MODE",
+            "ALLOWED_COMMANDS",
+            "ALLOWED_FLAGS",
+            "ALLOW_SHELL_OPERATORS",
+            "MAX_CONCURRENT_COMMANDS",
+            "SHELL_POOL_SIZE",
+        ):
+            os.environ.pop(name, None)
+
+    def process_gone(self, pid):
+        try:
+            with open(f"/proc/{pid}/stat") as stat:
+                return stat.read().rsplit(")", 1)[1].split()[0] == "Z"
+        except FileNotFoundError:
+            return True
+
+    def cancel_and_rerun(self, command):
+        """
+        Starts command over an MCP connection, cancels it and runs another one.
+
+        Returns the cancelled call's result, the seconds the next call took and
+        its output.
+        """
+        from cli_use.cancellation import serve
+
+        async def scenario():
+            await self.executor.start()
+            try:
+                async with create_client_server_memory_streams() as (client_streams, server_streams):
+                    async with anyio.create_task_group() as tg:
+                        tg.start_soon(
+                            serve,
+                            self.server.server,
+                            server_streams[0],
+                            server_streams[1],
+                            self.server.server.create_initialization_options(),
+                        )
+                        async with ClientSession(*client_streams) as client:
+                            await client.initialize()
+                            outcome = await self.cancel_with(client, command)
+                        tg.cancel_scope.cancel()
+                return outcome
+            finally:
+                await self.executor.close()
+
+        return asyncio.run(scenario())
+
+    async def cancel_with(self, client, command):
+        cancelled = asyncio.ensure_future(client.call_tool("run_command", {"command": command}))
+        await asyncio.sleep(0.5)
+        await client.send_notification(
+            types.ClientNotification(
+                types.CancelledNotification(
+                    method="notifications/cancelled",
+                    params=types.CancelledNotificationParams(requestId=client._request_id - 1),
+                )
+            )
+        )
+        result = await asyncio.wait_for(cancelled, 5)
+
+        started = time.monotonic()
+        # The only execution slot must be free again
+        after = await asyncio.wait_for(client.call_tool("run_command", {"command": "echo next"}), 5)
+        return result, time.monotonic() - started, after.content[0].text
+
+    def test_cancelled_command_is_stopped(self):
+        with open(os.path.join(self.tempdir.name, "script.sh"), "w") as script:
+            script.write("sleep 30 &\necho $! > child.pid\nsleep 30\n")
+
+        result, elapsed, output = self.cancel_and_rerun("sh script.sh")
+        self.assertEqual(result.content[0].text, "Command cancelled")
+        self.assertEqual(output, "next\n")
+        self.assertLess(elapsed, 2)
+        self.assertEqual(self.executor.metrics()["commands"]["cancelled"], 1)
+
+        with open(os.path.join(self.tempdir.name, "child.pid")) as pid_file:
+            pid = int(pid_file.read())
+        deadline = time.monotonic() + 2
+        while not self.process_gone(pid) and time.monotonic() < deadline:
+            time.sleep(0.05)
+        self.assertTrue(self.process_gone(pid))
+
+    def test_cancelled_shell_pool_command_frees_worker(self):
+        os.environ["SHELL_POOL_SIZE"] = "1"
+        self.reload()
+
+        result, elapsed, output = self.cancel_and_rerun("true && sleep 30")
+        self.assertEqual(result.content[0].text, "Command cancelled")
+        self.assertEqual(output, "next\n")
+        self.assertLess(elapsed, 2)
+
+    def test_unknown_request_ids_are_ignored(self):
+        from cli_use.cancellation import InFlightCalls
+
+        async def scenario():
+            calls = InFlightCalls()
+            work = calls.run(1, asyncio.sleep(0.1, result="done"))
+            self.assertFalse(calls.cancel(2))
+            return await work
+
+        self.assertEqual(asyncio.run(scenario()), "done")
+
+
+if __name__ == "__main__":
+    unittest.main()
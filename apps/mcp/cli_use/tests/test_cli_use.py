@@ -2,7 +2,10 @@ import os
 import importlib
 import asyncio
 import shutil
+import subprocess
+import sys
 import tempfile
+import time
 import unittest
 
 
@@ -31,6 +34,7 @@ class TestCLIMCPServer(unittest.TestCase):
         os.environ.pop("ALLOWED_FLAGS", None)
         # Ensure shell operators are disabled by default
         os.environ.pop("ALLOW_SHELL_OPERATORS", None)
+        os.environ.pop("MAX_CONCURRENT_COMMANDS", None)
         
         # Reload server module to pick up env changes
         try:
@@ -240,6 +244,161 @@ class TestCLIMCPServer(unittest.TestCase):
         self.assertEqual(texts[0].strip(), "OR_OK", f"Unexpected OR output: {texts[0]!r}")
         self.assertTrue(any("return code: 0" in text for text in texts))
 
+    def test_commands_run_concurrently(self):
+        # Allow all commands so sleep can be used
+        os.environ["ALLOWED_COMMANDS"] = "all"
+        os.environ["TEST_MODE"] = "true"
+        import cli_use.server as server_module
+
+        server = importlib.reload(server_module)
+
+        async def run_many():
+            return await asyncio.gather(
+                *(
+                    server.handle_call_tool("run_command", {"command": "sleep 0.5"})
+                    for _ in range(4)
+                )
+            )
+
+        started = time.monotonic()
+        results = asyncio.run(run_many())
+        elapsed = time.monotonic() - started
+        for result in results:
+            self.assertTrue(any("return code: 0" in tc.text for tc in result))
+        # Four half-second sleeps must overlap instead of running back to back
+        self.assertLess(elapsed, 1.5, f"Commands did not overlap, took {elapsed:.2f}s")
+
+    def test_concurrency_limit_serializes_commands(self):
+        os.environ["ALLOWED_COMMANDS"] = "all"
+        os.environ["MAX_CONCURRENT_COMMANDS"] = "1"
+        os.environ["TEST_MODE"] = "true"
+        import cli_use.server as server_module
+
+        server = importlib.reload(server_module)
+
+        async def run_many():
+            return await asyncio.gather(
+                *(server.executor.execute_async("sleep 0.3") for _ in range(3))
+            )
+
+        started = time.monotonic()
+        asyncio.run(run_many())
+        elapsed = time.monotonic() - started
+        self.assertGreaterEqual(elapsed, 0.85, f"Limit of 1 was not enforced, took {elapsed:.2f}s")
+
+    def test_output_is_streamed_before_command_exits(self):
+        os.environ["ALLOW_SHELL_OPERATORS"] = "true"
+        os.environ["ALLOWED_COMMANDS"] = "all"
+        os.environ["ALLOWED_FLAGS"] = "all"
+        os.environ["TEST_MODE"] = "true"
+        import cli_use.server as server_module
+
+        server = importlib.reload(server_module)
+        chunks = []
+
+        async def on_output(stream, text):
+            chunks.append((stream, text, time.monotonic()))
+
+        async def run():
+            result = await server.executor.execute_async(
+                "echo first; sleep 0.5; echo second", on_output=on_output
+            )
+            return result, time.monotonic()
+
+        result, finished = asyncio.run(run())
+        self.assertEqual(result.stdout, "first\nsecond\n")
+        self.assertEqual(chunks[0][:2], ("stdout", "first\n"))
+        # The first chunk must arrive long before the command finishes
+        self.assertLess(chunks[0][2], finished - 0.3)
+
+    def test_output_streamer_sends_log_and_progress_notifications(self):
+        sent = []
+
+        class FakeSession:
+            async def send_log_message(self, level, data, logger=None):
+                sent.append(("log", level, data))
+
+            async def send_notification(self, notification):
+                sent.append(("progress", notification.root.params))
+
+        streamer = self.server.OutputStreamer(FakeSession(), progress_token="tok")
+        asyncio.run(streamer("stdout", "héllo"))
+        self.assertEqual(sent[0], ("log", "info", {"stream": "stdout", "text": "héllo"}))
+        params = sent[1][1]
+        self.assertEqual(params.progressToken, "tok")
+        self.assertEqual(params.progress, len("héllo".encode()))
+        self.assertEqual(params.message, "héllo")
+
+    def test_pty_command_output_and_return_code(self):
+        os.environ["ALLOWED_COMMANDS"] = "all"
+        os.environ["ALLOWED_FLAGS"] = "all"
+        os.environ["TEST_MODE"] = "true"
+        import cli_use.server as server_module
+
+        server = importlib.reload(server_module)
+        chunks = []
+
+        async def on_output(stream, text):
+            chunks.append(text)
+
+        # Commands mentioning claude run on a PTY
+        result = asyncio.run(
+            server.executor.execute_async("echo claude-ñ-✓", on_output=on_output)
+        )
+        self.assertEqual(result.stdout.strip(), "claude-ñ-✓")
+        self.assertEqual("".join(chunks).strip(), "claude-ñ-✓")
+        self.assertEqual(result.returncode, 0)
+
+        result = asyncio.run(server.executor.execute_async("sh -c 'exit 3' claude"))
+        self.assertEqual(result.returncode, 3)
+
+    def test_sync_pty_command_returns_completed_process(self):
+        os.environ["ALLOWED_COMMANDS"] = "all"
+        os.environ["ALLOWED_FLAGS"] = "all"
+        os.environ["TEST_MODE"] = "true"
+        import cli_use.server as server_module
+
+        server = importlib.reload(server_module)
+
+        async def from_running_loop():
+            return server.executor.execute("echo claude")
+
+        for result in (server.executor.execute("echo claude"), asyncio.run(from_running_loop())):
+            self.assertIsInstance(result, subprocess.CompletedProcess)
+            self.assertEqual((result.returncode, result.stdout.strip()), (0, "claude"))
+
+    def test_pipeline_stages_are_wired_without_shell(self):
+        os.environ["ALLOW_SHELL_OPERATORS"] = "true"
+        os.environ["ALLOWED_COMMANDS"] = "all"
+        os.environ["ALLOWED_FLAGS"] = "all"
+        os.environ["TEST_MODE"] = "true"
+        import cli_use.server as server_module
+
+        server = importlib.reload(server_module)
+        # Directly spawned stages are children of the server itself
+        result = asyncio.run(
+            server.executor.execute_async(
+                f"{sys.executable} -c 'print(__import__(\"os\").getppid())' | cat"
+            )
+        )
+        self.assertEqual(result.stdout.strip(), str(os.getpid()))
+
+        # Like a shell pipeline, the last stage decides the return code
+        result = asyncio.run(server.executor.execute_async("sh -c 'exit 3' | cat"))
+        self.assertEqual(result.returncode, 0)
+        result = asyncio.run(server.executor.execute_async("echo x | sh -c 'exit 3'"))
+        self.assertEqual(result.returncode, 3)
+
+    def test_shell_builtin_falls_back_to_shell(self):
+        os.environ["ALLOWED_COMMANDS"] = "all"
+        os.environ["TEST_MODE"] = "true"
+        import cli_use.server as server_module
+
+        server = importlib.reload(server_module)
+        # 'type' only exists as a shell builtin
+        result = asyncio.run(server.executor.execute_async("type cd"))
+        self.assertEqual(result.returncode, 0, result.stderr)
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,102 @@
+import os
+import time
+import hmac
+import asyncio
+import hashlib
+import importlib
+import tempfile
+import unittest
+from contextlib import AsyncExitStack
+
+import anyio
+from mcp.client.session import ClientSession
+from mcp.shared.memory import create_client_server_memory_streams
+
+BOT_TOKEN = "123:test-token"
+
+
+def signed_login(user_id, first_name):
+    login = {"id": user_id, "first_name": first_name, "auth_date": str(int(time.time()))}
+    data_check_string = "\n".join(f"{k}={v}" for k, v in sorted(login.items()))
+    secret_key = hashlib.sha256(BOT_TOKEN.encode()).digest()
+    login["hash"] = hmac.new(secret_key, data_check_string.encode(), hashlib.sha256).hexdigest()
+    return login
+
+
+class TestConnectionSessions(unittest.TestCase):
+    def setUp(self):
+        os.environ.pop("TEST_MODE", None)
+        self.tempdir = tempfile.TemporaryDirectory()
+        os.environ["ALLOWED_DIR"] = self.tempdir.name
+        os.environ["TELEGRAM_BOT_TOKEN"] = BOT_TOKEN
+
+        import cli_use.server as server_module
+
+        self.server = importlib.reload(server_module)
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+        os.environ.pop("TELEGRAM_BOT_TOKEN", None)
+
+    def with_clients(self, count, scenario):
+        """Serves count concurrent connections and runs scenario with their client sessions."""
+        from cli_use.cancellation import serve
+
+        async def run():
+            async with AsyncExitStack() as stack:
+                tg = await stack.enter_async_context(anyio.create_task_group())
+                clients = []
+                for _ in range(count):
+                    client_streams, server_streams = await stack.enter_async_context(
+                        create_client_server_memory_streams()
+                    )
+                    tg.start_soon(
+                        serve,
+                        self.server.server,
+                        server_streams[0],
+                        server_streams[1],
+                        self.server.server.create_initialization_options(),
+                    )
+                    client = await stack.enter_async_context(ClientSession(*client_streams))
+                    await client.initialize()
+                    clients.append(client)
+                try:
+                    return await scenario(*clients)
+                finally:
+                    tg.cancel_scope.cancel()
+
+        return asyncio.run(run())
+
+    def test_sessions_are_bound_to_their_connection(self):
+        async def tool_names(client):
+            return {tool.name for tool in (await client.list_tools()).tools}
+
+        async def scenario(alice, bob, anonymous):
+            await alice.call_tool("telegram_auth", signed_login("1", "Alice"))
+            await bob.call_tool("telegram_auth", signed_login("2", "Bob"))
+            rules = await asyncio.gather(
+                alice.call_tool("show_security_rules", {}),
+                bob.call_tool("show_security_rules", {}),
+                anonymous.call_tool("show_security_rules", {}),
+            )
+            names = [await tool_names(client) for client in (alice, bob, anonymous)]
+            await bob.call_tool("telegram_logout", {})
+            after_logout = [await tool_names(client) for client in (alice, bob)]
+            return [result.content[0].text for result in rules], names, after_logout
+
+        rules, names, after_logout = self.with_clients(3, scenario)
+
+        alice_id = self.server.SessionManager.create_session_id(signed_login("1", "Alice"))
+        bob_id = self.server.SessionManager.create_session_id(signed_login("2", "Bob"))
+        self.assertIn(f"Session ID: {alice_id}", rules[0])
+        self.assertIn(f"Session ID: {bob_id}", rules[1])
+        self.assertIn("Authentication required", rules[2])
+        self.assertIn("run_command", names[0])
+        self.assertIn("run_command", names[1])
+        self.assertEqual(names[2], {"telegram_auth"})
+        self.assertIn("run_command", after_logout[0])
+        self.assertEqual(after_logout[1], {"telegram_auth"})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,129 @@
+import os
+import re
+import importlib
+import asyncio
+import tempfile
+import time
+import unittest
+
+
+class TestBackgroundJobs(unittest.TestCase):
+    def setUp(self):
+        os.environ["TEST_MODE"] = "true"
+        self.tempdir = tempfile.TemporaryDirectory()
+        os.environ["ALLOWED_DIR"] = self.tempdir.name
+        os.environ["ALLOWED_COMMANDS"] = "all"
+        os.environ["ALLOWED_FLAGS"] = "all"
+        os.environ["ALLOW_SHELL_OPERATORS"] = "true"
+        os.environ["COMMAND_TIMEOUT"] = "1"
+        os.environ["MAX_JOBS_PER_SESSION"] = "2"
+        os.environ["MAX_FINISHED_JOBS_PER_SESSION"] = "2"
+
+        import cli_use.server as server_module
+
+        self.server = importlib.reload(server_module)
+        self.executor = self.server.executor
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+        for name in (
+            "TEST_MODE",
+            "ALLOWED_COMMANDS",
+            "ALLOWED_FLAGS",
+            "ALLOW_SHELL_OPERATORS",
+            "COMMAND_TIMEOUT",
+            "MAX_JOBS_PER_SESSION",
+            "MAX_FINISHED_JOBS_PER_SESSION",
+        ):
+            os.environ.pop(name, None)
+
+    def run_with_executor(self, coro_factory):
+        async def run():
+            await self.executor.start()
+            try:
+                return await coro_factory()
+            finally:
+                await self.executor.close()
+
+        return asyncio.run(run())
+
+    async def call(self, name, arguments):
+        result = await self.server.handle_call_tool(name, arguments)
+        return "\n".join(tc.text for tc in result)
+
+    async def wait_for_job(self, job):
+        while job.running:
+            await asyncio.sleep(0.05)
+
+    def test_detached_job_outlives_command_timeout(self):
+        async def scenario():
+            started = time.monotonic()
+            text = await self.call(
+                "run_command", {"command": "echo begin && sleep 1.5 && echo end", "detach": True}
+            )
+            elapsed = time.monotonic() - started
+            job_id = re.search(r"job ([0-9a-f]+)", text).group(1)
+
+            await asyncio.sleep(0.3)
+            partial = await self.call("job_output", {"job_id": job_id})
+            await self.wait_for_job(self.executor.jobs.get("local", job_id))
+            offset = int(re.search(r"next_offset: (\d+)", partial).group(1))
+            rest = await self.call("job_output", {"job_id": job_id, "offset": offset})
+            status = await self.call("job_status", {"job_id": job_id})
+            return elapsed, partial, rest, status
+
+        elapsed, partial, rest, status = self.run_with_executor(scenario)
+        self.assertLess(elapsed, 0.5)
+        self.assertIn("begin", partial)
+        self.assertIn("job running", partial)
+        self.assertTrue(rest.startswith("end\n"))
+        self.assertIn("finished (return code 0)", status)
+
+    def test_cancel_kills_job(self):
+        async def scenario():
+            job = self.executor.jobs.start("local", "sleep 30")
+            await asyncio.sleep(0.2)
+            text = await self.call("job_cancel", {"job_id": job.job_id})
+            return job, text
+
+        job, text = self.run_with_executor(scenario)
+        self.assertEqual(job.status, "cancelled")
+        self.assertIn("cancelled", text)
+        self.assertLess(job.runtime, 5)
+
+    def test_per_session_quota_and_visibility(self):
+        async def scenario():
+            self.executor.jobs.start("local", "sleep 5")
+            self.executor.jobs.start("local", "sleep 5")
+            refused = await self.call("run_command", {"command": "sleep 5", "detach": True})
+            other = self.executor.jobs.start("other-session", "sleep 5")
+            hidden = await self.call("job_status", {"job_id": other.job_id})
+            return refused, hidden
+
+        refused, hidden = self.run_with_executor(scenario)
+        self.assertIn("Job limit reached", refused)
+        self.assertIn("Unknown job id", hidden)
+
+    def test_finished_jobs_are_evicted(self):
+        async def scenario():
+            jobs = []
+            for index in range(3):
+                job = self.executor.jobs.start("local", f"echo {index}")
+                await self.wait_for_job(job)
+                jobs.append(job)
+            return jobs, [job.job_id for job in self.executor.jobs.list("local")]
+
+        jobs, remaining = self.run_with_executor(scenario)
+        self.assertEqual(remaining, [jobs[1].job_id, jobs[2].job_id])
+
+    def test_invalid_command_is_rejected_up_front(self):
+        async def scenario():
+            return await self.call("run_command", {"command": "ls ../..", "detach": True})
+
+        text = self.run_with_executor(scenario)
+        self.assertIn("Security violation", text)
+        self.assertEqual(self.executor.jobs.list("local"), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
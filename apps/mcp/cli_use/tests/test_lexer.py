@@ -0,0 +1,199 @@
+import os
+import asyncio
+import importlib
+import tempfile
+import unittest
+
+WORD, OPERATOR, REDIRECT, HEREDOC = "word", "operator", "redirect", "heredoc"
+
+
+class TestLexer(unittest.TestCase):
+    def setUp(self):
+        # Importing the package loads the server, which needs an ALLOWED_DIR
+        os.environ.setdefault("ALLOWED_DIR", tempfile.gettempdir())
+        from cli_use import lexer
+
+        self.lexer = lexer
+
+    def tokenize(self, command_string):
+        return self.lexer.tokenize(command_string)
+
+    def kinds_and_values(self, command_string):
+        return [(token.kind, token.value) for token in self.tokenize(command_string)]
+
+    def test_quotes_and_escapes(self):
+        self.assertEqual(
+            self.kinds_and_values(r"""echo "a|b" 'c && d' e\;f "" g"h"'i'"""),
+            [
+                (WORD, "echo"),
+                (WORD, "a|b"),
+                (WORD, "c && d"),
+                (WORD, "e;f"),
+                (WORD, ""),
+                (WORD, "ghi"),
+            ],
+        )
+        self.assertEqual(
+            self.kinds_and_values('echo "say \\"hi\\" \\n"'),
+            [(WORD, "echo"), (WORD, 'say "hi" \\n')],
+        )
+
+    def test_operators_and_redirections(self):
+        self.assertEqual(
+            self.kinds_and_values("make 2>&1 >>log.txt|tail -n 5&& ls &"),
+            [
+                (WORD, "make"),
+                (REDIRECT, ">&"),
+                (WORD, "1"),
+                (REDIRECT, ">>"),
+                (WORD, "log.txt"),
+                (OPERATOR, "|"),
+                (WORD, "tail"),
+                (WORD, "-n"),
+                (WORD, "5"),
+                (OPERATOR, "&&"),
+                (WORD, "ls"),
+                (OPERATOR, "&"),
+            ],
+        )
+        self.assertEqual(
+            self.kinds_and_values("ls # not; a command\npwd"),
+            [(WORD, "ls"), (OPERATOR, "\n"), (WORD, "pwd")],
+        )
+
+    def test_expansions_are_flagged(self):
+        tokens = self.tokenize("""echo $HOME "${x}" ~/a '$y' $$ $? `id` "$(id)" <(ls)""")
+        self.assertEqual(
+            [(token.expands, token.substitution) for token in tokens],
+            [
+                (False, False),
+                (True, False),
+                (True, False),
+                (True, False),
+                (False, False),
+                (False, False),
+                (False, False),
+                (False, True),
+                (False, True),
+                (False, True),
+            ],
+        )
+
+    def test_unquoted_glob_patterns_are_flagged(self):
+        tokens = self.tokenize(r"""ls *.txt '*.txt' "a?" \[b] file[12] x=y""")
+        self.assertEqual(
+            [token.glob for token in tokens], [False, True, False, False, False, True, False]
+        )
+
+    def test_brace_and_parenthesis_are_shell_syntax(self):
+        tokens = self.tokenize("ls {a,b} '{a}' *(e:x:) \\(")
+        self.assertEqual([token.shell_syntax for token in tokens], [False, True, False, True, False])
+
+    def test_heredoc_body_is_one_token(self):
+        tokens = self.tokenize("cat <<EOF > out.txt\nrm -rf x\nEOF\nls")
+        self.assertEqual(
+            [(token.kind, token.value) for token in tokens],
+            [
+                (WORD, "cat"),
+                (REDIRECT, "<<"),
+                (WORD, "EOF"),
+                (REDIRECT, ">"),
+                (WORD, "out.txt"),
+                (OPERATOR, "\n"),
+                (HEREDOC, "rm -rf x\nEOF\n"),
+                (WORD, "ls"),
+            ],
+        )
+
+    def test_unterminated_quotes_are_errors(self):
+        for command in ('echo "abc', "echo 'abc", "echo abc\\"):
+            with self.assertRaises(self.lexer.LexError):
+                self.tokenize(command)
+
+
+class TestOperatorValidation(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        os.environ["ALLOWED_DIR"] = self.tempdir.name
+        os.environ["ALLOWED_COMMANDS"] = "ls,cat,echo,grep"
+        os.environ["ALLOWED_FLAGS"] = "-l"
+        os.environ["ALLOW_SHELL_OPERATORS"] = "true"
+
+        import cli_use.server as server_module
+
+        self.server = importlib.reload(server_module)
+        self.executor = self.server.executor
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+        for name in ("ALLOWED_COMMANDS", "ALLOWED_FLAGS", "ALLOW_SHELL_OPERATORS"):
+            os.environ.pop(name, None)
+
+    def assertRejected(self, command, message):
+        with self.assertRaisesRegex(self.server.CommandSecurityError, message):
+            self.executor.validate_command(command)
+
+    def test_quoted_operators_are_arguments(self):
+        self.assertEqual(self.executor.validate_command('echo "a|b; c"'), ("echo", ["a|b; c"]))
+        validated = self.executor._validate("echo 'a>b' | grep a")
+        self.assertTrue(validated.shell)
+        self.assertEqual(validated.stages, [["echo", "a>b"], ["grep", "a"]])
+
+    def test_every_simple_command_is_validated(self):
+        self.assertRejected("ls & rm x", "Invalid command part 'rm x'")
+        self.assertRejected("ls\nrm x", "Invalid command part 'rm x'")
+        self.assertRejected("echo `rm x` | cat", "Command substitution")
+        self.assertRejected("cat $HOME/secret | grep a", "expansion")
+        self.assertRejected("cat ~/secret | grep a", "expansion")
+
+    def test_redirection_targets_are_paths(self):
+        self.assertEqual(self.executor.validate_command("ls > out.txt 2>&1"), ("ls > out.txt 2>&1", []))
+        self.assertRejected("echo hi > /etc/passwd", "outside of allowed directory")
+        self.assertRejected("cat < ../secret", "outside of allowed directory")
+
+        os.environ["ALLOW_SHELL_OPERATORS"] = "false"
+        self.server = importlib.reload(self.server)
+        self.executor = self.server.executor
+        self.assertRejected("echo a 2> err", "Shell operator '>' is not supported")
+        self.assertEqual(self.executor.validate_command("echo 'a > b'"), ("echo", ["a > b"]))
+
+    def test_glob_patterns_are_expanded_without_a_shell(self):
+        for name in ("a.txt", "b.txt", "c.log", "-rf"):
+            with open(os.path.join(self.tempdir.name, name), "w") as f:
+                f.write(name)
+        os.symlink("/etc/hostname", os.path.join(self.tempdir.name, "z.link"))
+        self.assertEqual(self.executor.validate_command("ls '*.txt'"), ("ls", ["*.txt"]))
+        self.assertEqual(self.executor.validate_command("ls *.txt"), ("ls", ["a.txt", "b.txt"]))
+        self.assertEqual(self.executor.validate_command("cat ?.log x*"), ("cat", ["c.log", "x*"]))
+        self.assertRejected("cat -*", "Flag")
+        self.assertEqual(self.executor.validate_command("cat *rf"), ("cat", ["./-rf"]))
+        validated = self.executor._validate("ls *.txt | cat")
+        self.assertEqual(validated.stages, [["ls", "a.txt", "b.txt"], ["cat"]])
+        self.assertRejected("ls ../*", "outside of allowed directory")
+        self.assertRejected("ls /*", "outside of allowed directory")
+        self.assertRejected("cat *.link", "outside of allowed directory")
+
+        result = asyncio.run(self.executor.execute_async("ls *.txt | cat"))
+        self.assertEqual(result.stdout.split(), ["a.txt", "b.txt"])
+        self.assertEqual(asyncio.run(self.executor.execute_async("cat ?.log")).stdout, "c.log")
+
+    def test_shell_only_syntax_is_refused(self):
+        self.assertRejected("cat {/etc/hostname,*} | cat", "Brace expansion")
+        self.assertRejected("ls *(e:true:) | cat", "glob qualifiers")
+        self.assertRejected("ls .* && pwd", "could match '..'")
+        self.assertRejected("ls *.txt > out.txt && cat ../*", "outside of allowed directory")
+
+        # Without operators nothing reaches a shell, so braces stay literal
+        os.environ["ALLOW_SHELL_OPERATORS"] = "false"
+        self.server = importlib.reload(self.server)
+        self.executor = self.server.executor
+        self.assertRejected("ls *.txt | cat", "Shell operator '|' is not supported")
+        for command in ("cat {/etc/hostname,*}", "ls {/,*}"):
+            self.assertFalse(self.executor._validate(command).shell)
+            result = asyncio.run(self.executor.execute_async(command))
+            self.assertNotEqual(result.returncode, 0)
+            self.assertNotIn("bin", result.stdout)
+
+
+if __name__ == "__main__":
+    unittest.main()
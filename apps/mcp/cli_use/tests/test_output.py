@@ -0,0 +1,133 @@
+import os
+import importlib
+import asyncio
+import tempfile
+import unittest
+from unittest import mock
+
+
+class TestOutputBuffer(unittest.TestCase):
+    def setUp(self):
+        # Importing the package loads the server, which needs an ALLOWED_DIR
+        os.environ.setdefault("ALLOWED_DIR", tempfile.gettempdir())
+        from cli_use import output
+
+        self.output = output
+
+    def test_small_output_stays_in_memory(self):
+        buffer = self.output.OutputBuffer(memory_limit=1024, spill_limit=4096, tail_size=8)
+        buffer.write(b"hello\n")
+        self.assertFalse(buffer.spilled)
+        self.assertEqual(buffer.text(), "hello\n")
+        self.assertEqual(buffer.preview(64), "hello\n")
+
+    def test_spills_to_disk_and_caps_size(self):
+        buffer = self.output.OutputBuffer(memory_limit=10, spill_limit=100, tail_size=8)
+        for _ in range(30):
+            buffer.write(b"0123456789")
+        self.assertTrue(buffer.spilled)
+        self.assertEqual(buffer.total_bytes, 300)
+        self.assertEqual(buffer.stored_bytes, 100)
+        self.assertEqual(buffer.dropped_bytes, 200)
+        self.assertEqual(buffer.read(95, 10), b"56789")
+        # The tail keeps the real end of the output even past the cap
+        preview = buffer.preview(16)
+        self.assertTrue(preview.startswith("01234567"))
+        self.assertTrue(preview.endswith("23456789"))
+        self.assertIn("[284 bytes omitted]", preview)
+        buffer.close()
+
+    def test_read_lines_uses_sparse_index(self):
+        buffer = self.output.OutputBuffer(memory_limit=1024, spill_limit=10 * 1024 * 1024)
+        lines = [f"line {i}\n".encode() for i in range(3 * self.output.LINE_INDEX_INTERVAL + 5)]
+        # Write in uneven chunks so lines straddle writes
+        data = b"".join(lines)
+        for start in range(0, len(data), 777):
+            buffer.write(data[start : start + 777])
+
+        page, count = buffer.read_lines(2 * self.output.LINE_INDEX_INTERVAL + 3, 2, 4096)
+        self.assertEqual(count, 2)
+        self.assertEqual(page, lines[2 * self.output.LINE_INDEX_INTERVAL + 3] + lines[2 * self.output.LINE_INDEX_INTERVAL + 4])
+        page, count = buffer.read_lines(len(lines) - 1, 10, 4096)
+        self.assertEqual((page, count), (lines[-1], 1))
+        self.assertEqual(buffer.read_lines(len(lines) + 1, 10, 4096), (b"", 0))
+        buffer.close()
+
+    def test_store_evicts_least_recently_used(self):
+        store = self.output.OutputStore(max_entries=2)
+        ids = [store.add({"stdout": self.output.OutputBuffer(16, 16)}) for _ in range(2)]
+        self.assertIsNotNone(store.get(ids[0], "stdout"))
+        store.add({"stdout": self.output.OutputBuffer(16, 16)})
+        self.assertIsNotNone(store.get(ids[0], "stdout"))
+        self.assertIsNone(store.get(ids[1], "stdout"))
+
+    def test_store_entries_belong_to_their_owner(self):
+        store = self.output.OutputStore()
+        output_id = store.add({"stdout": self.output.OutputBuffer(16, 16)}, owner="alice")
+        self.assertIsNotNone(store.get(output_id, "stdout", owner="alice"))
+        self.assertIsNone(store.get(output_id, "stdout", owner="bob"))
+        self.assertIsNone(store.get(output_id, "stdout"))
+
+
+class TestReadCommandOutput(unittest.TestCase):
+    def setUp(self):
+        os.environ["TEST_MODE"] = "true"
+        self.tempdir = tempfile.TemporaryDirectory()
+        os.environ["ALLOWED_DIR"] = self.tempdir.name
+        os.environ["ALLOWED_COMMANDS"] = "all"
+        os.environ["OUTPUT_MEMORY_LIMIT"] = "4096"
+        os.environ["OUTPUT_PREVIEW_BYTES"] = "1024"
+
+        import cli_use.server as server_module
+
+        self.server = importlib.reload(server_module)
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+        for name in ("TEST_MODE", "ALLOWED_COMMANDS", "OUTPUT_MEMORY_LIMIT", "OUTPUT_PREVIEW_BYTES"):
+            os.environ.pop(name, None)
+
+    def test_large_output_is_previewed_and_paged(self):
+        async def scenario():
+            result = await self.server.handle_call_tool("run_command", {"command": "seq 1 100000"})
+            note = next(tc.text for tc in result if "read_command_output" in tc.text)
+            output_id = note.split("output_id '")[1].split("'")[0]
+            lines = await self.server.handle_call_tool(
+                "read_command_output",
+                {"output_id": output_id, "start_line": 50000, "line_count": 2},
+            )
+            chunk = await self.server.handle_call_tool(
+                "read_command_output", {"output_id": output_id, "offset": 0, "length": 6}
+            )
+            return result, lines, chunk
+
+        result, lines, chunk = asyncio.run(scenario())
+        self.assertLess(len(result[0].text), 1200)
+        self.assertTrue(result[0].text.startswith("1\n2\n"))
+        self.assertTrue(result[0].text.endswith("99999\n100000\n"))
+        self.assertEqual(lines[0].text, "50001\n50002\n")
+        self.assertEqual(chunk[0].text, "1\n2\n3\n")
+        self.assertTrue(any("return code: 0" in tc.text for tc in result))
+
+    def test_output_of_other_sessions_is_not_found(self):
+        async def scenario():
+            result = await self.server.handle_call_tool("run_command", {"command": "seq 1 100000"})
+            note = next(tc.text for tc in result if "read_command_output" in tc.text)
+            output_id = note.split("output_id '")[1].split("'")[0]
+            with mock.patch.object(
+                self.server.SessionManager, "get_session_key", return_value="other"
+            ):
+                return output_id, await self.server.handle_call_tool(
+                    "read_command_output", {"output_id": output_id}
+                )
+
+        output_id, result = asyncio.run(scenario())
+        self.assertTrue(result[0].error)
+        self.assertEqual(
+            result[0].text,
+            f"No stdout output found for output_id '{output_id}'. It may have expired.",
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,117 @@
+import os
+import time
+import asyncio
+import importlib
+import tempfile
+import unittest
+from unittest import mock
+
+
+class TestPathResolver(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.root = os.path.realpath(self.tempdir.name)
+        os.environ["ALLOWED_DIR"] = self.root
+        import cli_use.paths as paths
+
+        self.paths = paths
+        os.makedirs(os.path.join(self.root, "src", "deep", "er"))
+        os.mkdir(os.path.join(self.root, "other"))
+        os.symlink(os.path.join(self.root, "src"), os.path.join(self.root, "link"))
+        os.symlink("deep/er", os.path.join(self.root, "src", "short"))
+        with open(os.path.join(self.root, "src", "deep", "er", "file"), "w") as f:
+            f.write("x")
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def settle(self):
+        # Directories changed within the racy interval are not cached
+        time.sleep(0.03)
+
+    def test_matches_realpath(self):
+        resolver = self.paths.PathResolver(self.root)
+        candidates = [
+            ".",
+            "..",
+            "src/deep/er/file",
+            "link/deep/er/file",
+            "link/short/file",
+            "link/short/../er/./file",
+            "src/missing/../deep",
+            "src/deep/er/file/..",
+            "link/",
+            "link",
+            self.root + "/link/short",
+            "/etc/passwd",
+        ]
+        with mock.patch.object(self.paths, "RACY_INTERVAL_NS", 20_000_000):
+            self.settle()
+            for _ in range(2):
+                for path in candidates:
+                    expected = os.path.abspath(os.path.realpath(os.path.join(self.root, path)))
+                    self.assertEqual(resolver.resolve(path), expected, path)
+        self.assertGreater(resolver.hits, 0)
+
+    def test_cached_directories_are_checked_without_watch(self):
+        resolver = self.paths.PathResolver(self.root)
+        with mock.patch.object(self.paths, "RACY_INTERVAL_NS", 20_000_000):
+            self.settle()
+            self.assertEqual(
+                resolver.resolve("link/short/file"),
+                os.path.join(self.root, "src", "deep", "er", "file"),
+            )
+            resolver.resolve("link/short/file")
+            self.assertEqual(resolver.stats()["hits"], 1)
+
+            os.remove(os.path.join(self.root, "src", "short"))
+            os.symlink("/", os.path.join(self.root, "src", "short"))
+            self.assertEqual(resolver.resolve("link/short/file"), "/file")
+
+    def test_watch_invalidates_before_the_next_lookup(self):
+        resolver = self.paths.PathResolver(self.root)
+
+        async def scenario():
+            resolver.start()
+            try:
+                self.assertTrue(resolver.watching)
+                resolver.resolve("link/deep/er/file")
+                resolver.resolve("link/deep/er/file")
+                os.remove(os.path.join(self.root, "link"))
+                os.symlink("/", os.path.join(self.root, "link"))
+                # No await in between, the event loop has not seen the change yet
+                return resolver.resolve("link/deep/er/file")
+            finally:
+                resolver.stop()
+
+        with mock.patch.object(self.paths, "RACY_INTERVAL_NS", 20_000_000):
+            self.settle()
+            resolved = asyncio.run(scenario())
+        self.assertEqual(resolved, "/deep/er/file")
+        self.assertEqual(resolver.hits, 1)
+        self.assertGreater(resolver.invalidations, 0)
+
+    def test_sibling_directories_are_outside(self):
+        allowed = os.path.join(self.root, "work")
+        sibling = os.path.join(self.root, "work2")
+        os.mkdir(allowed)
+        os.mkdir(sibling)
+        os.environ["ALLOWED_DIR"] = allowed
+        os.environ["ALLOWED_COMMANDS"] = "cat"
+        try:
+            import cli_use.server as server_module
+
+            server = importlib.reload(server_module)
+            for path in (os.path.join(sibling, "file"), "../work2/file"):
+                with self.assertRaisesRegex(server.CommandSecurityError, "outside of allowed"):
+                    server.executor.validate_command(f"cat {path}")
+            self.assertEqual(
+                server.executor.validate_command("cat ../work/file"),
+                ("cat", [os.path.join(allowed, "file")]),
+            )
+        finally:
+            os.environ.pop("ALLOWED_COMMANDS", None)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,83 @@
+import os
+import dataclasses
+import importlib
+import tempfile
+import unittest
+
+
+class TestSecurityPolicy(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        os.environ["ALLOWED_DIR"] = self.tempdir.name
+        os.environ["ALLOWED_COMMANDS"] = "ls,cat,echo"
+        os.environ["ALLOWED_FLAGS"] = "-l"
+        os.environ["ALLOW_SHELL_OPERATORS"] = "true"
+
+        import cli_use.server as server_module
+
+        self.server = importlib.reload(server_module)
+        self.executor = self.server.executor
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+        for name in ("ALLOWED_COMMANDS", "ALLOWED_FLAGS", "ALLOW_SHELL_OPERATORS"):
+            os.environ.pop(name, None)
+
+    def test_repeated_commands_hit_the_cache(self):
+        for _ in range(3):
+            self.assertEqual(self.executor.validate_command("ls -l"), ("ls", ["-l"]))
+        for _ in range(2):
+            with self.assertRaisesRegex(self.server.CommandSecurityError, "'rm' is not allowed"):
+                self.executor.validate_command("rm -l")
+
+        self.assertEqual(
+            self.executor.metrics()["validation_cache"], {"entries": 2, "hits": 3, "misses": 2}
+        )
+
+    def test_paths_are_resolved_on_every_use(self):
+        root = os.path.realpath(self.tempdir.name)
+        os.mkdir(os.path.join(root, "sub"))
+        link = os.path.join(root, "link")
+        os.symlink(os.path.join(root, "sub"), link)
+
+        self.assertEqual(
+            self.executor.validate_command("cat link/file"),
+            ("cat", [os.path.join(root, "sub", "file")]),
+        )
+        os.remove(link)
+        os.symlink("/", link)
+        with self.assertRaisesRegex(self.server.CommandSecurityError, "outside of allowed"):
+            self.executor.validate_command("cat link/file")
+        with self.assertRaisesRegex(self.server.CommandSecurityError, "Invalid command part 'cat link/file'"):
+            self.executor.validate_command("echo hi && cat link/file")
+
+    def test_operator_commands_keep_their_rules(self):
+        self.assertEqual(
+            self.executor.validate_command("ls -l | cat"), ("ls -l | cat", [])
+        )
+        with self.assertRaisesRegex(self.server.CommandSecurityError, "Invalid command part 'rm x'"):
+            self.executor.validate_command("ls && rm x")
+
+        self.executor.policy = dataclasses.replace(
+            self.executor.policy, allow_shell_operators=False
+        )
+        self.executor.verdicts.clear()
+        with self.assertRaisesRegex(self.server.CommandSecurityError, "Shell operator '\\|\\|'"):
+            self.executor.validate_command("ls || ls")
+
+    def test_least_recently_used_verdicts_are_evicted(self):
+        from cli_use.policy import VerdictCache
+
+        cache = VerdictCache(max_entries=2)
+        policy = self.executor.policy
+        for command in ("ls", "cat", "echo"):
+            cache.put(command, policy.check(command))
+            cache.get("ls")
+
+        self.assertIsNotNone(cache.get("ls"))
+        self.assertIsNone(cache.get("cat"))
+        self.assertIsNotNone(cache.get("echo"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,125 @@
+import os
+import json
+import asyncio
+import importlib
+import tempfile
+import unittest
+
+import anyio
+import mcp.types as types
+from mcp.client.session import ClientSession
+from mcp.shared.memory import create_client_server_memory_streams
+
+
+class TestPolicyReload(unittest.TestCase):
+    def setUp(self):
+        os.environ["TEST_MODE"] = "true"
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.policy_file = os.path.join(self.tempdir.name, "policy.json")
+        os.environ["ALLOWED_DIR"] = self.tempdir.name
+        os.environ["ALLOWED_COMMANDS"] = "ls,cat,echo"
+        os.environ["ALLOWED_FLAGS"] = "-l"
+        os.environ["SECURITY_POLICY_FILE"] = self.policy_file
+        os.environ["POLICY_RELOAD_INTERVAL"] = "0.05"
+        self.write_policy({"allowed_commands": ["ls"]})
+        self.reload()
+
+    def reload(self):
+        import cli_use.server as server_module
+
+        self.server = importlib.reload(server_module)
+        self.executor = self.server.executor
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+        for name in (
+            "TEST_MODE",
+            "ALLOWED_COMMANDS",
+            "ALLOWED_FLAGS",
+            "SECURITY_POLICY_FILE",
+            "POLICY_RELOAD_INTERVAL",
+        ):
+            os.environ.pop(name, None)
+
+    def write_policy(self, settings):
+        # Written next to the file and renamed, like editors and ConfigMaps do
+        with open(self.policy_file + ".tmp", "w") as f:
+            json.dump(settings, f)
+        os.replace(self.policy_file + ".tmp", self.policy_file)
+
+    def test_file_overrides_environment_and_reloads(self):
+        self.assertEqual(self.executor.validate_command("ls -l"), ("ls", ["-l"]))
+        with self.assertRaisesRegex(self.server.CommandSecurityError, "'cat' is not allowed"):
+            self.executor.validate_command("cat x")
+
+        self.write_policy({"allowed_commands": ["ls", "cat"], "allowed_flags": "all"})
+        self.assertTrue(self.executor.reload_policy())
+        self.assertEqual(self.executor.policy.version, 1)
+        self.assertEqual(self.executor.validate_command("cat -n x")[0], "cat")
+
+        # Unchanged settings are not a new version
+        self.write_policy({"allowed_flags": "all", "allowed_commands": ["cat", "ls"]})
+        self.assertFalse(self.executor.reload_policy())
+        self.assertEqual(self.executor.policy.version, 1)
+
+    def test_invalid_file_keeps_policy(self):
+        for settings in ({"allowed_commands": "ls"}, {"command_timeout": -1}, {"shell": True}):
+            self.write_policy(settings)
+            self.assertFalse(self.executor.reload_policy())
+        with open(self.policy_file, "w") as f:
+            f.write("{")
+        self.assertFalse(self.executor.reload_policy())
+
+        self.assertEqual(self.executor.policy.version, 0)
+        self.assertEqual(self.executor.metrics()["policy"]["failures"], 4)
+        self.assertEqual(self.executor.validate_command("ls"), ("ls", []))
+
+        with self.assertRaisesRegex(ValueError, "Cannot read policy file"):
+            self.server.CommandExecutor(self.tempdir.name, self.executor.base_config)
+
+    def test_clients_are_told_to_refetch_tools(self):
+        from cli_use.cancellation import serve
+
+        changed = asyncio.Event()
+
+        async def on_message(message):
+            if isinstance(message, types.ServerNotification) and isinstance(
+                message.root, types.ToolListChangedNotification
+            ):
+                changed.set()
+
+        async def scenario():
+            await self.executor.start()
+            try:
+                async with create_client_server_memory_streams() as (client_streams, server_streams):
+                    async with anyio.create_task_group() as tg:
+                        tg.start_soon(
+                            serve,
+                            self.server.server,
+                            server_streams[0],
+                            server_streams[1],
+                            self.server.server.create_initialization_options(),
+                        )
+                        async with ClientSession(*client_streams, message_handler=on_message) as client:
+                            await client.initialize()
+                            before = await client.list_tools()
+                            self.write_policy({"allowed_commands": ["ls", "echo"]})
+                            await asyncio.wait_for(changed.wait(), 5)
+                            after = await client.list_tools()
+                        tg.cancel_scope.cancel()
+                return before, after
+            finally:
+                await self.executor.close()
+
+        before, after = asyncio.run(scenario())
+
+        def description(tools):
+            return next(tool.description for tool in tools.tools if tool.name == "run_command")
+
+        self.assertNotIn("echo", description(before))
+        self.assertIn("echo", description(after))
+        self.assertEqual(self.executor.policy.version, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
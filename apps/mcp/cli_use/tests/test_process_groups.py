@@ -0,0 +1,161 @@
+import os
+import sys
+import time
+import signal
+import asyncio
+import importlib
+import subprocess
+import tempfile
+import unittest
+
+
+def process_gone(pid):
+    """True once pid exited, including when it is an unreaped zombie."""
+    try:
+        with open(f"/proc/{pid}/stat") as stat:
+            return stat.read().rsplit(")", 1)[1].split()[0] == "Z"
+    except FileNotFoundError:
+        return True
+
+
+class TestProcessGroups(unittest.TestCase):
+    def setUp(self):
+        os.environ["TEST_MODE"] = "true"
+        self.tempdir = tempfile.TemporaryDirectory()
+        os.environ["ALLOWED_DIR"] = self.tempdir.name
+        os.environ["ALLOWED_COMMANDS"] = "all"
+        os.environ["ALLOWED_FLAGS"] = "all"
+        os.environ["ALLOW_SHELL_OPERATORS"] = "true"
+        os.environ["COMMAND_TIMEOUT"] = "1"
+        os.environ["COMMAND_KILL_GRACE_PERIOD"] = "0.5"
+        self.reload()
+
+    def reload(self):
+        import cli_use.server as server_module
+
+        self.server = importlib.reload(server_module)
+        self.executor = self.server.executor
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+        for name in (
+            "TEST_MODE",
+            "ALLOWED_COMMANDS",
+            "ALLOWED_FLAGS",
+            "ALLOW_SHELL_OPERATORS",
+            "COMMAND_TIMEOUT",
+            "COMMAND_KILL_GRACE_PERIOD",
+            "SHELL_POOL_SIZE",
+        ):
+            os.environ.pop(name, None)
+
+    def run_with_executor(self, coro_factory):
+        async def run():
+            await self.executor.start()
+            try:
+                return await coro_factory()
+            finally:
+                await self.executor.close()
+
+        return asyncio.run(run())
+
+    def write_script(self, body):
+        with open(os.path.join(self.tempdir.name, "script.sh"), "w") as script:
+            script.write(body)
+
+    def background_pid(self):
+        with open(os.path.join(self.tempdir.name, "child.pid")) as pid_file:
+            return int(pid_file.read())
+
+    def wait_until_gone(self, pid, timeout=2):
+        deadline = time.monotonic() + timeout
+        while not process_gone(pid) and time.monotonic() < deadline:
+            time.sleep(0.05)
+        return process_gone(pid)
+
+    def test_timeout_kills_background_children(self):
+        self.write_script("sleep 30 &\necho $! > child.pid\nsleep 30\n")
+
+        async def scenario():
+            with self.assertRaises(self.server.CommandTimeoutError):
+                await self.executor.execute_async("sh script.sh")
+
+        self.run_with_executor(scenario)
+        self.assertTrue(self.wait_until_gone(self.background_pid()))
+        self.assertGreaterEqual(self.executor.sweeper.stats["groups_terminated"], 1)
+
+    def test_leftover_children_are_stopped_when_command_exits(self):
+        self.write_script("sleep 30 &\necho $! > child.pid\necho done\n")
+
+        async def scenario():
+            return await self.executor.execute_async("sh script.sh")
+
+        started = time.monotonic()
+        result = self.run_with_executor(scenario)
+        self.assertEqual(result.stdout, "done\n")
+        self.assertLess(time.monotonic() - started, 3)
+        self.assertTrue(self.wait_until_gone(self.background_pid()))
+
+    def test_shell_pool_timeout_kills_background_children(self):
+        os.environ["SHELL_POOL_SIZE"] = "1"
+        self.reload()
+        self.write_script("sleep 30 &\necho $! > child.pid\nsleep 30\n")
+
+        async def scenario():
+            with self.assertRaises(self.server.CommandTimeoutError):
+                await self.executor.execute_async("true && sh script.sh")
+            return await self.executor.execute_async("true && echo next")
+
+        result = self.run_with_executor(scenario)
+        self.assertEqual(result.stdout, "next\n")
+        self.assertTrue(self.wait_until_gone(self.background_pid()))
+
+    def test_sigterm_escalates_to_sigkill(self):
+        # Ignored signals stay ignored across exec, so sleep ignores SIGTERM too
+        self.write_script("trap '' TERM\nsleep 30\n")
+
+        async def scenario():
+            with self.assertRaises(self.server.CommandTimeoutError):
+                await self.executor.execute_async("sh script.sh")
+
+        started = time.monotonic()
+        self.run_with_executor(scenario)
+        self.assertLess(time.monotonic() - started, 5)
+        self.assertEqual(self.executor.sweeper.stats["sigkill_escalations"], 1)
+        self.assertIn("orphans_killed", self.executor.metrics()["processes"])
+
+
+class TestOrphanSweeper(unittest.TestCase):
+    def test_sweep_kills_only_processes_of_finished_commands(self):
+        from cli_use.process import COMMAND_MARKER_ENV, OrphanSweeper
+
+        sweeper = OrphanSweeper(interval=0)
+        finished = sweeper.register()
+        running = sweeper.register()
+        sweeper.unregister(finished)
+
+        def spawn(command_id):
+            environment = dict(os.environ, **{COMMAND_MARKER_ENV: command_id})
+            # A new session, like a daemon that escaped its command's group
+            return subprocess.Popen(
+                [sys.executable, "-c", "import time; time.sleep(30)"],
+                env=environment,
+                start_new_session=True,
+            )
+
+        orphan, active = spawn(finished), spawn(running)
+        try:
+            time.sleep(0.2)
+            self.assertEqual(sweeper.sweep(), 1)
+            self.assertEqual(orphan.wait(timeout=5), -signal.SIGKILL)
+            self.assertIsNone(active.poll())
+            self.assertEqual(sweeper.stats["orphans_killed"], 1)
+        finally:
+            orphan.kill()
+            active.kill()
+            orphan.wait()
+            active.wait()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,119 @@
+import os
+import sys
+import importlib
+import asyncio
+import tempfile
+import unittest
+
+BURN_CPU = f"{sys.executable} -c 'sum(range(20000000))'"
+
+
+class TestResourceAccounting(unittest.TestCase):
+    def setUp(self):
+        os.environ["TEST_MODE"] = "true"
+        self.tempdir = tempfile.TemporaryDirectory()
+        os.environ["ALLOWED_DIR"] = self.tempdir.name
+        os.environ["ALLOWED_COMMANDS"] = "all"
+        os.environ["ALLOWED_FLAGS"] = "all"
+        os.environ["ALLOW_SHELL_OPERATORS"] = "true"
+        self.reload()
+
+    def reload(self):
+        import cli_use.server as server_module
+
+        self.server = importlib.reload(server_module)
+        self.executor = self.server.executor
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+        for name in (
+            "TEST_MODE",
+            "ALLOWED_COMMANDS",
+            "ALLOWED_FLAGS",
+            "ALLOW_SHELL_OPERATORS",
+            "COMMAND_CPU_LIMIT",
+            "COMMAND_MAX_OPEN_FILES",
+            "SHELL_POOL_SIZE",
+        ):
+            os.environ.pop(name, None)
+
+    def run_with_executor(self, coro_factory):
+        async def run():
+            await self.executor.start()
+            try:
+                return await coro_factory()
+            finally:
+                await self.executor.close()
+
+        return asyncio.run(run())
+
+    def test_cpu_and_memory_are_reported(self):
+        allocate = f"{sys.executable} -c 'b = bytearray(400 * 1024 * 1024)'"
+
+        async def scenario():
+            return (
+                await self.executor.execute_async(BURN_CPU),
+                await self.executor.execute_async(allocate),
+            )
+
+        burn, allocate = self.run_with_executor(scenario)
+        self.assertGreaterEqual(burn.usage.user_time + burn.usage.system_time, 0.1)
+        self.assertGreaterEqual(burn.usage.wall_time, 0.1)
+        self.assertGreater(allocate.usage.max_rss_kb, 300 * 1024)
+
+        metrics = self.executor.metrics()
+        self.assertEqual(metrics["commands"]["commands"], 2)
+        # Only the program is named, since arguments may hold secrets
+        self.assertEqual(
+            metrics["most_expensive_commands"][0]["command"], os.path.basename(sys.executable)
+        )
+        self.assertEqual(self.server._command_name("TOKEN=s3cret /usr/bin/env x | y"), "env")
+
+    def test_usage_is_part_of_tool_result_on_request(self):
+        result = asyncio.run(
+            self.server.handle_call_tool("run_command", {"command": "echo hello"})
+        )
+        self.assertFalse(any(tc.text.startswith("Resources:") for tc in result))
+        result = asyncio.run(
+            self.server.handle_call_tool(
+                "run_command", {"command": "echo hello", "resources": True}
+            )
+        )
+        self.assertTrue(any(tc.text.startswith("Resources: wall") for tc in result))
+
+    def test_cpu_limit_kills_command(self):
+        os.environ["COMMAND_CPU_LIMIT"] = "1"
+        self.reload()
+        spin = f"{sys.executable} -c 'while True: pass'"
+
+        result = self.run_with_executor(lambda: self.executor.execute_async(spin))
+        self.assertLess(result.returncode, 0)
+        self.assertLess(result.usage.wall_time, 5)
+
+    def test_open_files_limit(self):
+        os.environ["COMMAND_MAX_OPEN_FILES"] = "16"
+        self.reload()
+        many_files = f"{sys.executable} -c '[__import__(\"os\").dup(0) for _ in range(64)]'"
+
+        result = self.run_with_executor(lambda: self.executor.execute_async(many_files))
+        self.assertNotEqual(result.returncode, 0)
+        self.assertIn("Too many open files", result.stderr)
+
+    def test_shell_pool_applies_limits_and_measures_cpu(self):
+        os.environ["COMMAND_MAX_OPEN_FILES"] = "16"
+        os.environ["SHELL_POOL_SIZE"] = "1"
+        self.reload()
+
+        async def scenario():
+            return (
+                await self.executor.execute_async("true && ulimit -n"),
+                await self.executor.execute_async(f"true && {BURN_CPU}"),
+            )
+
+        limit, burn = self.run_with_executor(scenario)
+        self.assertEqual(limit.stdout, "16\n")
+        self.assertGreaterEqual(burn.usage.user_time + burn.usage.system_time, 0.1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,141 @@
+import os
+import asyncio
+import tempfile
+import unittest
+
+
+class TestServingProfile(unittest.TestCase):
+    def setUp(self):
+        # Importing the package loads the server, which needs an ALLOWED_DIR
+        os.environ.setdefault("ALLOWED_DIR", tempfile.gettempdir())
+        import cli_use.serving as serving
+
+        self.serving = serving
+
+    def test_options_override_the_profile(self):
+        profile = self.serving.serving_profile("production", workers=3, loop=None, keep_alive=30)
+        self.assertEqual((profile.workers, profile.loop, profile.keep_alive), (3, "auto", 30))
+        self.assertFalse(profile.debug)
+        self.assertEqual(self.serving.serving_profile("development").workers, 1)
+
+
+class TestWorkerRouter(unittest.TestCase):
+    def setUp(self):
+        os.environ.setdefault("ALLOWED_DIR", tempfile.gettempdir())
+        import cli_use.serving as serving
+        from starlette.requests import Request
+        from starlette.responses import Response
+
+        self.serving = serving
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.received = []
+
+        def handler(worker):
+            async def handle_post_message(scope, receive, send):
+                body = await Request(scope, receive).body()
+                self.received.append((worker, scope["query_string"], body))
+                await Response("Accepted", status_code=202)(scope, receive, send)
+
+            return handle_post_message
+
+        self.routers = []
+        self.apps = []
+        for worker in ("1", "2"):
+            router = serving.WorkerRouter(self.tempdir.name)
+            router.worker = worker
+            self.routers.append(router)
+            self.apps.append(router.route_messages(handler(worker)))
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def test_messages_reach_the_worker_of_their_session(self):
+        import httpx
+
+        first, second = self.routers
+
+        async def scenario():
+            for router, app in zip(self.routers, self.apps):
+                await router.start(app)
+            try:
+                async with httpx.AsyncClient(
+                    transport=httpx.ASGITransport(app=self.apps[0]), base_url="http://test"
+                ) as client:
+                    local = await client.post("/messages/1/?session_id=a", content=b"{}")
+                    forwarded = await client.post(
+                        "/messages/2/?session_id=b", content=b'{"id": 1}'
+                    )
+                    unknown = await client.post("/messages/3/?session_id=c", content=b"{}")
+            finally:
+                for router in self.routers:
+                    await router.close()
+            return local, forwarded, unknown
+
+        local, forwarded, unknown = asyncio.run(scenario())
+        self.assertEqual((local.status_code, local.text), (202, "Accepted"))
+        self.assertEqual((forwarded.status_code, forwarded.text), (202, "Accepted"))
+        self.assertEqual(unknown.status_code, 404)
+        self.assertEqual(
+            self.received, [("1", b"session_id=a", b"{}"), ("2", b"session_id=b", b'{"id": 1}')]
+        )
+        self.assertEqual((first.forwarded, second.forwarded), (1, 0))
+        self.assertEqual(os.listdir(self.tempdir.name), [])
+
+    def test_only_workers_in_the_run_dir_are_forwarded_to(self):
+        import httpx
+
+        first, second = self.routers
+        outside = tempfile.TemporaryDirectory()
+        self.addCleanup(outside.cleanup)
+        # A socket outside of the run directory, and a file that is no socket
+        bystander = self.serving.WorkerRouter(outside.name)
+        bystander.worker = "9"
+        with open(os.path.join(self.tempdir.name, "7.sock"), "w"):
+            pass
+        escape = os.path.relpath(os.path.join(outside.name, "9"), self.tempdir.name)
+
+        async def forward(scope, receive, send):
+            await first.forward(scope["path"].strip("/").replace("|", "/"), scope, receive, send)
+
+        async def scenario():
+            await bystander.start(self.apps[1])
+            try:
+                async with httpx.AsyncClient(
+                    transport=httpx.ASGITransport(app=forward), base_url="http://test"
+                ) as client:
+                    return [
+                        (await client.post(f"/{worker.replace('/', '|')}", content=b"{}")).status_code
+                        for worker in (escape, "7", "2")
+                    ]
+            finally:
+                await bystander.close()
+
+        self.assertEqual(asyncio.run(scenario()), [404, 404, 404])
+        self.assertEqual(self.received, [])
+        self.assertEqual((first.forwarded, first._peers), (0, {}))
+
+    def test_oversized_bodies_are_refused(self):
+        import httpx
+
+        async def scenario():
+            for router, app in zip(self.routers, self.apps):
+                await router.start(app)
+            try:
+                async with httpx.AsyncClient(
+                    transport=httpx.ASGITransport(app=self.apps[0]), base_url="http://test"
+                ) as client:
+                    return await client.post(
+                        "/messages/2/?session_id=b", content=b"x" * (self.serving.MAX_MESSAGE_BYTES + 1)
+                    )
+            finally:
+                for router in self.routers:
+                    await router.close()
+
+        response = asyncio.run(scenario())
+        self.assertEqual(response.status_code, 413)
+        self.assertEqual(self.received, [])
+        self.assertEqual(self.routers[0].forwarded, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
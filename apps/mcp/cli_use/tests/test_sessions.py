@@ -0,0 +1,63 @@
+import os
+import tempfile
+import unittest
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestSessionStore(unittest.TestCase):
+    def setUp(self):
+        # Importing the package loads the server, which needs an ALLOWED_DIR
+        os.environ.setdefault("ALLOWED_DIR", tempfile.gettempdir())
+        from cli_use.sessions import SessionStore
+
+        self.clock = FakeClock()
+        self.store = SessionStore(idle_timeout=60, max_entries=3, clock=self.clock)
+
+    def test_use_slides_expiry_up_to_the_hard_limit(self):
+        self.store.add("a", hard_expiry=self.clock.now + 150)
+        for _ in range(2):
+            self.clock.now += 50
+            self.assertTrue(self.store.touch("a"))
+        # 100s in, the idle timeout would reach past the hard expiry
+        self.clock.now += 50
+        self.assertFalse(self.store.touch("a"))
+        self.assertEqual(self.store.stats(), {"live": 0, "expired": 1, "evicted": 0})
+
+    def test_idle_sessions_expire(self):
+        self.store.add("a")
+        self.store.add("b")
+        self.clock.now += 30
+        self.store.touch("b")
+        self.clock.now += 40
+        self.assertNotIn("a", self.store)
+        self.assertIn("b", self.store)
+        self.assertEqual(self.store.expire(), 1)
+        self.assertEqual(len(self.store), 1)
+
+    def test_least_recently_used_session_is_evicted(self):
+        for session_id in ("a", "b", "c"):
+            self.store.add(session_id)
+        self.store.touch("a")
+        self.store.add("d")
+        self.assertEqual([s for s in "abcd" if s in self.store], ["a", "c", "d"])
+        self.assertEqual(self.store.stats()["evicted"], 1)
+
+    def test_renewals_do_not_grow_the_heap(self):
+        self.store.add("a")
+        for _ in range(1000):
+            self.clock.now += 1
+            self.store.touch("a")
+        self.assertLess(len(self.store._expiries), 100)
+        self.store.discard("a")
+        self.assertFalse(self.store.touch("a"))
+
+
+if __name__ == "__main__":
+    unittest.main()
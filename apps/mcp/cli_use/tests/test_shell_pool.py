@@ -0,0 +1,165 @@
+import os
+import importlib
+import asyncio
+import tempfile
+import unittest
+
+
+class TestShellWorkerPool(unittest.TestCase):
+    def setUp(self):
+        os.environ["TEST_MODE"] = "true"
+        self.tempdir = tempfile.TemporaryDirectory()
+        os.environ["ALLOWED_DIR"] = self.tempdir.name
+        os.environ["ALLOWED_COMMANDS"] = "all"
+        os.environ["ALLOWED_FLAGS"] = "all"
+        os.environ["ALLOW_SHELL_OPERATORS"] = "true"
+        os.environ["SHELL_POOL_SIZE"] = "2"
+        os.environ["SHELL_POOL_MAX_COMMANDS"] = "3"
+
+        import cli_use.server as server_module
+
+        self.server = importlib.reload(server_module)
+        self.executor = self.server.executor
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+        for name in (
+            "TEST_MODE",
+            "ALLOWED_COMMANDS",
+            "ALLOWED_FLAGS",
+            "ALLOW_SHELL_OPERATORS",
+            "SHELL_POOL_SIZE",
+            "SHELL_POOL_MAX_COMMANDS",
+            "COMMAND_TIMEOUT",
+        ):
+            os.environ.pop(name, None)
+
+    def run_with_executor(self, coro_factory):
+        async def run():
+            await self.executor.start()
+            try:
+                return await coro_factory()
+            finally:
+                await self.executor.close()
+
+        return asyncio.run(run())
+
+    def test_commands_are_isolated(self):
+        async def scenario():
+            first = await self.executor.execute_async("mkdir sub && cd sub && pwd && echo err >&2")
+            # Operators keep these commands off the direct exec path
+            second = await self.executor.execute_async("true && pwd")
+            failed = await self.executor.execute_async("true && sh -c 'exit 4'")
+            return first, second, failed
+
+        first, second, failed = self.run_with_executor(scenario)
+        self.assertEqual(
+            os.path.realpath(first.stdout.strip()),
+            os.path.realpath(os.path.join(self.tempdir.name, "sub")),
+        )
+        self.assertEqual(first.stderr, "err\n")
+        self.assertEqual(first.returncode, 0)
+        # The cd of the previous command must not leak into the next one
+        self.assertEqual(
+            os.path.realpath(second.stdout.strip()), os.path.realpath(self.tempdir.name)
+        )
+        self.assertEqual(failed.returncode, 4)
+
+    def test_output_without_trailing_newline_and_streaming(self):
+        chunks = []
+
+        async def on_output(stream, text):
+            chunks.append((stream, text))
+
+        async def scenario():
+            return await self.executor.execute_async("true && printf abc", on_output=on_output)
+
+        result = self.run_with_executor(scenario)
+        self.assertEqual(result.stdout, "abc")
+        self.assertEqual("".join(text for _, text in chunks), "abc")
+
+    def test_workers_are_recycled(self):
+        async def scenario():
+            for _ in range(8):
+                result = await self.executor.execute_async("true && echo ok")
+                self.assertEqual(result.stdout, "ok\n")
+            # Let background replacements finish
+            await asyncio.sleep(0.5)
+            return self.executor.shell_pool.workers_started
+
+        workers_started = self.run_with_executor(scenario)
+        self.assertGreater(workers_started, 2)
+
+    def test_crashed_worker_is_replaced(self):
+        async def scenario():
+            with self.assertRaises(self.server.CommandExecutionError):
+                # $$ is the worker shell itself
+                await self.executor.execute_async("true && kill -9 $$")
+            return await self.executor.execute_async("true && echo alive")
+
+        result = self.run_with_executor(scenario)
+        self.assertEqual(result.stdout, "alive\n")
+
+    def test_timeout_kills_worker(self):
+        os.environ["COMMAND_TIMEOUT"] = "1"
+        import cli_use.server as server_module
+
+        self.server = importlib.reload(server_module)
+        self.executor = self.server.executor
+
+        async def scenario():
+            with self.assertRaises(self.server.CommandTimeoutError):
+                await self.executor.execute_async("true && sleep 5")
+            return await self.executor.execute_async("true && echo after")
+
+        result = self.run_with_executor(scenario)
+        self.assertEqual(result.stdout, "after\n")
+
+    def test_cancelled_command_does_not_return_dead_worker(self):
+        async def scenario():
+            task = asyncio.ensure_future(self.executor.execute_async("true && sleep 5"))
+            await asyncio.sleep(0.5)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+            # Both workers, including the one being replaced, must serve commands
+            results = await asyncio.gather(
+                *(self.executor.execute_async("true && echo after") for _ in range(4))
+            )
+            return results
+
+        for result in self.run_with_executor(scenario):
+            self.assertEqual(result.stdout, "after\n")
+
+    def test_failed_replacement_does_not_hang_callers(self):
+        from cli_use.shell_pool import ShellWorkerError, ShellWorkerPool
+
+        pool = ShellWorkerPool(["bash"], self.tempdir.name, size=1)
+
+        async def scenario():
+            await pool.start()
+            try:
+                task = asyncio.ensure_future(pool.run("sleep 5", 10, _Sink(), _Sink()))
+                await asyncio.sleep(0.2)
+                # The replacement cannot start
+                pool.shell_args = [os.path.join(self.tempdir.name, "missing-shell")]
+                task.cancel()
+                with self.assertRaises(asyncio.CancelledError):
+                    await task
+                await asyncio.sleep(0.2)
+                with self.assertRaisesRegex(ShellWorkerError, "last start failed"):
+                    await asyncio.wait_for(pool.run("echo hi", 1, _Sink(), _Sink()), 5)
+            finally:
+                await pool.close()
+
+        asyncio.run(scenario())
+        self.assertEqual(pool.spawn_failures, 1)
+
+
+class _Sink:
+    def write(self, data):
+        pass
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,149 @@
+import os
+import sys
+import time
+import asyncio
+import importlib
+import sqlite3
+import subprocess
+import tempfile
+import unittest
+
+SRC = os.path.join(os.path.dirname(__file__), "..", "src")
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestSQLiteStateBackend(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tempdir.name, "state.sqlite3")
+        os.environ["ALLOWED_DIR"] = self.tempdir.name
+        os.environ["TEST_MODE"] = "true"
+        os.environ["STATE_BACKEND"] = "sqlite"
+        os.environ["STATE_DB_PATH"] = self.path
+
+        import cli_use.server as server_module
+
+        self.server = importlib.reload(server_module)
+        self.state = importlib.import_module("cli_use.state")
+
+    def tearDown(self):
+        self.server.state_backend.close()
+        self.tempdir.cleanup()
+        for name in ("TEST_MODE", "STATE_BACKEND", "STATE_DB_PATH"):
+            os.environ.pop(name, None)
+
+    def backend(self, clock=None, max_sessions=3):
+        return self.state.SQLiteStateBackend(
+            self.path, idle_timeout=60, max_sessions=max_sessions, clock=clock or time.time
+        )
+
+    def test_database_uses_wal(self):
+        (mode,) = sqlite3.connect(self.path).execute("PRAGMA journal_mode").fetchone()
+        self.assertEqual(mode, "wal")
+
+    def test_sessions_follow_the_session_store_rules(self):
+        clock = FakeClock()
+        first, second = self.backend(clock), self.backend(clock)
+        first.add_session("a", hard_expiry=clock.now + 100)
+        first.add_session("b")
+        first.add_session("c")
+        clock.now += 50
+        self.assertTrue(second.touch_session("a"))
+        self.assertTrue(second.touch_session("b"))
+        second.add_session("d")
+        # c was used least recently
+        self.assertFalse(first.touch_session("c"))
+        clock.now += 55
+        self.assertFalse(first.touch_session("a"))
+        self.assertTrue(first.touch_session("b"))
+        second.discard_session("b")
+        self.assertFalse(first.touch_session("b"))
+        self.assertEqual(first.session_stats(), {"live": 1, "expired": 1, "evicted": 1})
+
+    def test_sessions_are_shared_between_processes(self):
+        self.server.SessionManager.authenticate_session("from-parent")
+        script = (
+            "import sys; sys.path.insert(0, sys.argv[1]);"
+            "from cli_use.state import SQLiteStateBackend;"
+            "state = SQLiteStateBackend(sys.argv[2]);"
+            "print(state.touch_session('from-parent'));"
+            "state.add_session('from-child')"
+        )
+        child = subprocess.run(
+            [sys.executable, "-c", script, SRC, self.path],
+            capture_output=True,
+            text=True,
+            env={**os.environ, "PYTHONPATH": SRC},
+        )
+        self.assertEqual(child.stdout.strip(), "True", child.stderr)
+        self.assertTrue(self.server.SessionManager.is_authenticated("from-child"))
+
+    def test_jobs_of_other_workers_are_listed(self):
+        executor = self.server.executor
+        other = self.backend()
+        sleeper = subprocess.Popen(["sleep", "30"])
+        exited = subprocess.Popen(["true"])
+        exited.wait()
+        try:
+            for job_id, worker in (("alive", sleeper.pid), ("gone", exited.pid)):
+                other.put_job(
+                    self.state.JobRecord(
+                        job_id=job_id,
+                        owner="local",
+                        worker=worker,
+                        command="sleep 30",
+                        status="running",
+                        started_at=time.time(),
+                    )
+                )
+
+            async def scenario():
+                await executor.start()
+                try:
+                    job = executor.jobs.start("local", "pwd")
+                    await job.task
+                    return (
+                        executor.jobs.summaries("local"),
+                        await self.server.handle_call_tool("job_output", {"job_id": "alive"}),
+                    )
+                finally:
+                    await executor.close()
+
+            summaries, output = asyncio.run(scenario())
+        finally:
+            sleeper.kill()
+            sleeper.wait()
+
+        self.assertEqual(len(summaries), 3)
+        self.assertIn("running", summaries[0])
+        self.assertIn(f"Worker: {sleeper.pid}", summaries[0])
+        self.assertIn(f"Worker {exited.pid} exited", summaries[1])
+        self.assertIn("finished (return code 0)", summaries[2])
+        self.assertIn(f"belongs to worker {sleeper.pid}", output[0].text)
+        # Jobs of a worker that shuts down go with it
+        self.assertEqual([r.job_id for r in other.list_jobs("local")], ["alive", "gone"])
+
+    def test_unknown_backend_is_rejected(self):
+        with self.assertRaisesRegex(self.state.StateError, "Unknown state backend"):
+            self.state.create_state_backend("redis")
+        with self.assertRaisesRegex(self.state.StateError, "STATE_DB_PATH"):
+            self.state.create_state_backend("sqlite")
+
+    def test_backends_must_implement_every_operation(self):
+        class Partial(self.state.StateBackend):
+            def add_session(self, session_id, hard_expiry=None):
+                pass
+
+        with self.assertRaises(TypeError):
+            Partial()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,105 @@
+import os
+import sys
+import json
+import tempfile
+import subprocess
+import unittest
+from unittest import mock
+
+SRC = os.path.join(os.path.dirname(__file__), "..", "src")
+
+
+class TestSplitMessages(unittest.TestCase):
+    def setUp(self):
+        # Importing the package loads the server, which needs an ALLOWED_DIR
+        os.environ.setdefault("ALLOWED_DIR", tempfile.gettempdir())
+        import cli_use.stdio as stdio
+
+        self.stdio = stdio
+
+    def test_lines_split_across_chunks(self):
+        buffer = bytearray()
+        self.assertEqual(self.stdio.split_messages(buffer, b'{"a": 1}\n{"b"'), [b'{"a": 1}'])
+        self.assertEqual(self.stdio.split_messages(buffer, b": 2"), [])
+        self.assertEqual(
+            self.stdio.split_messages(buffer, b"}\n\n{}\r\n{"), [b'{"b": 2}', b"{}\r"]
+        )
+        self.assertEqual(bytes(buffer), b"{")
+
+    def test_oversized_message_is_dropped(self):
+        buffer = bytearray()
+        with mock.patch.object(self.stdio, "MAX_MESSAGE_BYTES", 8):
+            with self.assertRaisesRegex(ValueError, "exceeds 8 bytes"):
+                self.stdio.split_messages(buffer, b"0123456789")
+        self.assertEqual(self.stdio.split_messages(buffer, b"{}\n"), [b"{}"])
+
+
+class TestStdioServer(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def test_burst_of_requests_over_pipes(self):
+        requests = [
+            {
+                "jsonrpc": "2.0",
+                "id": 0,
+                "method": "initialize",
+                "params": {
+                    "protocolVersion": "2024-11-05",
+                    "capabilities": {},
+                    "clientInfo": {"name": "test", "version": "1"},
+                },
+            },
+            {"jsonrpc": "2.0", "method": "notifications/initialized"},
+        ]
+        requests += [{"jsonrpc": "2.0", "id": i, "method": "tools/list"} for i in range(1, 50)]
+        requests.append(
+            {
+                "jsonrpc": "2.0",
+                "id": 50,
+                "method": "tools/call",
+                "params": {"name": "run_command", "arguments": {"command": "pwd"}},
+            }
+        )
+        child = subprocess.Popen(
+            [sys.executable, "-m", "cli_use.cli", "start"],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            env={
+                **os.environ,
+                "PYTHONPATH": SRC,
+                "ALLOWED_DIR": self.tempdir.name,
+                "TEST_MODE": "true",
+            },
+        )
+        try:
+            child.stdin.write(b"".join(json.dumps(r).encode() + b"\n" for r in requests))
+            child.stdin.flush()
+            responses = {}
+            while 50 not in responses:
+                line = child.stdout.readline()
+                self.assertTrue(line, "server closed stdout")
+                message = json.loads(line)
+                if "id" in message:
+                    responses[message["id"]] = message
+            # The server exits once the client closes stdin
+            child.stdin.close()
+            self.assertEqual(child.wait(timeout=10), 0)
+        finally:
+            if child.poll() is None:
+                child.kill()
+                child.wait()
+
+        self.assertEqual(sorted(responses), list(range(51)))
+        self.assertIn("run_command", json.dumps(responses[1]["result"]))
+        self.assertIn(
+            os.path.realpath(self.tempdir.name), responses[50]["result"]["content"][0]["text"]
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,198 @@
+import os
+import re
+import sys
+import json
+import time
+import socket
+import tempfile
+import subprocess
+import http.client
+import unittest
+
+SRC = os.path.join(os.path.dirname(__file__), "..", "src")
+
+POST_HEADERS = {"Accept": "application/json, text/event-stream", "Content-Type": "application/json"}
+
+
+def read_events(response):
+    """Parses a text/event-stream response into (id, data) pairs."""
+    events = []
+    event = {}
+    for raw in response:
+        line = raw.decode().rstrip("\r\n")
+        if not line:
+            if event:
+                events.append((event.get("id"), event.get("data")))
+                event = {}
+        elif not line.startswith(":"):
+            field, _, value = line.partition(":")
+            event[field] = value[1:] if value.startswith(" ") else value
+    return events
+
+
+class TestEventBuffer(unittest.TestCase):
+    def setUp(self):
+        # Importing the package loads the server, which needs an ALLOWED_DIR
+        os.environ.setdefault("ALLOWED_DIR", tempfile.gettempdir())
+        import cli_use.streamable_http as streamable_http
+
+        self.streamable_http = streamable_http
+
+    def test_replay_returns_later_events_of_the_same_stream(self):
+        buffer = self.streamable_http.EventBuffer(max_events=4)
+        for stream, data in [("1", b""), ("standalone", b"a"), ("1", b"b"), ("2", b"c")]:
+            buffer.append(stream, data)
+        self.assertEqual(buffer.replay(1), ("1", [(3, b"b")]))
+        self.assertEqual(buffer.replay(4), ("2", []))
+
+        buffer.append("1", b"d")
+        # The oldest event was dropped to make room
+        with self.assertRaises(KeyError):
+            buffer.replay(1)
+        with self.assertRaises(KeyError):
+            buffer.replay(6)
+        self.assertEqual(buffer.replay(3), ("1", [(5, b"d")]))
+
+
+class TestStreamableHTTPServer(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            self.port = sock.getsockname()[1]
+        self.child = subprocess.Popen(
+            [sys.executable, "-m", "cli_use.cli", "start", "--transport", "streamable-http",
+             "--host", "127.0.0.1", "--port", str(self.port)],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            env={
+                **os.environ,
+                "PYTHONPATH": SRC,
+                "ALLOWED_DIR": self.tempdir.name,
+                "ALLOWED_COMMANDS": "sleep,pwd",
+                "TEST_MODE": "true",
+            },
+        )
+        deadline = time.monotonic() + 30
+        while True:
+            try:
+                connection = http.client.HTTPConnection("127.0.0.1", self.port, timeout=1)
+                connection.request("GET", "/health")
+                connection.getresponse().read()
+                connection.close()
+                break
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.2)
+
+    def tearDown(self):
+        self.child.terminate()
+        self.child.wait(timeout=30)
+        self.tempdir.cleanup()
+
+    def post(self, connection, message, session_id=None):
+        headers = dict(POST_HEADERS)
+        if session_id:
+            headers["Mcp-Session-Id"] = session_id
+        connection.request("POST", "/mcp", json.dumps(message), headers)
+        return connection.getresponse()
+
+    def test_session_survives_a_dropped_stream(self):
+        connection = http.client.HTTPConnection("127.0.0.1", self.port, timeout=30)
+        response = self.post(
+            connection,
+            {
+                "jsonrpc": "2.0",
+                "id": 0,
+                "method": "initialize",
+                "params": {
+                    "protocolVersion": "2025-03-26",
+                    "capabilities": {},
+                    "clientInfo": {"name": "test", "version": "1"},
+                },
+            },
+        )
+        session_id = response.getheader("Mcp-Session-Id")
+        self.assertEqual(response.getheader("Transfer-Encoding"), "chunked")
+        events = read_events(response)
+        # The stream starts with an event to resume from, then the response
+        self.assertEqual(events[0], ("1", ""))
+        self.assertEqual(json.loads(events[1][1])["id"], 0)
+
+        sock = connection.sock
+        response = self.post(
+            connection, {"jsonrpc": "2.0", "method": "notifications/initialized"}, session_id
+        )
+        response.read()
+        self.assertEqual(response.status, 202)
+        response = self.post(
+            connection,
+            [
+                {"jsonrpc": "2.0", "id": 1, "method": "tools/list"},
+                {"jsonrpc": "2.0", "id": 2, "method": "ping"},
+            ],
+            session_id,
+        )
+        responses = [json.loads(data) for _, data in read_events(response) if data]
+        self.assertEqual(sorted(r["id"] for r in responses), [1, 2])
+        # Requests and their streams share one keep-alive connection
+        self.assertIs(connection.sock, sock)
+
+        # The connection drops while the command runs
+        dropped = http.client.HTTPConnection("127.0.0.1", self.port, timeout=30)
+        response = self.post(
+            dropped,
+            {
+                "jsonrpc": "2.0",
+                "id": 3,
+                "method": "tools/call",
+                "params": {"name": "run_command", "arguments": {"command": "sleep 1"}},
+            },
+            session_id,
+        )
+        first = b""
+        while not first.endswith(b"\n\n"):
+            first += response.fp.read(1)
+        last_event_id = re.search(rb"id: (\d+)", first).group(1).decode()
+        dropped.sock.shutdown(socket.SHUT_RDWR)
+        dropped.close()
+
+        connection.request(
+            "GET",
+            "/mcp",
+            headers={
+                "Accept": "text/event-stream",
+                "Mcp-Session-Id": session_id,
+                "Last-Event-ID": last_event_id,
+            },
+        )
+        events = read_events(connection.getresponse())
+        self.assertEqual(len(events), 1)
+        result = json.loads(events[0][1])
+        self.assertEqual(result["id"], 3)
+        self.assertIn("return code: 0", json.dumps(result["result"]))
+
+        connection.request(
+            "GET",
+            "/mcp",
+            headers={
+                "Accept": "text/event-stream",
+                "Mcp-Session-Id": session_id,
+                "Last-Event-ID": "1000",
+            },
+        )
+        response = connection.getresponse()
+        response.read()
+        self.assertEqual(response.status, 400)
+
+        connection.request("DELETE", "/mcp", headers={"Mcp-Session-Id": session_id})
+        connection.getresponse().read()
+        response = self.post(connection, {"jsonrpc": "2.0", "id": 4, "method": "ping"}, session_id)
+        response.read()
+        self.assertEqual(response.status, 404)
+        connection.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
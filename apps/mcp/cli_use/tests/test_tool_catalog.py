@@ -0,0 +1,61 @@
+import os
+import asyncio
+import dataclasses
+import importlib
+import tempfile
+import unittest
+
+
+class TestToolCatalog(unittest.TestCase):
+    def setUp(self):
+        os.environ["TEST_MODE"] = "true"
+        self.tempdir = tempfile.TemporaryDirectory()
+        os.environ["ALLOWED_DIR"] = self.tempdir.name
+        os.environ["ALLOWED_COMMANDS"] = "ls,cat"
+        os.environ["ALLOWED_FLAGS"] = "-l,-a"
+
+        import cli_use.server as server_module
+
+        self.server = importlib.reload(server_module)
+        self.executor = self.server.executor
+        self.catalog = self.server.tool_catalog
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+        for name in ("TEST_MODE", "ALLOWED_COMMANDS", "ALLOWED_FLAGS"):
+            os.environ.pop(name, None)
+
+    def run_command_description(self):
+        tools = asyncio.run(self.server.handle_list_tools())
+        return next(tool.description for tool in tools if tool.name == "run_command")
+
+    def test_tools_are_rendered_once_per_policy(self):
+        first = self.run_command_description()
+        self.assertEqual(first, self.run_command_description())
+        self.assertIn("Available commands: cat, ls\n", first)
+        self.assertEqual((self.catalog.renders, self.catalog.hits), (1, 1))
+
+        self.executor.security_config = dataclasses.replace(
+            self.executor.security_config, allowed_commands={"ls", "cat", "git"}
+        )
+        self.executor.policy = self.server.SecurityPolicy.compile(
+            self.executor.allowed_dir, self.executor.security_config, version=1
+        )
+        self.assertIn("Available commands: cat, git, ls\n", self.run_command_description())
+        self.assertEqual(self.catalog.renders, 2)
+
+    def test_security_rules_are_cached(self):
+        def rules():
+            result = asyncio.run(self.server.handle_call_tool("show_security_rules", {}))
+            return result[0].text
+
+        first = rules()
+        self.assertEqual(first, rules())
+        self.assertIn("Session ID: None\n", first)
+        self.assertIn("-a, -l\n", first)
+        self.assertIn("Policy Version: 0\n", first)
+        self.assertEqual((self.catalog.renders, self.catalog.hits), (1, 1))
+
+
+if __name__ == "__main__":
+    unittest.main()